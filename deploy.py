@@ -14,6 +14,9 @@ class DeploymentManager:
         self.app_dir = Path(app_dir)
         self.venv_dir = self.app_dir / "venv"
         self.backup_dir = Path("/home/appuser/backups")
+        self.benchmark_baseline = Path(
+            os.environ.get('BENCHMARK_BASELINE', self.app_dir / "benchmarks" / "baseline.json")
+        )
         
     def run_command(self, command, check=True, shell=True):
         """コマンドを実行してログに記録"""
@@ -30,30 +33,38 @@ class DeploymentManager:
             
         return result
     
-    def backup_database(self):
+    def backup_timestamp(self):
+        """デプロイ前のバックアップに付けるタイムスタンプ（rollback に指定する）"""
+        return subprocess.check_output("date +%Y%m%d_%H%M%S", shell=True, text=True).strip()
+    
+    def db_backup_id_file(self, timestamp):
+        """デプロイ前に取得したデータベースバックアップの ID を記録するファイル"""
+        return self.backup_dir / f"db_backup_before_deploy_{timestamp}.id"
+    
+    def run_db_optimizer(self, args):
+        """バックアップの保存先を指定して db_optimizer.py を実行する"""
+        python_cmd = f"{self.venv_dir}/bin/python"
+        optimizer_script = self.app_dir / "python" / "db_optimizer.py"
+        backup_store = self.backup_dir / "database"
+        
+        # SQLite の相対パスはアプリの起動ディレクトリ基準のため、app_dir で実行する
+        return self.run_command(f"cd {self.app_dir} && BACKUP_DIR={backup_store} {python_cmd} {optimizer_script} {args}")
+    
+    def backup_database(self, timestamp):
         """データベースをバックアップ"""
         logger.info("データベースバックアップを開始")
         
-        timestamp = subprocess.check_output("date +%Y%m%d_%H%M%S", shell=True, text=True).strip()
-        backup_file = self.backup_dir / f"db_backup_before_deploy_{timestamp}.sql"
-        
-        # PostgreSQLの場合
-        if os.environ.get('DATABASE_URL', '').startswith('postgresql'):
-            db_url = os.environ.get('DATABASE_URL')
-            self.run_command(f"pg_dump '{db_url}' > {backup_file}")
-        # SQLiteの場合
-        else:
-            db_file = self.app_dir / "database.db"
-            if db_file.exists():
-                self.run_command(f"cp {db_file} {backup_file.with_suffix('.db')}")
+        # 稼働中のままオンラインバックアップ（変更のないチャンクは前回分を再利用）
+        # 取得したバックアップの ID は rollback で復元できるようタイムスタンプごとに記録する
+        id_file = self.db_backup_id_file(timestamp)
+        self.run_db_optimizer(f"backup --id-file {id_file}")
                 
-        logger.info(f"データベースバックアップ完了: {backup_file}")
+        logger.info(f"データベースバックアップ完了: {id_file.read_text().strip()}")
     
-    def backup_application(self):
+    def backup_application(self, timestamp):
         """アプリケーションファイルをバックアップ"""
         logger.info("アプリケーションバックアップを開始")
         
-        timestamp = subprocess.check_output("date +%Y%m%d_%H%M%S", shell=True, text=True).strip()
         backup_file = self.backup_dir / f"app_backup_before_deploy_{timestamp}.tar.gz"
         
         # 重要なファイルのみバックアップ（venvは除外）
@@ -75,6 +86,18 @@ class DeploymentManager:
         
         logger.info("コード更新完了")
     
+    def current_commit(self):
+        """現在チェックアウトしているコミット"""
+        return self.run_command(f"git -C {self.app_dir} rev-parse HEAD").stdout.strip()
+    
+    def revert_code(self, commit):
+        """コードを指定したコミットに戻す（反映前に中止したデプロイの取り消し用）"""
+        logger.info(f"コードを元に戻します: {commit}")
+        
+        self.run_command(f"git -C {self.app_dir} reset --hard {commit}")
+        
+        logger.info("コードを元に戻しました")
+    
     def update_dependencies(self):
         """依存関係を更新"""
         logger.info("依存関係の更新を開始")
@@ -95,15 +118,10 @@ class DeploymentManager:
         
         python_cmd = f"{self.venv_dir}/bin/python"
         
-        # テーブル作成/更新
-        migration_script = """
-from app import app, db
-app.app_context().push()
-db.create_all()
-print("データベース更新完了")
-"""
+        migration_script = self.app_dir / "python" / "db_migration.py"
         
-        self.run_command(f"echo '{migration_script}' | {python_cmd}")
+        # 未適用のバージョン付きマイグレーションを適用（インデックスは CONCURRENTLY で作成）
+        self.run_command(f"{python_cmd} {migration_script} upgrade")
         
         logger.info("データベースマイグレーション完了")
     
@@ -113,20 +131,38 @@ print("データベース更新完了")
         
         python_cmd = f"{self.venv_dir}/bin/python"
         
-        optimization_script = """
-from db_optimizer import DatabaseOptimizer
-try:
-    DatabaseOptimizer.optimize_indexes()
-    DatabaseOptimizer.update_statistics()
-    print("データベース最適化完了")
-except Exception as e:
-    print(f"最適化エラー: {e}")
-"""
+        optimizer_script = self.app_dir / "python" / "db_optimizer.py"
         
-        self.run_command(f"echo '{optimization_script}' | {python_cmd}")
+        # 不足インデックスの作成（PostgreSQL は CONCURRENTLY）と更新量に応じた VACUUM / ANALYZE
+        # バックアップは backup_database で取得済み
+        result = self.run_command(
+            f"{python_cmd} {optimizer_script} maintain --create-indexes --no-backup",
+            check=False,
+        )
+        if result.returncode != 0:
+            logger.warning("データベース最適化に失敗しました")
         
         logger.info("データベース最適化完了")
     
+    def run_benchmark_gate(self):
+        """ベンチマークを実行し、ベースライン・ルート予算と比較する（デプロイ前チェック）"""
+        logger.info("ベンチマークによる性能回帰チェックを開始")
+        
+        python_cmd = f"{self.venv_dir}/bin/python"
+        benchmark_script = self.app_dir / "python" / "benchmark.py"
+        
+        # 一時 SQLite DB で計測するため DATABASE_URL は渡さない
+        result = self.run_command(
+            f"env -u DATABASE_URL {python_cmd} {benchmark_script} gate --baseline {self.benchmark_baseline}",
+            check=False,
+        )
+        if result.returncode != 0:
+            logger.error("性能回帰を検出しました")
+            return False
+        
+        logger.info("性能回帰チェック完了")
+        return True
+    
     def restart_application(self):
         """アプリケーションを再起動"""
         logger.info("アプリケーション再起動を開始")
@@ -161,22 +197,33 @@ except Exception as e:
         logger.error("ヘルスチェックが失敗しました")
         return False
     
-    def deploy(self, branch="main", skip_backup=False):
+    def deploy(self, branch="main", skip_backup=False, benchmark_gate=False):
         """完全なデプロイメントプロセスを実行"""
         try:
             logger.info("=== デプロイメント開始 ===")
             
             # バックアップの作成
             if not skip_backup:
-                self.backup_database()
-                self.backup_application()
+                timestamp = self.backup_timestamp()
+                self.backup_database(timestamp)
+                self.backup_application(timestamp)
+                logger.info(f"ロールバック用タイムスタンプ: {timestamp}")
             
             # コードの更新
+            previous_commit = self.current_commit()
             self.update_code(branch)
             
             # 依存関係の更新
             self.update_dependencies()
             
+            # 性能回帰チェック（オプション）：新しいコードで計測し、回帰があれば再起動の前に中止する
+            # 取得したコードと依存関係は元のコミットの状態に戻す（稼働中のアプリは古いコードのまま）
+            if benchmark_gate and not self.run_benchmark_gate():
+                self.revert_code(previous_commit)
+                self.update_dependencies()
+                logger.error("=== デプロイメント中止（性能回帰） ===")
+                return False
+            
             # データベースマイグレーション
             self.run_database_migrations()
             
@@ -209,12 +256,15 @@ except Exception as e:
                 self.run_command(f"tar -xzf {backup_file} -C {self.app_dir.parent}")
                 logger.info("アプリケーションファイル復元完了")
             
-            # データベースの復元
-            db_backup_file = self.backup_dir / f"db_backup_before_deploy_{backup_timestamp}.sql"
-            if db_backup_file.exists() and os.environ.get('DATABASE_URL', '').startswith('postgresql'):
-                db_url = os.environ.get('DATABASE_URL')
-                self.run_command(f"psql '{db_url}' < {db_backup_file}")
-                logger.info("データベース復元完了")
+            # データベースの復元（アプリを止めてから、デプロイ前に取得したバックアップで置き換える）
+            id_file = self.db_backup_id_file(backup_timestamp)
+            if id_file.exists():
+                backup_id = id_file.read_text().strip()
+                self.run_command("sudo systemctl stop social-implementation")
+                self.run_db_optimizer(f"restore --id {backup_id} --yes")
+                logger.info(f"データベース復元完了: {backup_id}")
+            else:
+                logger.warning(f"データベースバックアップの記録が見つかりません: {id_file}")
             
             # アプリケーション再起動
             self.restart_application()
@@ -235,16 +285,19 @@ def main():
     if len(sys.argv) < 2:
         print("使用方法:")
         print("  python deploy.py deploy [branch]       - デプロイメント実行")
+        print("    --benchmark-gate                     - 事前に性能回帰チェックを行う")
         print("  python deploy.py rollback [timestamp]  - ロールバック実行")
         print("  python deploy.py health                 - ヘルスチェックのみ")
         sys.exit(1)
     
     deployer = DeploymentManager()
     command = sys.argv[1]
+    benchmark_gate = "--benchmark-gate" in sys.argv or os.environ.get('BENCHMARK_GATE') == '1'
+    args = [arg for arg in sys.argv[2:] if not arg.startswith("--")]
     
     if command == "deploy":
-        branch = sys.argv[2] if len(sys.argv) > 2 else "main"
-        success = deployer.deploy(branch)
+        branch = args[0] if args else "main"
+        success = deployer.deploy(branch, benchmark_gate=benchmark_gate)
         sys.exit(0 if success else 1)
         
     elif command == "rollback":
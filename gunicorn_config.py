@@ -9,18 +9,28 @@ worker_class = "sync"
 worker_connections = 1000
 
 # パフォーマンス設定
+# リクエスト数による再起動は保険として残し、通常は下の WORKER_MAX_RSS_MB で再起動する
 max_requests = 1000
 max_requests_jitter = 50
+# ワーカーのRSSがこの値(MB)を超えたら、処理中のリクエスト完了後に再起動する（0で無効）
+worker_max_rss_mb = int(os.environ.get('WORKER_MAX_RSS_MB', '512'))
 timeout = 30
 keepalive = 2
 preload_app = True
 
 # ログ設定
-log_dir = os.environ.get('LOG_DIR', '/var/log/social-implementation')
+# アプリのログ（production_logging.py）も同じディレクトリに書き出すため、環境変数を設定しておく
+log_dir = os.environ.setdefault('LOG_DIR', '/var/log/social-implementation')
 accesslog = f"{log_dir}/access.log"
 errorlog = f"{log_dir}/error.log"
 loglevel = os.environ.get('LOG_LEVEL', 'info')
 
+# メトリクス設定（ワーカー間でメトリクスを集計するための共有ディレクトリ）
+# アプリより先に読み込まれるため、ここで環境変数を設定しておく
+metrics_dir = os.environ.setdefault(
+    'METRICS_MULTIPROC_DIR', '/tmp/social-implementation-metrics'
+)
+
 # セキュリティ設定
 limit_request_line = 4094
 limit_request_fields = 100
@@ -40,4 +50,46 @@ secure_scheme_headers = {
 if os.environ.get('FLASK_ENV') == 'development':
     reload = True
     reload_extra_files = ['templates/', 'Static/']
-    workers = 1
\ No newline at end of file
+    workers = 1
+
+# --- メトリクス集計用フック ---
+def on_starting(server):
+    """起動時に前回のワーカーのメトリクスファイルを削除"""
+    os.makedirs(metrics_dir, exist_ok=True)
+    for filename in os.listdir(metrics_dir):
+        if filename.startswith('metrics_'):
+            os.remove(os.path.join(metrics_dir, filename))
+
+
+def worker_exit(server, worker):
+    """ワーカー終了時に最新のメトリクスを書き出す（ワーカープロセス内で実行）"""
+    from metrics import get_registry
+    get_registry().flush()
+
+
+def child_exit(server, worker):
+    """終了したワーカーのメトリクスをアーカイブに統合する（masterで実行）"""
+    from metrics import get_registry
+    get_registry().mark_process_dead(worker.pid)
+
+
+# --- メモリ量によるワーカー再起動 ---
+def post_worker_init(worker):
+    """ワーカー起動時に SIGUSR2 でメモリレポートを出力できるようにする"""
+    from memory_tracker import install_signal_handler
+    install_signal_handler()
+
+
+def post_request(worker, req, environ, resp):
+    """RSSが上限を超えたワーカーを、現在のリクエスト完了後に安全に終了させる"""
+    if worker_max_rss_mb <= 0:
+        return
+    from memory_tracker import get_rss_bytes
+    rss_mb = get_rss_bytes() / 1024 / 1024
+    if rss_mb > worker_max_rss_mb:
+        from metrics import WORKER_RECYCLES
+        WORKER_RECYCLES.inc(reason="memory")
+        worker.log.info(
+            f"ワーカー {worker.pid} のRSS {rss_mb:.0f}MB が上限 {worker_max_rss_mb}MB を超えたため再起動します"
+        )
+        worker.alive = False
@@ -0,0 +1,99 @@
+"""
+管理者専用エンドポイント（プロファイリング設定・メモリ調査など）
+
+ADMIN_TOKEN 環境変数が設定されている場合のみ有効。
+リクエストには X-Admin-Token ヘッダーで同じ値を付与する。
+"""
+import hmac
+import os
+from functools import wraps
+
+from flask import Blueprint, abort, current_app, jsonify, request
+
+from memory_tracker import MEMORY_REPORT_LIMIT, get_memory_tracker
+from profiler import get_profiler_config, make_profile_token, PROFILE_HEADER
+
+bp = Blueprint("admin_bp", __name__, url_prefix="/admin")
+
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+
+
+def admin_required(func):
+    """X-Admin-Token が ADMIN_TOKEN と一致するかチェックするデコレータ"""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        admin_token = os.getenv("ADMIN_TOKEN")
+        if not admin_token:
+            # 管理者トークン未設定の場合は管理機能そのものを公開しない
+            abort(404)
+        given = request.headers.get(ADMIN_TOKEN_HEADER, "")
+        if not hmac.compare_digest(given.encode(), admin_token.encode()):
+            abort(403)
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+@bp.route("/profiling", methods=["GET"])
+@admin_required
+def get_profiling():
+    """現在のプロファイリング設定を返す"""
+    config = get_profiler_config()
+    config.refresh()
+    return jsonify(config.to_dict()), 200
+
+
+@bp.route("/profiling", methods=["POST"])
+@admin_required
+def update_profiling():
+    """プロファイリング設定を変更する（enabled, sample_rate, slow_ms）"""
+    data = request.get_json() or {}
+    try:
+        get_profiler_config().update(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({"message": f"無効な設定です: {e}"}), 400
+    return jsonify(get_profiler_config().to_dict()), 200
+
+
+@bp.route("/profiling/token", methods=["POST"])
+@admin_required
+def issue_profile_token():
+    """特定のリクエストだけをプロファイルするための署名付きトークンを発行する"""
+    token = make_profile_token(current_app.secret_key)
+    return jsonify({"header": PROFILE_HEADER, "token": token}), 200
+
+
+# --- メモリ調査（値はリクエストを処理したワーカーのもの。レスポンスの pid を参照） ---
+
+
+@bp.route("/memory", methods=["GET"])
+@admin_required
+def get_memory_status():
+    """ワーカーのRSSと tracemalloc の状態を返す"""
+    return jsonify(get_memory_tracker().status()), 200
+
+
+@bp.route("/memory/snapshot", methods=["POST"])
+@admin_required
+def take_memory_snapshot():
+    """tracemalloc スナップショットを取得し、前回との差分を返す（初回は計測を開始する）"""
+    data = request.get_json(silent=True) or {}
+    try:
+        limit = int(data.get("limit", MEMORY_REPORT_LIMIT))
+    except (AttributeError, TypeError, ValueError):
+        limit = 0
+    if limit < 1:
+        return jsonify({"message": "limit は 1 以上の整数で指定してください。"}), 400
+    key_type = data.get("key_type", "lineno")
+    if key_type not in ("lineno", "filename", "traceback"):
+        return jsonify({"message": "key_type は lineno, filename, traceback のいずれかです。"}), 400
+    return jsonify(get_memory_tracker().snapshot_report(limit=limit, key_type=key_type)), 200
+
+
+@bp.route("/memory/tracemalloc", methods=["DELETE"])
+@admin_required
+def stop_memory_tracing():
+    """tracemalloc を停止してスナップショットを破棄する"""
+    get_memory_tracker().stop()
+    return jsonify(get_memory_tracker().status()), 200
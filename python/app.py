@@ -10,15 +10,28 @@ from flask import (
     session,
 )
 import logging
-from database import init_db, get_db
+import os
+import time
+from database import init_db, get_db, get_read_db, engine, replica_engine, begin_write, LAST_WRITE_SESSION_KEY
+import sharding
 from auth_service import verify_login
+from points_ledger import HISTORY_DEFAULT_LIMIT, HISTORY_MAX_LIMIT
+from sql_instrumentation import install_query_listeners, setup_sql_instrumentation
+from metrics import setup_metrics
+from profiler import setup_profiling
+from memory_tracker import setup_memory_tracking
+from production_logging import setup_production_logging
 # schemas削除：Renderビルド問題対応
 from datetime import datetime, timedelta, timezone, date
 from knowledge import bp as knowledge_bp
+from admin import bp as admin_bp
 # pydantic削除：Renderビルド問題対応
 from services import (
     register_new_user,
     add_new_loss_record_direct,
+    add_loss_record_with_points,  # 記録の追加とポイント計算を1トランザクションで
+    update_loss_record,
+    delete_loss_record,
     get_user_by_username,  # ログイン認証用
     calculate_weekly_points_logic,  # ポイント計算ロジック
     get_user_by_id,
@@ -26,23 +39,74 @@ from services import (
     get_all_loss_reasons,
     register_leftover_item,
     get_user_profile,
-    get_arrange_recipe_text
+    get_arrange_recipe_text,
+    redeem_points,
+    get_points_history,
     # ★ get_user_by_id など、services.pyで定義した関数は必要に応じてインポート
 )
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # --- アプリケーション初期設定 ---
 app = Flask(__name__, template_folder="../templates", static_folder="../static")
 
+# 本番（LOG_DIR を設定。gunicorn_config.py が設定する）ではキュー経由で書き込みスレッドから
+# ファイルに書き出す（INFO は LOG_INFO_SAMPLE_RATE で間引く）。開発時は標準エラー出力
+if os.getenv("LOG_DIR"):
+    setup_production_logging(app, log_dir=os.getenv("LOG_DIR"))
+else:
+    logging.basicConfig(level=logging.INFO)
+
 app.register_blueprint(knowledge_bp)
+app.register_blueprint(admin_bp)
+
+# リクエスト単位のSQL計測（クエリ数・DB時間・N+1検出）
+setup_sql_instrumentation(app, engine)
+if replica_engine is not None:
+    install_query_listeners(replica_engine)
+# エンドポイント別レイテンシ等のメトリクスと /metrics エンドポイント
+setup_metrics(app, engine)
+# オプトインのサンプリングプロファイラー（署名付きヘッダー・管理者設定で有効化）
+setup_profiling(app)
+# ワーカーのRSSをメトリクスに出力（メモリ量によるワーカー再起動に使用）
+setup_memory_tracking(app)
 
 # ★ 必須: セッションを使うためのSECRET_KEYを設定する ★
 # 本番環境では環境変数から読み込む必要があります
 app.secret_key = "a_secure_and_complex_secret_key"
 init_db()
 
+
+
+def read_db():
+    """読み取り専用のルートで使うセッション（レプリカ。直近に書き込んだユーザーはプライマリ）"""
+    return next(get_read_db(session.get(LAST_WRITE_SESSION_KEY), session.get("user_id")))
+
+
+def register_account(db, username, email, password):
+    """ユーザー登録（シャーディング時は全シャードで重複を確認し、採番した ID のシャードに登録する）"""
+    router = sharding.active_router()
+    if router is not None:
+        return sharding.register_user(router, username, email, password)
+    return register_new_user(db, username, email, password)
+
+
+def find_login_user(db, username):
+    """ログインするユーザーを探す（シャーディング時は全シャードから探す）"""
+    router = sharding.active_router()
+    if router is not None:
+        return sharding.find_user_by_username(router, username)
+    return get_user_by_username(db, username)
+
+
+@app.after_request
+def remember_write(response):
+    """書き込みに成功した時刻をセッションに残す（その後しばらくの読み取りをプライマリにするため）"""
+    if request.method in ("POST", "PUT", "PATCH", "DELETE") and response.status_code < 400 and "user_id" in session:
+        session[LAST_WRITE_SESSION_KEY] = time.time()
+    return response
+
+
 # --- 画面ルーティング ---
 # ★ ログイン必須のチェック（セッション確認）を追加 ★
 
@@ -110,7 +174,7 @@ def register():
         db = next(get_db())
         try:
             # 4. Services層を呼び出して登録
-            register_new_user(db, username, email, password)
+            register_account(db, username, email, password)
 
             # 5. 成功したらログインページにリダイレクト
             # (注: ここで自動的にログインさせることも可能ですが、
@@ -140,7 +204,7 @@ def register():
 def input():
     today = date.today()
     user_id = session.get("user_id")
-    db = next(get_db())
+    db = next(get_db(user_id))
     
     success_message = None
     error_message = None
@@ -179,14 +243,18 @@ def input():
                     "reason_text": reason_text,
                 }
                 validated_data = loss_data  # スキーマ削除対応
-                add_new_loss_record_direct(db, validated_data)
-                
-                # --- 自動ポイント計算を実行 ---
-                try:
-                    logger.info(f"ユーザーID {user_id} の自動ポイント計算を実行中...")
-                    point_result = calculate_weekly_points_logic(db, user_id)
+
+                # --- 記録の追加と自動ポイント計算（1トランザクション・ユーザー単位のロック） ---
+                logger.info(f"ユーザーID {user_id} の自動ポイント計算を実行中...")
+                _, point_result = add_loss_record_with_points(db, validated_data)
+                if "error" in point_result:
+                    # ポイント計算でエラーが発生してもレコード追加は成功として扱う
+                    logger.error(f"ポイント計算エラー: {point_result['error']}")
+                    logger.error(f"スタックトレース: {point_result['traceback']}")
+                    success_message = "フードロスを記録しました！"
+                else:
                     points_awarded = point_result.get("points_added", 0)
-                    
+
                     # 詳細ログ出力（改良版ベースライン計算対応）
                     details = point_result.get("calculation_details", {})
                     logger.info(
@@ -200,7 +268,7 @@ def input():
                         f"Final rate: {point_result.get('final_reduction_rate', 0):.1f}% "
                         f"({details.get('comparison_method', 'unknown')})"
                     )
-                    
+
                     if points_awarded > 0:
                         onboarding = " (初回ボーナス)" if point_result.get("onboarding_applied", False) else ""
                         success_message = f"フードロスを記録しました！ {points_awarded}ポイントを獲得しました{onboarding}！"
@@ -213,13 +281,6 @@ def input():
                         else:
                             success_message = "フードロスを記録しました！"
                             logger.info(f"ユーザーID {user_id} はポイント付与条件を満たしていません: {point_result.get('message', '不明')}")
-                except Exception as point_error:
-                    # ポイント計算でエラーが発生してもレコード追加は成功として扱う
-                    logger.error(f"ポイント計算エラー: {point_error}")
-                    logger.error(f"ポイント計算エラー詳細: {type(point_error).__name__}: {str(point_error)}")
-                    import traceback
-                    logger.error(f"スタックトレース: {traceback.format_exc()}")
-                    success_message = "フードロスを記録しました！"
 
             # --- 余りもの記録の処理 ---
             leftover_name = form_data.get("leftover_name")
@@ -334,7 +395,7 @@ def log():
 @login_required
 def points():
     user_id = session["user_id"]
-    db = next(get_db())
+    db = read_db()
 
     try:
         # services.py の get_user_profile を呼び出す想定
@@ -364,7 +425,7 @@ def account():
     # 1. セッションからユーザーIDを取得
     user_id = session["user_id"]
 
-    db = next(get_db())
+    db = next(get_db(user_id))
     try:
         # 2. データベースからユーザー情報を取得
         # (services.py の get_user_by_id 関数を使用)
@@ -401,7 +462,7 @@ def login():
         password = request.form.get('password')
 
         try:
-            user = get_user_by_username(db, username) 
+            user = find_login_user(db, username)
             if user and verify_login(username, password, user.password):
                 session['user_id'] = user.id
                 
@@ -458,7 +519,7 @@ def register_user_api():
     db = next(get_db())
     try:
         # ★ Services層を呼び出し、DB操作を任せる ★
-        user_id = register_new_user(db, username, email, password)
+        user_id = register_account(db, username, email, password)
 
         return jsonify({"message": "登録完了！", "user_id": user_id}), 201
     except Exception as e:
@@ -480,7 +541,7 @@ def add_loss_record_api():
 
     # 必須項目チェック (手動チェックは削除)
 
-    db = next(get_db())
+    db = next(get_db(user_id))
     try:
         # ★ 1. データの基本検証 ★
         validated_data = data  # スキーマ削除対応
@@ -504,6 +565,52 @@ def add_loss_record_api():
         db.close()
 
 
+@app.route("/api/loss_records/<int:record_id>", methods=["PATCH"])
+def update_loss_record_api(record_id):
+    """記録の品目名・重量・廃棄理由を変更する（ポイント付与済みの週ならポイントも計算し直す）"""
+    user_id = session.get("user_id")
+    if not user_id:
+        return jsonify({"message": "認証が必要です。"}), 401
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"message": "JSON で変更する項目を指定してください。"}), 400
+
+    db = next(get_db(user_id))
+    try:
+        result = update_loss_record(db, user_id, record_id, data)
+        if result is None:
+            return jsonify({"message": "記録が見つかりません。"}), 404
+        return jsonify({"message": "記録を変更しました。", **result}), 200
+    except ValueError as e:
+        return jsonify({"message": "入力データが無効です", "details": str(e)}), 422
+    except Exception as e:
+        db.rollback()
+        return jsonify({"message": f"記録の変更中にエラーが発生しました: {str(e)}"}), 500
+    finally:
+        db.close()
+
+
+@app.route("/api/loss_records/<int:record_id>", methods=["DELETE"])
+def delete_loss_record_api(record_id):
+    """記録を削除する（ポイント付与済みの週ならポイントも計算し直す）"""
+    user_id = session.get("user_id")
+    if not user_id:
+        return jsonify({"message": "認証が必要です。"}), 401
+
+    db = next(get_db(user_id))
+    try:
+        result = delete_loss_record(db, user_id, record_id)
+        if result is None:
+            return jsonify({"message": "記録が見つかりません。"}), 404
+        return jsonify({"message": "記録を削除しました。", **result}), 200
+    except Exception as e:
+        db.rollback()
+        return jsonify({"message": f"記録の削除中にエラーが発生しました: {str(e)}"}), 500
+    finally:
+        db.close()
+
+
 # --- API: 週次ポイント計算 ---
 @app.route("/api/calculate_weekly_points", methods=["POST"])
 def calculate_weekly_points_api():
@@ -511,7 +618,7 @@ def calculate_weekly_points_api():
     if not user_id:
         return jsonify({"message": "認証が必要です。"}), 401
 
-    db = next(get_db())
+    db = next(get_db(user_id))
     try:
         # ★ Services層を呼び出し、ロジックを実行させる ★
         result = calculate_weekly_points_logic(db, user_id)
@@ -553,7 +660,7 @@ def get_user_profile_api():
     if not user_id:
         return jsonify({"message": "認証が必要です。"}), 401
 
-    db = next(get_db())
+    db = read_db()
     try:
         profile_data = get_user_profile(db, user_id)
 
@@ -593,13 +700,15 @@ def redeem_api():
     except Exception:
         return jsonify({"message": "cost は整数でなければなりません。"}), 400
 
-    db = next(get_db())
+    db = next(get_db(user_id))
     try:
-        user = get_user_by_id(db, user_id)
-        if not user:
-            return jsonify({"message": "ユーザーが見つかりません。"}), 404
-
-        if user.total_points < cost:
+        begin_write(db)
+        # 残高の確認と減算は1つの条件付き UPDATE で行う（同時の交換でも残高は負にならない）
+        remaining = redeem_points(db, user_id, cost, item_name)
+        if remaining is None:
+            user = get_user_by_id(db, user_id)
+            if not user:
+                return jsonify({"message": "ユーザーが見つかりません。"}), 404
             return (
                 jsonify(
                     {
@@ -610,15 +719,11 @@ def redeem_api():
                 403,
             )
 
-        # ポイントを減算して確定
-        user.total_points -= cost
-        db.commit()
-
         return (
             jsonify(
                 {
                     "message": f"{item_name} を交換しました。",
-                    "remaining_points": user.total_points,
+                    "remaining_points": remaining,
                 }
             ),
             200,
@@ -631,6 +736,35 @@ def redeem_api():
         db.close()
 
 
+@app.route("/api/points/history", methods=["GET"])
+def points_history_api():
+    """ポイントの付与・交換の履歴（新しい順）。?limit= と、続きは ?before=<最後の id>"""
+    user_id = session.get("user_id")
+    if not user_id:
+        return jsonify({"message": "認証が必要です。"}), 401
+
+    try:
+        limit = int(request.args.get("limit", HISTORY_DEFAULT_LIMIT))
+        before = request.args.get("before")
+        before_id = int(before) if before else None
+    except ValueError:
+        return jsonify({"message": "limit と before は整数でなければなりません。"}), 400
+    limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+
+    db = read_db()
+    try:
+        entries = get_points_history(db, user_id, limit=limit, before_id=before_id)
+        return jsonify(
+            {
+                "entries": entries,
+                # 続きがある可能性がある場合のみ次のカーソルを返す
+                "next_before": entries[-1]["id"] if len(entries) == limit else None,
+            }
+        )
+    finally:
+        db.close()
+
+
 @app.route("/api/weekly_stats", methods=["GET"])
 def get_weekly_stats_api():
     user_id = session.get("user_id")
@@ -648,7 +782,7 @@ def get_weekly_stats_api():
         except ValueError:
             pass  # 不正な場合は今日の日付を使用
 
-    db = next(get_db())
+    db = read_db()
     try:
         # Services層を呼び出し、週次データを取得
         stats_data = get_weekly_stats(db, user_id, target_date)
@@ -675,7 +809,7 @@ def register_leftover_api():
     data = request.get_json()
     data["user_id"] = user_id
     
-    db = next(get_db())
+    db = next(get_db(user_id))
     try:
         validated_data = data  # スキーマ削除対応
         #下一行はデバッグ用のprint文　消していい
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+古いフードロス記録の保管（アーカイブ）
+
+ポイントの計算に使うのは過去8週間と今週の記録、ログ画面に表示するのは1週間分だけだが、
+food_loss_records は増え続ける。保管期間（ARCHIVE_HORIZON_WEEKS 週）より前の週の記録を
+food_loss_records_archive に移し、ユーザー・日・廃棄理由ごとの集計を daily_loss_summaries に
+残す。final_report は記録と集計を合わせて集計するため、移した後もレポートの値は変わらない。
+
+週の途中で区切らないよう、保管期間の最初の週の月曜日より前の記録を移す。
+1バッチ（ID 順に batch_size 件）ごとに、保管・集計の加算・削除を1つのトランザクションで
+行うため、途中で止めても再実行すれば続きから移せる。
+PostgreSQL で月別パーティションにしている場合、月全体は partitioning.py detach で切り離す方が速い。
+
+使用例:
+    python archive.py status
+    python archive.py run --dry-run
+    python archive.py run --horizon-weeks 12
+"""
+import os
+import time
+from collections import defaultdict
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import click
+from sqlalchemy import delete, func, insert, literal, select, tuple_, union_all, update
+from sqlalchemy.orm import Session
+
+import clock
+from database import begin_write
+from models import DailyLossSummary, FoodLossRecord, FoodLossRecordArchive
+from statistics import get_week_boundaries
+
+# 記録をそのまま残す週数（今週を含まない）
+ARCHIVE_HORIZON_WEEKS = int(os.getenv("ARCHIVE_HORIZON_WEEKS", "12"))
+# ポイントのベースライン（過去8週間）より短くはできない
+MIN_HORIZON_WEEKS = 9
+ARCHIVE_BATCH_SIZE = 5000
+
+SummaryKey = Tuple[int, str, Optional[int]]
+
+
+def archive_cutoff(horizon_weeks: int = ARCHIVE_HORIZON_WEEKS) -> str:
+    """これより前（record_date < cutoff）の記録を移す。保管期間の最初の週の月曜日（YYYY-MM-DD）"""
+    if horizon_weeks < MIN_HORIZON_WEEKS:
+        raise ValueError(f"保管期間は {MIN_HORIZON_WEEKS} 週以上にしてください（ポイントの計算に使うため）")
+    this_monday, _ = get_week_boundaries(clock.now())
+    return (this_monday - timedelta(weeks=horizon_weeks)).strftime("%Y-%m-%d")
+
+
+def loss_rows(start_date=None, end_date=None):
+    """記録と、保管した記録の日ごとの集計を合わせた行（final_report・user_counters が集計に使う）
+
+    列は user_id, day (YYYY-MM-DD), loss_reason_id, grams, records（記録は1行が1件）
+    """
+    hot = select(
+        FoodLossRecord.user_id,
+        func.substr(FoodLossRecord.record_date, 1, 10).label("day"),
+        FoodLossRecord.loss_reason_id,
+        FoodLossRecord.weight_grams.label("grams"),
+        literal(1).label("records"),
+    )
+    archived = select(
+        DailyLossSummary.user_id,
+        DailyLossSummary.day,
+        DailyLossSummary.loss_reason_id,
+        DailyLossSummary.total_grams,
+        DailyLossSummary.record_count,
+    )
+    if start_date is not None:
+        hot = hot.where(FoodLossRecord.record_date >= start_date, FoodLossRecord.record_date <= end_date)
+        archived = archived.where(
+            DailyLossSummary.day >= start_date.strftime("%Y-%m-%d"),
+            DailyLossSummary.day <= end_date.strftime("%Y-%m-%d"),
+        )
+    return union_all(hot, archived).subquery("loss_rows")
+
+
+def add_to_summaries(db: Session, rows: List[Dict[str, Any]]) -> int:
+    """移す記録をユーザー・日・廃棄理由ごとに集計し、既存の集計行に加算する。新しく作った行数を返す"""
+    totals: Dict[SummaryKey, List[float]] = defaultdict(lambda: [0.0, 0])
+    for row in rows:
+        key = (row["user_id"], row["record_date"][:10], row["loss_reason_id"])
+        totals[key][0] += row["weight_grams"]
+        totals[key][1] += 1
+
+    # 同じユーザー・日の集計行（以前のバッチ・以前の実行で作ったもの）を読み込む
+    user_days = {(user_id, day) for user_id, day, _ in totals}
+    existing = {
+        (summary.user_id, summary.day, summary.loss_reason_id): summary.id
+        for summary in db.execute(
+            select(DailyLossSummary.id, DailyLossSummary.user_id, DailyLossSummary.day, DailyLossSummary.loss_reason_id)
+            .where(tuple_(DailyLossSummary.user_id, DailyLossSummary.day).in_(user_days))
+        )
+    }
+    new_rows = []
+    for key, (grams, count) in totals.items():
+        if key in existing:
+            db.execute(
+                update(DailyLossSummary)
+                .where(DailyLossSummary.id == existing[key])
+                .values(
+                    total_grams=DailyLossSummary.total_grams + grams,
+                    record_count=DailyLossSummary.record_count + count,
+                )
+            )
+        else:
+            user_id, day, loss_reason_id = key
+            new_rows.append(
+                {"user_id": user_id, "day": day, "loss_reason_id": loss_reason_id, "total_grams": grams, "record_count": count}
+            )
+    if new_rows:
+        db.execute(insert(DailyLossSummary), new_rows)
+    return len(new_rows)
+
+
+def archive_records(
+    db: Session,
+    horizon_weeks: int = ARCHIVE_HORIZON_WEEKS,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    """保管期間より前の記録を保管テーブルに移し、日ごとの集計を残す"""
+    started = time.perf_counter()
+    cutoff = archive_cutoff(horizon_weeks)
+    old = FoodLossRecord.record_date < cutoff
+    report = {"cutoff": cutoff, "records_archived": 0, "summary_rows_created": 0, "batches": 0, "dry_run": dry_run}
+    if dry_run:
+        report["records_archived"] = db.execute(select(func.count(FoodLossRecord.id)).where(old)).scalar()
+        db.rollback()
+        report["seconds"] = round(time.perf_counter() - started, 3)
+        return report
+
+    columns = (
+        FoodLossRecord.id,
+        FoodLossRecord.user_id,
+        FoodLossRecord.item_name,
+        FoodLossRecord.weight_grams,
+        FoodLossRecord.loss_reason_id,
+        FoodLossRecord.record_date,
+    )
+    while True:
+        begin_write(db)
+        rows = [dict(row) for row in db.execute(select(*columns).where(old).order_by(FoodLossRecord.id).limit(batch_size)).mappings()]
+        if not rows:
+            db.rollback()
+            break
+        archived_at = clock.now().isoformat(timespec="seconds")
+        db.execute(
+            insert(FoodLossRecordArchive),
+            [
+                {**{key: value for key, value in row.items() if key != "id"}, "record_id": row["id"], "archived_at": archived_at}
+                for row in rows
+            ],
+        )
+        report["summary_rows_created"] += add_to_summaries(db, rows)
+        db.execute(delete(FoodLossRecord).where(FoodLossRecord.id.in_([row["id"] for row in rows])))
+        db.commit()
+        report["records_archived"] += len(rows)
+        report["batches"] += 1
+
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def archive_status(db: Session, horizon_weeks: int = ARCHIVE_HORIZON_WEEKS) -> Dict[str, Any]:
+    cutoff = archive_cutoff(horizon_weeks)
+    status = {
+        "cutoff": cutoff,
+        "hot_records": db.execute(select(func.count(FoodLossRecord.id))).scalar(),
+        "oldest_hot_record": db.execute(select(func.min(FoodLossRecord.record_date))).scalar(),
+        "archivable_records": db.execute(
+            select(func.count(FoodLossRecord.id)).where(FoodLossRecord.record_date < cutoff)
+        ).scalar(),
+        "archived_records": db.execute(select(func.count(FoodLossRecordArchive.id))).scalar(),
+        "summary_rows": db.execute(select(func.count(DailyLossSummary.id))).scalar(),
+    }
+    db.rollback()
+    return status
+
+
+@click.group()
+def cli():
+    """古いフードロス記録の保管ツール"""
+    pass
+
+
+@cli.command("run")
+@click.option("--horizon-weeks", default=ARCHIVE_HORIZON_WEEKS, show_default=True, help="記録をそのまま残す週数")
+@click.option("--batch-size", default=ARCHIVE_BATCH_SIZE, show_default=True, help="1回のトランザクションで移す件数")
+@click.option("--dry-run", is_flag=True, help="移す件数だけを表示する")
+def run_command(horizon_weeks, batch_size, dry_run):
+    """保管期間より前の記録を保管テーブルに移し、日ごとの集計を残す"""
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        report = archive_records(db, horizon_weeks=horizon_weeks, batch_size=batch_size, dry_run=dry_run)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    finally:
+        db.close()
+
+    if dry_run:
+        click.echo(f"{report['cutoff']} より前の記録 {report['records_archived']} 件を移します")
+    else:
+        click.echo(
+            f"✓ {report['cutoff']} より前の記録 {report['records_archived']} 件を移しました"
+            f"（集計行 {report['summary_rows_created']} 件を追加、{report['seconds']} 秒）"
+        )
+
+
+@cli.command("status")
+@click.option("--horizon-weeks", default=ARCHIVE_HORIZON_WEEKS, show_default=True, help="記録をそのまま残す週数")
+def status_command(horizon_weeks):
+    """記録・保管済みの件数を表示する"""
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        status = archive_status(db, horizon_weeks)
+    finally:
+        db.close()
+
+    click.echo(f"記録: {status['hot_records']} 件（最も古い記録 {status['oldest_hot_record']}）")
+    click.echo(f"移せる記録（{status['cutoff']} より前）: {status['archivable_records']} 件")
+    click.echo(f"保管済み: {status['archived_records']} 件、日ごとの集計: {status['summary_rows']} 行")
+
+
+if __name__ == "__main__":
+    cli()
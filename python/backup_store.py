@@ -0,0 +1,236 @@
+"""
+重複排除・圧縮付きのバックアップ保存先
+
+バックアップの内容をチャンクに分け、SHA-256 をファイル名として圧縮して保存する
+（content-addressed）。前回から変わっていないチャンクは再利用されるため、
+毎回のバックアップで増えるのは変更された部分だけになる。
+
+- SQLite: オンラインバックアップ API で一貫したスナップショットを作り、ページ境界に揃えた
+  固定長チャンクに分ける（変更のないページは同じチャンクになる）
+- PostgreSQL: pg_dump の SQL 出力を行単位の内容依存チャンク（content-defined chunking）に分ける
+  （行の追加・削除で後ろのチャンク境界がずれない）
+
+保存先の構成:
+    <root>/chunks/ab/abcdef...   zlib で圧縮したチャンク
+    <root>/manifests/<id>.json    チャンクの並び・全体のハッシュ・所要時間
+"""
+import fcntl
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional
+
+# SQLite のチャンクサイズ（ページサイズの倍数にする）
+# 小さいほど変更の少ない日の保存量は減るが、ファイル数が増える（64KB = 4KB ページ × 16）
+SQLITE_CHUNK_SIZE = 64 * 1024
+# オンラインバックアップで1ステップにコピーするページ数と、ステップ間の待ち時間
+# ステップの間は書き込みがブロックされない
+SQLITE_BACKUP_PAGES = 1024
+SQLITE_BACKUP_SLEEP = 0.005
+# pg_dump 出力の内容依存チャンク: 平均 約 256KB、最小 64KB、最大 4MB
+CDC_MASK = (1 << 18) - 1
+CDC_MIN_SIZE = 64 * 1024
+CDC_MAX_SIZE = 4 * 1024 * 1024
+COMPRESSION_LEVEL = 6
+
+# 保持ポリシーの既定値（直近 N 件 + 日ごと N 日分 + 週ごと N 週分）
+DEFAULT_KEEP_LAST = 3
+DEFAULT_KEEP_DAILY = 7
+DEFAULT_KEEP_WEEKLY = 4
+
+
+def fixed_chunks(stream: BinaryIO, size: int = SQLITE_CHUNK_SIZE) -> Iterator[bytes]:
+    while True:
+        chunk = stream.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def line_chunks(lines: Iterable[bytes], mask: int = CDC_MASK, min_size: int = CDC_MIN_SIZE, max_size: int = CDC_MAX_SIZE) -> Iterator[bytes]:
+    """行の内容のハッシュで境界を決める（同じ行の並びなら前後の変更に関係なく同じ境界になる）"""
+    buffer: List[bytes] = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= max_size or (size >= min_size and zlib.crc32(line) & mask == 0):
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def sqlite_snapshot(source_path: str, dest_path: str, pages: int = SQLITE_BACKUP_PAGES, sleep: float = SQLITE_BACKUP_SLEEP) -> None:
+    """稼働中の SQLite データベースの一貫したコピーを作る（ページ単位で少しずつコピーする）"""
+    source = sqlite3.connect(source_path)
+    dest = sqlite3.connect(dest_path)
+    try:
+        with dest:
+            source.backup(dest, pages=pages, sleep=sleep)
+        # 復元したファイルを単体で開けるよう、WAL ではなく通常のジャーナルにしておく
+        dest.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        dest.close()
+        source.close()
+
+
+class BackupStore:
+    """チャンク単位で重複排除するバックアップの保存先"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.chunk_dir = self.root / "chunks"
+        self.manifest_dir = self.root / "manifests"
+
+    @contextmanager
+    def _lock(self):
+        """書き込み中のチャンクを GC が消さないよう、バックアップと GC を直列化する"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.root / ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _chunk_path(self, digest: str) -> Path:
+        return self.chunk_dir / digest[:2] / digest
+
+    def _put_chunk(self, data: bytes) -> tuple:
+        """チャンクを保存し (ハッシュ, 新規に保存したバイト数) を返す"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._chunk_path(digest)
+        if path.exists():
+            return digest, 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        compressed = zlib.compress(data, COMPRESSION_LEVEL)
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(compressed)
+        os.replace(temp_path, path)
+        return digest, len(compressed)
+
+    def write(self, chunks: Iterable[bytes], meta: Dict[str, Any]) -> Dict[str, Any]:
+        """チャンク列を保存してマニフェストを返す（マニフェストは最後に書くため、途中で失敗しても壊れない）"""
+        started = time.perf_counter()
+        created_at = datetime.now()
+        backup_id = created_at.strftime("%Y%m%d_%H%M%S_%f")
+        whole = hashlib.sha256()
+        digests: List[str] = []
+        size = stored = new_chunks = 0
+        with self._lock():
+            for data in chunks:
+                whole.update(data)
+                digest, written = self._put_chunk(data)
+                digests.append(digest)
+                size += len(data)
+                stored += written
+                new_chunks += 1 if written else 0
+            manifest = {
+                "id": backup_id,
+                "created_at": created_at.isoformat(timespec="seconds"),
+                **meta,
+                "size_bytes": size,
+                "sha256": whole.hexdigest(),
+                "chunks": digests,
+                "new_chunks": new_chunks,
+                "stored_bytes": stored,
+                "seconds": round(time.perf_counter() - started, 3),
+            }
+            self.manifest_dir.mkdir(parents=True, exist_ok=True)
+            temp_path = self.manifest_dir / f".{backup_id}.json"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.manifest_dir / f"{backup_id}.json")
+        return manifest
+
+    def manifests(self) -> List[Dict[str, Any]]:
+        """保存されているバックアップ（古い順）"""
+        if not self.manifest_dir.exists():
+            return []
+        result = []
+        for path in sorted(self.manifest_dir.glob("*.json")):
+            if path.name.startswith("."):
+                continue
+            with open(path, encoding="utf-8") as f:
+                result.append(json.load(f))
+        return result
+
+    def get(self, backup_id: Optional[str] = None) -> Dict[str, Any]:
+        """指定した ID（未指定なら最新）のマニフェスト"""
+        manifests = self.manifests()
+        if not manifests:
+            raise FileNotFoundError(f"バックアップがありません: {self.root}")
+        if backup_id is None:
+            return manifests[-1]
+        for manifest in manifests:
+            if manifest["id"] == backup_id:
+                return manifest
+        raise FileNotFoundError(f"バックアップが見つかりません: {backup_id}")
+
+    def read(self, manifest: Dict[str, Any]) -> Iterator[bytes]:
+        """バックアップの内容をチャンクごとに展開して返す（各チャンクと全体のハッシュを検証する）"""
+        whole = hashlib.sha256()
+        for digest in manifest["chunks"]:
+            with open(self._chunk_path(digest), "rb") as f:
+                data = zlib.decompress(f.read())
+            if hashlib.sha256(data).hexdigest() != digest:
+                raise ValueError(f"チャンクが破損しています: {digest}")
+            whole.update(data)
+            yield data
+        if whole.hexdigest() != manifest["sha256"]:
+            raise ValueError(f"バックアップ全体のハッシュが一致しません: {manifest['id']}")
+
+    def retained(self, keep_last: int = DEFAULT_KEEP_LAST, keep_daily: int = DEFAULT_KEEP_DAILY, keep_weekly: int = DEFAULT_KEEP_WEEKLY, now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """保持ポリシーで残すバックアップ（直近 keep_last 件、各日・各週の最新）"""
+        now = now or datetime.now()
+        manifests = sorted(self.manifests(), key=lambda m: m["created_at"], reverse=True)  # 新しい順
+        keep = {m["id"] for m in manifests[:keep_last]}
+        days, weeks = set(), set()
+        for manifest in manifests:
+            created = datetime.fromisoformat(manifest["created_at"])
+            day = created.date()
+            week = day - timedelta(days=day.weekday())
+            if now.date() - day < timedelta(days=keep_daily) and day not in days:
+                days.add(day)
+                keep.add(manifest["id"])
+            if now.date() - week < timedelta(weeks=keep_weekly) and week not in weeks:
+                weeks.add(week)
+                keep.add(manifest["id"])
+        return [m for m in manifests if m["id"] in keep]
+
+    def prune(self, **policy) -> Dict[str, int]:
+        """保持ポリシーから外れたバックアップと、どこからも参照されないチャンクを削除する"""
+        with self._lock():
+            keep = {m["id"] for m in self.retained(**policy)}
+            removed = 0
+            for manifest in self.manifests():
+                if manifest["id"] not in keep:
+                    (self.manifest_dir / f"{manifest['id']}.json").unlink()
+                    removed += 1
+            referenced = {digest for m in self.manifests() for digest in m["chunks"]}
+            freed_chunks = freed_bytes = 0
+            if self.chunk_dir.exists():
+                for path in self.chunk_dir.glob("*/*"):
+                    if path.name not in referenced:
+                        freed_bytes += path.stat().st_size
+                        path.unlink()
+                        freed_chunks += 1
+        return {"removed_backups": removed, "removed_chunks": freed_chunks, "freed_bytes": freed_bytes}
+
+    def usage(self) -> Dict[str, int]:
+        """保存先の実際の使用量と、全バックアップを個別に保存した場合の合計"""
+        stored = sum(path.stat().st_size for path in self.chunk_dir.glob("*/*")) if self.chunk_dir.exists() else 0
+        return {
+            "backups": len(self.manifests()),
+            "stored_bytes": stored,
+            "logical_bytes": sum(m["size_bytes"] for m in self.manifests()),
+        }
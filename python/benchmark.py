@@ -0,0 +1,587 @@
+#!/usr/bin/env python3
+"""
+再現可能なベンチマークスイート（performance_test.py の置き換え）
+
+- デフォルトでは一時的な SQLite データベースに合成データを投入し、Flask のテストクライアントで計測する
+- --target http://127.0.0.1:8000 を指定すると、起動中の gunicorn に対して計測する
+  （その場合は gunicorn と同じ DATABASE_URL を設定し、SQL_STATS_HEADER=1 で起動しておくと
+  クエリ数も記録される）
+- 結果（p50/p95/p99 など）は JSON に保存し、後から比較できるようにする
+
+使用例:
+    python benchmark.py run --iterations 200 --output benchmarks/baseline.json
+    python benchmark.py compare benchmarks/baseline.json benchmark_20250101_120000.json
+    python benchmark.py gate --baseline benchmarks/baseline.json   # 回帰があれば終了コード 1
+"""
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+import click
+
+from synthetic_data import SYNTHETIC_PASSWORD
+
+SQL_STATS_HEADER_NAME = "X-SQL-Stats"
+
+DISH_NAMES = ["カレー", "ご飯", "味噌汁", "サラダ", "パン", "牛乳", "焼き魚", "野菜炒め"]
+REASON_TEXTS = ["期限切れ", "調理中の廃棄", "料理後の廃棄", "調理失敗", "その他", "食べ残し"]
+
+
+# --- 統計ヘルパー（python/statistics.py が標準ライブラリを隠すため自前で実装） ---
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """ソート済みリストのパーセンタイル（線形補間）"""
+    if not sorted_values:
+        return 0.0
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    rank = (len(sorted_values) - 1) * pct / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    fraction = rank - lower
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * fraction
+
+
+def summarize(latencies_ms: List[float], query_counts: List[int], errors: int, elapsed: float) -> Dict[str, Any]:
+    values = sorted(latencies_ms)
+    summary = {
+        "iterations": len(values),
+        "errors": errors,
+        "mean_ms": round(sum(values) / len(values), 3) if values else 0.0,
+        "min_ms": round(values[0], 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 50), 3),
+        "p95_ms": round(percentile(values, 95), 3),
+        "p99_ms": round(percentile(values, 99), 3),
+        "max_ms": round(values[-1], 3) if values else 0.0,
+        "throughput_rps": round(len(values) / elapsed, 2) if elapsed > 0 else 0.0,
+        "samples_ms": [round(v, 3) for v in latencies_ms],
+    }
+    if query_counts:
+        summary["queries_mean"] = round(sum(query_counts) / len(query_counts), 2)
+        summary["queries_max"] = max(query_counts)
+    return summary
+
+
+def parse_sql_stats_header(value: Optional[str]) -> Optional[int]:
+    """X-SQL-Stats ヘッダー（count=..; time_ms=..）からクエリ数を取り出す"""
+    if not value:
+        return None
+    for part in value.split(";"):
+        key, _, raw = part.strip().partition("=")
+        if key == "count":
+            return int(raw)
+    return None
+
+
+# --- 合成データの投入 ---
+
+
+def seed_synthetic_database(num_users: int, weeks: int, records_per_week: int, seed: int) -> List[str]:
+    """synthetic_data でユーザーと過去 weeks 週分の記録を投入し、ユーザー名の一覧を返す"""
+    from database import engine
+    from synthetic_data import SyntheticDataGenerator, load_synthetic_data
+
+    generator = SyntheticDataGenerator(
+        num_users, weeks, records_per_week=records_per_week, seed=seed, prefix=f"bench_user_{seed}"
+    )
+    return load_synthetic_data(engine, generator)["usernames"]
+
+
+# --- 計測対象 ---
+
+
+class TestClientTarget:
+    """Flask テストクライアントで計測する（サーバー不要）"""
+
+    name = "flask-test-client"
+
+    def __init__(self):
+        from app import app
+
+        self.app = app
+        self.client = app.test_client()
+
+    def login(self, username: str) -> None:
+        self.client = self.app.test_client()
+        resp = self.client.post(
+            "/login", data={"username": username, "password": SYNTHETIC_PASSWORD}
+        )
+        if resp.status_code != 200:
+            raise RuntimeError(f"ログインに失敗しました: {resp.status_code}")
+
+    def request(self, method: str, path: str, **kwargs):
+        resp = self.client.open(path, method=method, **kwargs)
+        return resp.status_code, resp.headers.get(SQL_STATS_HEADER_NAME)
+
+
+class HttpTarget:
+    """起動中のサーバー（gunicorn など）に対して計測する"""
+
+    def __init__(self, base_url: str):
+        import requests
+
+        self.name = base_url
+        self.base_url = base_url.rstrip("/")
+        self._requests = requests
+        self.session = requests.Session()
+
+    def login(self, username: str) -> None:
+        self.session = self._requests.Session()
+        resp = self.session.post(
+            f"{self.base_url}/login",
+            data={"username": username, "password": SYNTHETIC_PASSWORD},
+            timeout=10,
+        )
+        if resp.status_code != 200:
+            raise RuntimeError(f"ログインに失敗しました: {resp.status_code}")
+
+    def request(self, method: str, path: str, data=None, json=None, **kwargs):
+        resp = self.session.request(
+            method, f"{self.base_url}{path}", data=data, json=json, timeout=30
+        )
+        return resp.status_code, resp.headers.get(SQL_STATS_HEADER_NAME)
+
+
+# --- シナリオ ---
+
+
+def _http_scenario(method: str, path_factory: Callable[[random.Random], str], data_factory=None):
+    def run(target, rng: random.Random):
+        kwargs = {}
+        if data_factory is not None:
+            kwargs["data"] = data_factory(rng)
+        status, header = target.request(method, path_factory(rng), **kwargs)
+        return status < 400, parse_sql_stats_header(header)
+
+    return run
+
+
+def _input_form(rng: random.Random) -> Dict[str, str]:
+    return {
+        "item_name": rng.choice(DISH_NAMES),
+        "weight_grams": str(rng.randint(20, 400)),
+        "reason_text": rng.choice(REASON_TEXTS),
+    }
+
+
+def _weekly_stats_path(rng: random.Random) -> str:
+    target_date = datetime.now() - timedelta(weeks=rng.randint(0, 3))
+    return f"/api/weekly_stats?date={target_date.strftime('%Y-%m-%d')}"
+
+
+def _points_calculation(target, rng: random.Random):
+    """ポイント計算ロジックをサービス層で直接計測する"""
+    from database import SessionLocal
+    from services import calculate_weekly_points_logic
+    from sql_instrumentation import collect_queries
+
+    db = SessionLocal()
+    try:
+        with collect_queries("points_calculation") as stats:
+            calculate_weekly_points_logic(db, target.current_user_id)
+        return True, stats.count
+    finally:
+        db.close()
+
+
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    "input_post": {
+        "route": "/input",
+        "run": _http_scenario("POST", lambda rng: "/input", _input_form),
+    },
+    "weekly_stats": {
+        "route": "/api/weekly_stats",
+        "run": _http_scenario("GET", _weekly_stats_path),
+    },
+    "knowledge": {
+        "route": "/knowledge/",
+        "run": _http_scenario("GET", lambda rng: "/knowledge/"),
+    },
+    "points_page": {
+        "route": "/points",
+        "run": _http_scenario("GET", lambda rng: "/points"),
+    },
+    "points_calculation": {
+        "route": None,
+        "local_only": True,
+        "run": _points_calculation,
+    },
+}
+
+
+def run_scenario(target, name: str, usernames: List[str], iterations: int, warmup: int, seed: int) -> Dict[str, Any]:
+    from database import SessionLocal
+    from models import User
+
+    scenario = SCENARIOS[name]
+    rng = random.Random(f"{seed}:{name}")
+
+    # ユーザーIDの解決（サービス層のシナリオ用）
+    db = SessionLocal()
+    try:
+        user_ids = {
+            u.username: u.id
+            for u in db.query(User).filter(User.username.in_(usernames)).all()
+        }
+    finally:
+        db.close()
+
+    latencies, query_counts, errors = [], [], 0
+    for i in range(warmup + iterations):
+        username = usernames[i % len(usernames)]
+        target.login(username)
+        target.current_user_id = user_ids.get(username)
+        t0 = time.perf_counter()
+        try:
+            ok, queries = scenario["run"](target, rng)
+        except Exception:
+            ok, queries = False, None
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        if i < warmup:
+            continue
+        if not ok:
+            errors += 1
+            continue
+        latencies.append(elapsed_ms)
+        if queries is not None:
+            query_counts.append(queries)
+    # ログイン時間を除いた、計測対象リクエストのみの所要時間でスループットを求める
+    result = summarize(latencies, query_counts, errors, sum(latencies) / 1000)
+    result["route"] = scenario["route"]
+    return result
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    except Exception:
+        return None
+
+
+def run_benchmarks(
+    iterations: int = 100,
+    warmup: int = 10,
+    users: int = 20,
+    weeks: int = 8,
+    records_per_week: int = 5,
+    seed: int = 42,
+    scenarios: Optional[List[str]] = None,
+    target_url: Optional[str] = None,
+) -> Dict[str, Any]:
+    """ベンチマークを実行して結果の辞書を返す（DATABASE_URL は呼び出し前に設定しておく）"""
+    from database import engine
+
+    usernames = seed_synthetic_database(users, weeks, records_per_week, seed)
+    target = HttpTarget(target_url) if target_url else TestClientTarget()
+
+    names = scenarios or list(SCENARIOS)
+    results = {}
+    for name in names:
+        if target_url and SCENARIOS[name].get("local_only"):
+            continue
+        click.echo(f"計測中: {name} ...")
+        results[name] = run_scenario(target, name, usernames, iterations, warmup, seed)
+        r = results[name]
+        click.echo(
+            f"  p50={r['p50_ms']:.2f}ms p95={r['p95_ms']:.2f}ms p99={r['p99_ms']:.2f}ms "
+            f"queries={r.get('queries_mean', '-')} errors={r['errors']}"
+        )
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "target": target.name,
+            "database_backend": engine.dialect.name,
+            "seed": seed,
+            "iterations": iterations,
+            "warmup": warmup,
+            "users": users,
+            "weeks": weeks,
+            "records_per_week": records_per_week,
+        },
+        "scenarios": results,
+    }
+
+
+# --- 回帰チェック（保存済みベースラインとの比較・ルートごとの予算） ---
+
+# ルート（ルートを持たないシナリオはシナリオ名）ごとの予算
+# max_queries はリクエスト1回あたりの SQL 実行数の上限、p95_ms は p95 レイテンシの上限
+ROUTE_BUDGETS: Dict[str, Dict[str, float]] = {
+    "/input": {"max_queries": 25, "p95_ms": 300},
+    "/api/weekly_stats": {"max_queries": 3, "p95_ms": 100},
+    "/knowledge/": {"max_queries": 2, "p95_ms": 100},
+    "/points": {"max_queries": 2, "p95_ms": 100},
+    "points_calculation": {"max_queries": 20, "p95_ms": 200},
+}
+
+# ベースラインとの比較で回帰とみなす閾値
+REGRESSION_RELATIVE_THRESHOLD = 0.10  # 10% 以上の悪化
+REGRESSION_NOISE_FACTOR = 2.0  # サンプルの IQR の何倍までをノイズとみなすか
+REGRESSION_MIN_DELTA_MS = 1.0  # これ未満の差は無視する
+QUERY_COUNT_TOLERANCE = 0.5  # クエリ数（平均）の許容増加量
+
+# 比較結果が信頼できるかどうかの判定に使うメタ情報
+COMPARABLE_META_KEYS = ("target", "database_backend", "seed", "users", "weeks", "records_per_week")
+
+
+def interquartile_range(samples: List[float]) -> float:
+    values = sorted(samples)
+    return percentile(values, 75) - percentile(values, 25)
+
+
+def budget_key(name: str, scenario: Dict[str, Any]) -> str:
+    return scenario.get("route") or name
+
+
+def compare_scenario(
+    name: str,
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    relative_threshold: float = REGRESSION_RELATIVE_THRESHOLD,
+    noise_factor: float = REGRESSION_NOISE_FACTOR,
+    min_delta_ms: float = REGRESSION_MIN_DELTA_MS,
+) -> List[Dict[str, Any]]:
+    """1シナリオの p50/p95 とクエリ数を比較し、閾値を超えた変化を返す
+
+    閾値は「相対閾値」「サンプルのばらつき（IQR）の noise_factor 倍」「最小差」の最大値。
+    ばらつきの大きいシナリオほど閾値が広がるため、計測ノイズによる誤検知を抑えられる。
+    """
+    findings = []
+    noise = noise_factor * max(
+        interquartile_range(baseline.get("samples_ms", [])),
+        interquartile_range(current.get("samples_ms", [])),
+    )
+    for metric in ("p50_ms", "p95_ms"):
+        before, after = baseline[metric], current[metric]
+        delta = after - before
+        threshold = max(before * relative_threshold, noise, min_delta_ms)
+        if abs(delta) <= threshold:
+            continue
+        findings.append(
+            {
+                "scenario": name,
+                "metric": metric,
+                "baseline": before,
+                "current": after,
+                "delta": round(delta, 3),
+                "threshold": round(threshold, 3),
+                "kind": "regression" if delta > 0 else "improvement",
+            }
+        )
+
+    if "queries_mean" in baseline and "queries_mean" in current:
+        delta = current["queries_mean"] - baseline["queries_mean"]
+        if abs(delta) > QUERY_COUNT_TOLERANCE:
+            findings.append(
+                {
+                    "scenario": name,
+                    "metric": "queries_mean",
+                    "baseline": baseline["queries_mean"],
+                    "current": current["queries_mean"],
+                    "delta": round(delta, 2),
+                    "threshold": QUERY_COUNT_TOLERANCE,
+                    "kind": "regression" if delta > 0 else "improvement",
+                }
+            )
+    return findings
+
+
+def check_budgets(result: Dict[str, Any], budgets: Dict[str, Dict[str, float]] = None) -> List[Dict[str, Any]]:
+    """ルートごとの予算（クエリ数・p95）を超えたシナリオを返す"""
+    budgets = ROUTE_BUDGETS if budgets is None else budgets
+    violations = []
+    for name, scenario in result["scenarios"].items():
+        budget = budgets.get(budget_key(name, scenario))
+        if not budget:
+            continue
+        checks = (("max_queries", "queries_max"), ("p95_ms", "p95_ms"))
+        for budget_name, metric in checks:
+            limit = budget.get(budget_name)
+            value = scenario.get(metric)
+            if limit is None or value is None or value <= limit:
+                continue
+            violations.append(
+                {
+                    "scenario": name,
+                    "metric": metric,
+                    "current": value,
+                    "budget": limit,
+                    "kind": "budget",
+                }
+            )
+    return violations
+
+
+def compare_results(
+    baseline: Optional[Dict[str, Any]],
+    current: Dict[str, Any],
+    budgets: Dict[str, Dict[str, float]] = None,
+) -> Dict[str, Any]:
+    """ベースラインとの比較と予算チェックをまとめて行う"""
+    findings = []
+    warnings = []
+    if baseline is not None:
+        for key in COMPARABLE_META_KEYS:
+            before = baseline.get("meta", {}).get(key)
+            after = current.get("meta", {}).get(key)
+            if before != after:
+                warnings.append(f"計測条件が異なります: {key} ({before} -> {after})")
+        for name, scenario in current["scenarios"].items():
+            if name not in baseline["scenarios"]:
+                warnings.append(f"ベースラインにないシナリオです: {name}")
+                continue
+            findings.extend(compare_scenario(name, baseline["scenarios"][name], scenario))
+    findings.extend(check_budgets(current, budgets))
+    failed = any(f["kind"] in ("regression", "budget") for f in findings)
+    return {"passed": not failed, "findings": findings, "warnings": warnings}
+
+
+def _echo_report(report: Dict[str, Any]) -> None:
+    for warning in report["warnings"]:
+        click.echo(f"警告: {warning}")
+    for f in report["findings"]:
+        if f["kind"] == "budget":
+            click.echo(
+                f"予算超過: {f['scenario']} {f['metric']}={f['current']} (予算 {f['budget']})"
+            )
+        else:
+            label = "回帰" if f["kind"] == "regression" else "改善"
+            click.echo(
+                f"{label}: {f['scenario']} {f['metric']} {f['baseline']} -> {f['current']} "
+                f"(差 {f['delta']:+}, 閾値 {f['threshold']})"
+            )
+    click.echo("判定: OK" if report["passed"] else "判定: 性能回帰を検出しました")
+
+
+def _load_json(path: Optional[str]) -> Optional[Dict[str, Any]]:
+    if not path:
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_result(result: Dict[str, Any], output: Optional[str]) -> str:
+    if output is None:
+        output = f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    return output
+
+
+def _prepare_environment(database_url: Optional[str]) -> Optional[str]:
+    """app/database をインポートする前に DB とクエリ数ヘッダーの設定を行う"""
+    temp_path = None
+    if database_url:
+        os.environ["DATABASE_URL"] = database_url
+    elif not os.getenv("DATABASE_URL"):
+        fd, temp_path = tempfile.mkstemp(prefix="benchmark_", suffix=".db")
+        os.close(fd)
+        os.environ["DATABASE_URL"] = f"sqlite:///{temp_path}"
+    os.environ.setdefault("SQL_STATS_HEADER", "1")
+    # クエリ数は結果に記録されるので、リクエストごとの予算超過ログは抑制する
+    logging.getLogger("sql_instrumentation").setLevel(logging.ERROR)
+    return temp_path
+
+
+def _run_with_options(database_url, **kwargs) -> Dict[str, Any]:
+    temp_path = _prepare_environment(database_url)
+    try:
+        return run_benchmarks(**kwargs)
+    finally:
+        if temp_path:
+            from database import engine, remove_sqlite_files
+
+            engine.dispose()
+            remove_sqlite_files(temp_path)
+
+
+def run_options(func):
+    """run / gate 共通のオプション"""
+    options = [
+        click.option("--iterations", default=100, show_default=True, help="シナリオごとの計測回数"),
+        click.option("--warmup", default=10, show_default=True, help="計測前のウォームアップ回数"),
+        click.option("--users", default=20, show_default=True, help="合成ユーザー数"),
+        click.option("--weeks", default=8, show_default=True, help="合成データの週数"),
+        click.option("--records-per-week", default=5, show_default=True),
+        click.option("--seed", default=42, show_default=True),
+        click.option("--scenario", "scenarios", multiple=True, type=click.Choice(list(SCENARIOS))),
+        click.option("--database-url", default=None, help="未指定の場合は一時的な SQLite ファイルを使用"),
+        click.option("--target", "target_url", default=None, help="起動中のサーバーのURL（未指定ならテストクライアント）"),
+        click.option("--output", default=None, help="結果を保存する JSON ファイル"),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+@click.group()
+def cli():
+    """ベンチマーク管理ツール"""
+    pass
+
+
+@cli.command("run")
+@run_options
+def run_command(database_url, output, scenarios, **kwargs):
+    """ベンチマークを実行する"""
+    result = _run_with_options(database_url, scenarios=list(scenarios) or None, **kwargs)
+    click.echo(f"結果を保存しました: {_write_result(result, output)}")
+
+
+@cli.command("compare")
+@click.argument("baseline_path", type=click.Path(exists=True))
+@click.argument("current_path", type=click.Path(exists=True))
+@click.option("--budgets", "budgets_path", default=None, type=click.Path(exists=True), help="ルート予算を上書きする JSON")
+def compare_command(baseline_path, current_path, budgets_path):
+    """保存済みの結果同士を比較し、回帰があれば終了コード 1 を返す"""
+    report = compare_results(
+        _load_json(baseline_path), _load_json(current_path), _load_json(budgets_path)
+    )
+    _echo_report(report)
+    sys.exit(0 if report["passed"] else 1)
+
+
+@cli.command("gate")
+@run_options
+@click.option("--baseline", "baseline_path", default=None, help="比較するベースライン（未指定・存在しない場合は予算のみチェック）")
+@click.option("--budgets", "budgets_path", default=None, type=click.Path(exists=True), help="ルート予算を上書きする JSON")
+@click.option("--update-baseline", is_flag=True, help="合格した場合に結果をベースラインとして保存する")
+def gate_command(database_url, output, scenarios, baseline_path, budgets_path, update_baseline, **kwargs):
+    """ベンチマークを実行してベースライン・予算と比較する（デプロイ前チェック用）"""
+    baseline = None
+    if baseline_path and os.path.exists(baseline_path):
+        baseline = _load_json(baseline_path)
+    elif baseline_path:
+        click.echo(f"ベースラインが見つかりません: {baseline_path}（予算のみチェックします）")
+
+    result = _run_with_options(database_url, scenarios=list(scenarios) or None, **kwargs)
+    if output:
+        _write_result(result, output)
+    report = compare_results(baseline, result, _load_json(budgets_path))
+    _echo_report(report)
+    if report["passed"] and update_baseline and baseline_path:
+        click.echo(f"ベースラインを更新しました: {_write_result(result, baseline_path)}")
+    sys.exit(0 if report["passed"] else 1)
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -1,6 +1,8 @@
 import openai
 import os
+import time
 from dotenv import load_dotenv
+from metrics import LLM_LATENCY
 
 # .envファイルを読み込み
 load_dotenv()
@@ -31,14 +33,24 @@ def generate_recipe_from_text(user_text: str) -> str:
     if not user_text or not user_text.strip():
         raise ValueError("入力テキストが空です")
 
-    response = openai.ChatCompletion.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": user_text}
-        ],
-        max_tokens=400,
-        temperature=0.6
-    )
+    outcome = "error"
+    start = time.perf_counter()
+    try:
+        response = openai.ChatCompletion.create(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": user_text}
+            ],
+            max_tokens=400,
+            temperature=0.6
+        )
+        outcome = "success"
+    finally:
+        LLM_LATENCY.observe(
+            time.perf_counter() - start,
+            function="generate_recipe_from_text",
+            outcome=outcome,
+        )
 
     return response.choices[0].message["content"].strip()
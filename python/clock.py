@@ -0,0 +1,56 @@
+"""
+現在時刻の取得を1か所にまとめる
+
+ポイント計算や週次集計は「今」を基準に動くため、datetime.now() を直接呼ばずに
+clock.now() を使う。シミュレーションやテストでは use_clock() で時刻を差し替えられる。
+"""
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Callable
+
+_now_func: Callable[[], datetime] = datetime.now
+
+
+def now() -> datetime:
+    return _now_func()
+
+
+def today() -> date:
+    return _now_func().date()
+
+
+def set_clock(func: Callable[[], datetime]) -> None:
+    global _now_func
+    _now_func = func
+
+
+def reset_clock() -> None:
+    set_clock(datetime.now)
+
+
+@contextmanager
+def use_clock(func: Callable[[], datetime]):
+    """with ブロックの間だけ時刻の取得元を差し替える"""
+    previous = _now_func
+    set_clock(func)
+    try:
+        yield func
+    finally:
+        set_clock(previous)
+
+
+class FrozenClock:
+    """明示的に進めるまで止まっている時計（シミュレーション・テスト用）"""
+
+    def __init__(self, current: datetime):
+        self.current = current
+
+    def __call__(self) -> datetime:
+        return self.current
+
+    def set(self, current: datetime) -> None:
+        self.current = current
+
+    def advance(self, **kwargs) -> datetime:
+        self.current += timedelta(**kwargs)
+        return self.current
@@ -5,3 +5,55 @@ import sys
 ROOT = os.path.dirname(__file__)
 if ROOT not in sys.path:
     sys.path.insert(0, ROOT)
+
+
+def _test_database_url() -> str:
+    """テスト用の DB（既定はプロセスごとのインメモリ SQLite）
+
+    本番の DATABASE_URL / db_* には接続しない。PostgreSQL などで実行したい場合は
+    TEST_DATABASE_URL を指定する。ファイルの SQLite を指定した場合は pytest-xdist の
+    ワーカーごとに別ファイルにする。
+    """
+    url = os.environ.get("TEST_DATABASE_URL", "sqlite://")
+    worker = os.environ.get("PYTEST_XDIST_WORKER")
+    if worker and url.startswith("sqlite:///") and url != "sqlite:///:memory:":
+        base, ext = os.path.splitext(url)
+        url = f"{base}_{worker}{ext or '.db'}"
+    return url
+
+
+# database.py はインポート時にエンジンを作成するため、アプリのモジュールより先に設定する
+os.environ["DATABASE_URL"] = _test_database_url()
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def database_engine():
+    """テーブルと初期データ（廃棄理由）をセッションの最初に1回だけ作成する"""
+    from database import engine, init_db
+
+    init_db()
+    yield engine
+
+
+@pytest.fixture
+def db(database_engine):
+    """テストごとにトランザクションを張り、終了時にロールバックする
+
+    アプリ側の commit() は SAVEPOINT の解放になるため、テスト中に作成したデータは
+    後片付けなしで消える。app のルートが使う SessionLocal も同じ接続に向ける。
+    """
+    from database import SessionLocal
+
+    connection = database_engine.connect()
+    transaction = connection.begin()
+    SessionLocal.configure(bind=connection, join_transaction_mode="create_savepoint")
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        SessionLocal.configure(bind=database_engine, join_transaction_mode="conditional_savepoint")
+        transaction.rollback()
+        connection.close()
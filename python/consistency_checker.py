@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+ポイント付与フラグの整合性チェック（バッチ）
+
+users.last_points_awarded_week_start / last_points_awarded_date（その週・その日の評価が
+済んでいることを示すフラグ）を、実際の記録とポイント台帳に照らして確認し、一括で修復する。
+以前はポイント計算のたびにリクエストの中で修復していたが、その処理をここに移した。
+記録には保管した記録の日ごとの集計（archive.py）も含める。
+
+ユーザーを ID 順に chunk_size 人ずつ読み、チャンクごとに数本の集計クエリで判定する。
+修復はフラグが読み込んだときの値のままの場合だけ更新する（実行中のリクエストが
+更新したフラグは上書きしない）。フラグを消しても台帳の idempotency_key により
+同じ週・同じ日のポイントが二重に付与されることはない。
+
+検出する不整合:
+    week_in_future       週のフラグが今週より先
+    week_without_records フラグの週に記録がない（記録の削除など）
+    week_missing_award   初回の週の記録が条件を満たしているのに付与がない
+    week_behind_ledger   台帳の最新の週次付与（記録のある週）よりフラグが古い
+    date_in_future       日のフラグが今日より先
+    date_without_records フラグの日に記録がない
+    date_behind_ledger   台帳の最新の毎日のボーナス（記録のある日）よりフラグが古い
+
+使用例:
+    python consistency_checker.py check                 # 検出のみ（不整合があれば終了コード 1）
+    python consistency_checker.py check --fix --output consistency.json
+"""
+import json
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import click
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.orm import Session
+
+import clock
+import points_ledger
+from archive import loss_rows
+from database import begin_write
+from models import PointsLedger, User
+from services import MIN_RECORD_WEIGHT
+from statistics import get_week_boundaries
+
+CHUNK_SIZE = 1000
+# レポートに含める不整合の例の件数
+REPORT_EXAMPLES = 20
+
+WEEK_FLAG = "last_points_awarded_week_start"
+DATE_FLAG = "last_points_awarded_date"
+
+
+def _week_days(week_start: str) -> List[str]:
+    start = datetime.strptime(week_start, "%Y-%m-%d")
+    return [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(7)]
+
+
+class _ChunkFacts:
+    """チャンク内のユーザーの記録と台帳の集計（ユーザーごとのクエリを避ける）"""
+
+    def __init__(self, db: Session, user_ids: List[int], since: Optional[str]):
+        # 保管した記録（日ごとの集計）も含める。フラグの日の記録が保管済みでも不整合としない
+        rows = loss_rows()
+        # フラグの中で最も古い日以降の、日ごとの記録量
+        self.grams: Dict[Tuple[int, str], float] = {}
+        if since is not None:
+            self.grams = {
+                (user_id, day): grams
+                for user_id, day, grams in db.execute(
+                    select(rows.c.user_id, rows.c.day, func.sum(rows.c.grams))
+                    .where(rows.c.user_id.in_(user_ids), rows.c.day >= since)
+                    .group_by(rows.c.user_id, rows.c.day)
+                )
+            }
+        self.first_day: Dict[int, str] = {
+            user_id: first
+            for user_id, first in db.execute(
+                select(rows.c.user_id, func.min(rows.c.day))
+                .where(rows.c.user_id.in_(user_ids))
+                .group_by(rows.c.user_id)
+            )
+        }
+        self.latest: Dict[Tuple[int, str], str] = {
+            (user_id, entry_type): reference
+            for user_id, entry_type, reference in db.execute(
+                select(PointsLedger.user_id, PointsLedger.entry_type, func.max(PointsLedger.reference))
+                .where(
+                    PointsLedger.user_id.in_(user_ids),
+                    PointsLedger.entry_type.in_((points_ledger.WEEKLY_AWARD, points_ledger.DAILY_BONUS)),
+                )
+                .group_by(PointsLedger.user_id, PointsLedger.entry_type)
+            )
+        }
+        self.awarded_weeks: Set[Tuple[int, str]] = set()
+        if since is not None:
+            self.awarded_weeks = {
+                (user_id, reference)
+                for user_id, reference in db.execute(
+                    select(PointsLedger.user_id, PointsLedger.reference).where(
+                        PointsLedger.user_id.in_(user_ids),
+                        PointsLedger.entry_type == points_ledger.WEEKLY_AWARD,
+                        PointsLedger.reference >= since,
+                    )
+                )
+            }
+
+    def grams_in_week(self, user_id: int, week_start: str) -> float:
+        return sum(self.grams.get((user_id, day), 0) for day in _week_days(week_start))
+
+
+def _check_user(user: Dict[str, Any], facts: _ChunkFacts, this_week: str, today: str) -> List[Dict[str, Any]]:
+    """1人分のフラグを判定し、修復内容（列・修復前・修復後）のリストを返す"""
+    issues = []
+    user_id = user["id"]
+
+    def issue(kind: str, column: str, new: Optional[str]) -> None:
+        issues.append({"user_id": user_id, "issue": kind, "column": column, "old": user[column], "new": new})
+
+    week = user[WEEK_FLAG]
+    latest_award = facts.latest.get((user_id, points_ledger.WEEKLY_AWARD))
+    if week is not None:
+        if week > this_week:
+            issue("week_in_future", WEEK_FLAG, latest_award if latest_award and latest_award <= this_week else None)
+        elif facts.grams_in_week(user_id, week) == 0:
+            issue("week_without_records", WEEK_FLAG, None)
+        elif (
+            facts.first_day.get(user_id, week) >= week
+            and facts.grams_in_week(user_id, week) >= MIN_RECORD_WEIGHT
+            and (user_id, week) not in facts.awarded_weeks
+        ):
+            # 初回の週（それより前の記録がない）は条件を満たせば必ず付与されるため、付与漏れ
+            issue("week_missing_award", WEEK_FLAG, None)
+        elif latest_award and week < latest_award <= this_week and facts.grams_in_week(user_id, latest_award) > 0:
+            issue("week_behind_ledger", WEEK_FLAG, latest_award)
+
+    day = user[DATE_FLAG]
+    latest_bonus = facts.latest.get((user_id, points_ledger.DAILY_BONUS))
+    if day is not None:
+        if day > today:
+            issue("date_in_future", DATE_FLAG, latest_bonus if latest_bonus and latest_bonus <= today else None)
+        elif facts.grams.get((user_id, day), 0) == 0:
+            issue("date_without_records", DATE_FLAG, None)
+        elif latest_bonus and day < latest_bonus <= today and facts.grams.get((user_id, latest_bonus), 0) > 0:
+            issue("date_behind_ledger", DATE_FLAG, latest_bonus)
+    return issues
+
+
+def _repair(db: Session, issues: List[Dict[str, Any]]) -> int:
+    """列ごとに一括で更新する（読み込んだときの値から変わっていない行だけ）。更新した件数を返す"""
+    repaired = 0
+    for column in (WEEK_FLAG, DATE_FLAG):
+        params = [
+            {"b_id": i["user_id"], "b_old": i["old"], "b_new": i["new"]} for i in issues if i["column"] == column
+        ]
+        if not params:
+            continue
+        flag = User.__table__.c[column]
+        statement = (
+            update(User.__table__)
+            .where(User.__table__.c.id == bindparam("b_id"), flag.is_not_distinct_from(bindparam("b_old")))
+            .values({column: bindparam("b_new")})
+        )
+        connection = db.connection()
+        result = connection.execute(statement, params)
+        # executemany の rowcount を正しく返さないドライバーでは件数を推定する
+        repaired += result.rowcount if connection.dialect.supports_sane_multi_rowcount else len(params)
+    return repaired
+
+
+def check_consistency(db: Session, fix: bool = False, chunk_size: int = CHUNK_SIZE) -> Dict[str, Any]:
+    """全ユーザーのフラグを確認し（fix=True なら修復し）、レポートを返す"""
+    started = time.perf_counter()
+    now = clock.now()
+    this_week = get_week_boundaries(now)[0].strftime("%Y-%m-%d")
+    today = now.strftime("%Y-%m-%d")
+
+    counts: Counter = Counter()
+    examples: List[Dict[str, Any]] = []
+    scanned = repaired = 0
+    last_id = 0
+    while True:
+        users = [
+            dict(row)
+            for row in db.execute(
+                select(User.id, User.last_points_awarded_week_start, User.last_points_awarded_date)
+                .where(User.id > last_id)
+                .order_by(User.id)
+                .limit(chunk_size)
+            ).mappings()
+        ]
+        if not users:
+            break
+        last_id = users[-1]["id"]
+        scanned += len(users)
+
+        flags = [u[c] for u in users for c in (WEEK_FLAG, DATE_FLAG) if u[c] is not None]
+        facts = _ChunkFacts(db, [u["id"] for u in users], min(flags) if flags else None)
+        issues = [i for user in users for i in _check_user(user, facts, this_week, today)]
+        counts.update(i["issue"] for i in issues)
+        examples.extend(issues[: REPORT_EXAMPLES - len(examples)])
+
+        if fix and issues:
+            db.rollback()
+            begin_write(db)
+            repaired += _repair(db, issues)
+            db.commit()
+        else:
+            # 読み取りのトランザクションを長く保持しない
+            db.rollback()
+
+    return {
+        "timestamp": now.isoformat(timespec="seconds"),
+        "users_scanned": scanned,
+        "issues": sum(counts.values()),
+        "issues_by_type": dict(sorted(counts.items())),
+        "repaired": repaired,
+        "examples": examples,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+@click.group()
+def cli():
+    """ポイント付与フラグの整合性チェックツール"""
+    pass
+
+
+@cli.command("check")
+@click.option("--fix", is_flag=True, help="検出した不整合を修復する")
+@click.option("--chunk-size", default=CHUNK_SIZE, show_default=True, help="1回に確認するユーザー数")
+@click.option("--output", default=None, help="レポートを保存する JSON ファイル")
+def check_command(fix, chunk_size, output):
+    """全ユーザーのポイント付与フラグを記録・台帳と照合する（修復しない場合、不整合があれば終了コード 1）"""
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        report = check_consistency(db, fix=fix, chunk_size=chunk_size)
+    finally:
+        db.close()
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    click.echo(f"{report['users_scanned']} 人を確認しました（{report['seconds']} 秒）")
+    for kind, count in report["issues_by_type"].items():
+        click.echo(f"  {kind}: {count} 件")
+    if not report["issues"]:
+        click.echo("✓ 不整合はありません")
+    elif fix:
+        click.echo(f"✓ {report['repaired']} 件を修復しました")
+    else:
+        click.echo(f"✗ {report['issues']} 件の不整合があります（--fix で修復）")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,10 +1,15 @@
 # database.py
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker
 from models import Base, User, LossReason, FoodLossRecord
-from sqlalchemy.pool import NullPool
+from metrics import install_pool_wait_listener
+from sharding import ShardRouter, parse_shard_urls
+from sqlalchemy.pool import NullPool, StaticPool
 import os
 import logging
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 import hashlib
@@ -21,21 +26,271 @@ HOST = os.getenv("db_host")
 PORT = os.getenv("db_port")
 DBNAME = os.getenv("db_dbname")
 
-DATABASE_URL = f"postgresql+psycopg2://{USER}:{PASSWORD}@{HOST}:{PORT}/{DBNAME}?sslmode=require"
-engine = create_engine(DATABASE_URL, poolclass=NullPool)
+# DATABASE_URL が設定されていればそれを優先（ベンチマーク・ローカル検証用）
+# 未設定の場合は従来どおり db_* 環境変数から Supabase/PostgreSQL の URL を組み立てる
+DATABASE_URL = os.getenv("DATABASE_URL") or (
+    f"postgresql+psycopg2://{USER}:{PASSWORD}@{HOST}:{PORT}/{DBNAME}?sslmode=require"
+)
+
+
+# --- SQLite モード（1校単位の小規模運用・テスト・ベンチマーク用） ---
+
+# 接続ごとに適用する PRAGMA（環境変数で調整可能）
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))  # 64MB
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # 256MB
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# 書き込みを行うトランザクションの BEGIN の種類（begin_write を参照）
+SQLITE_WRITE_BEGIN_MODE = "IMMEDIATE"
+SQLITE_BEGIN_MODES = ("DEFERRED", "IMMEDIATE", "EXCLUSIVE")
+
+
+def is_sqlite_memory_url(url: str) -> bool:
+    return url in ("sqlite://", "sqlite:///:memory:")
+
+
+def sqlite_path_from_url(url: str):
+    """SQLite ファイルの絶対パスを返す（SQLite 以外・インメモリの場合は None）"""
+    if not url.startswith("sqlite") or is_sqlite_memory_url(url):
+        return None
+    from sqlalchemy.engine import make_url
+
+    database = make_url(url).database
+    return os.path.abspath(database) if database else None
+
+
+def remove_sqlite_files(path: str) -> None:
+    """SQLite ファイルと WAL モードの付随ファイル（-wal, -shm）を削除する"""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def _install_sqlite_tuning(engine, is_memory: bool) -> None:
+    """接続時の PRAGMA 設定と、pysqlite のトランザクション制御の置き換え
+
+    既定の pysqlite は DML の直前まで BEGIN を遅らせるため、SAVEPOINT を使う
+    ネストしたトランザクション（テストのロールバックなど）が正しく動かない。
+    暗黙の BEGIN を無効にし、SQLAlchemy の begin イベントで発行する。
+    """
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+            if not is_memory:
+                # WAL: 読み取りと書き込みが互いをブロックしない。WAL では NORMAL でも破損しない
+                cursor.execute("PRAGMA journal_mode = WAL")
+                cursor.execute("PRAGMA synchronous = NORMAL")
+                cursor.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+            cursor.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}")
+            cursor.execute("PRAGMA temp_store = MEMORY")
+        finally:
+            cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def _emit_begin(conn):
+        mode = conn.get_execution_options().get("sqlite_begin_mode", "DEFERRED").upper()
+        if mode not in SQLITE_BEGIN_MODES:
+            raise ValueError(f"不明な sqlite_begin_mode: {mode}")
+        # ドライバーに直接発行して、SQL 計測（sql_instrumentation）の件数に含めない
+        conn.connection.driver_connection.execute(f"BEGIN {mode}")
+
+
+def create_database_engine(url: str):
+    """URL のバックエンドに応じた設定でエンジンを作成する（レプリカ・シャードも同じ計測を付ける）"""
+    if url.startswith("sqlite"):
+        # スレッドをまたいで同じ接続を使えるようにする（gunicorn のスレッドワーカー・テスト用）
+        connect_args = {"check_same_thread": False}
+        is_memory = is_sqlite_memory_url(url)
+        if is_memory:
+            # インメモリ DB は接続ごとに別の DB になるため、1つの接続を共有する
+            sqlite_engine = create_engine(url, connect_args=connect_args, poolclass=StaticPool)
+        else:
+            path = sqlite_path_from_url(url)
+            if path:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            sqlite_engine = create_engine(url, connect_args=connect_args)
+        _install_sqlite_tuning(sqlite_engine, is_memory)
+        install_pool_wait_listener(sqlite_engine)
+        return sqlite_engine
+    new_engine = create_engine(url, poolclass=NullPool)
+    install_pool_wait_listener(new_engine)
+    return new_engine
+
+
+engine = create_database_engine(DATABASE_URL)
 
 # データベースセッションを作成
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
-def get_db():
-    db = SessionLocal()
+def get_db(user_id=None):
+    """セッションを返す。シャーディング時に user_id を渡すと、そのユーザーのシャードに接続する"""
+    db = shard_router.session_for(user_id) if shard_router is not None and user_id is not None else SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
 
+# --- ユーザー ID によるシャーディング（任意、sharding.py を参照） ---
+
+# "shard0=URL,shard1=URL"。設定した場合、ユーザーのデータはユーザー ID のハッシュで各シャードに置く
+# DATABASE_URL には最初のシャードを指定する（ユーザーに属さない処理はそこで行う）
+DATABASE_SHARD_URLS = os.getenv("DATABASE_SHARD_URLS")
+shard_router = (
+    ShardRouter.from_urls(parse_shard_urls(DATABASE_SHARD_URLS), create_database_engine)
+    if DATABASE_SHARD_URLS
+    else None
+)
+
+
+# --- 読み取り専用レプリカ（任意） ---
+
+# 設定した場合、読み取りのみのルート・関数（get_read_db / read_session）はレプリカから読む
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+# ユーザーが書き込んでからこの秒数は、そのユーザーの読み取りもプライマリで行う（read-your-writes）
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+# レプリカの遅延がこれを超えたら、またはレプリカに接続できなければプライマリで読む
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "10"))
+# レプリカの状態を確認し直す間隔（秒）。リクエストごとには確認しない
+REPLICA_HEALTH_CHECK_INTERVAL = float(os.getenv("REPLICA_HEALTH_CHECK_INTERVAL", "5"))
+# 最後に書き込んだ時刻（time.time()）を保存する Flask セッションのキー
+LAST_WRITE_SESSION_KEY = "last_write_at"
+
+# PostgreSQL のストリーミングレプリカの遅延（秒）。受信済みの WAL をすべて適用済みなら 0
+# レプリカでない（通常のサーバー）場合は NULL になるため 0 とみなす
+_PG_REPLICA_LAG_SQL = (
+    "SELECT COALESCE(CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END, 0)"
+)
+
+
+class ReplicaRouter:
+    """読み取りに使うエンジンを選ぶ（レプリカが使えない場合は None = プライマリ）"""
+
+    def __init__(
+        self,
+        replica,
+        sticky_seconds: float = REPLICA_STICKY_SECONDS,
+        max_lag_seconds: float = REPLICA_MAX_LAG_SECONDS,
+        check_interval: float = REPLICA_HEALTH_CHECK_INTERVAL,
+    ):
+        self.replica = replica
+        self.sticky_seconds = sticky_seconds
+        self.max_lag_seconds = max_lag_seconds
+        self.check_interval = check_interval
+        self.lag = None
+        self._healthy = False
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()
+        if replica is not None:
+            event.listen(replica, "handle_error", self._on_error)
+
+    def _on_error(self, context) -> None:
+        # 接続断などでレプリカのクエリが失敗したら、次の確認まではプライマリで読む
+        if context.is_disconnect or isinstance(context.sqlalchemy_exception, OperationalError):
+            self.mark_unhealthy()
+
+    def mark_unhealthy(self) -> None:
+        with self._lock:
+            self._healthy = False
+            self._checked_at = time.monotonic()
+
+    def _probe(self) -> float:
+        with self.replica.connect() as conn:
+            if conn.dialect.name == "postgresql":
+                return float(conn.exec_driver_sql(_PG_REPLICA_LAG_SQL).scalar())
+            conn.exec_driver_sql("SELECT 1")
+            return 0.0
+
+    def healthy(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return self._healthy
+            # 確認中は他のスレッドは前回の結果を使う
+            self._checked_at = now
+        try:
+            lag = self._probe()
+            healthy = lag <= self.max_lag_seconds
+            if not healthy:
+                logger.warning(f"レプリカの遅延が {lag:.1f} 秒のため、プライマリから読み取ります")
+        except Exception as e:
+            lag, healthy = None, False
+            logger.warning(f"レプリカに接続できないため、プライマリから読み取ります: {e}")
+        with self._lock:
+            self.lag, self._healthy = lag, healthy
+        return healthy
+
+    def engine_for_read(self, last_write_at=None):
+        """読み取りに使うエンジン（プライマリを使う場合は None）"""
+        if self.replica is None:
+            return None
+        if last_write_at is not None and time.time() - last_write_at < self.sticky_seconds:
+            return None
+        return self.replica if self.healthy() else None
+
+
+replica_engine = create_database_engine(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL else None
+replica_router = ReplicaRouter(replica_engine)
+
+
+def read_session(last_write_at=None, user_id=None):
+    """読み取り専用の処理に使うセッション
+
+    レプリカが設定されていて正常なら、レプリカに接続する。last_write_at（そのユーザーが
+    最後に書き込んだ時刻）から REPLICA_STICKY_SECONDS 以内の場合は、自分の書き込みが
+    見えるようプライマリに接続する。シャーディング時に user_id を渡すと、そのユーザーの
+    シャードに接続する。このセッションで書き込みを行わないこと。
+    """
+    if shard_router is not None and user_id is not None:
+        return shard_router.session_for(user_id)
+    read_engine = replica_router.engine_for_read(last_write_at)
+    return SessionLocal(bind=read_engine) if read_engine is not None else SessionLocal()
+
+
+def get_read_db(last_write_at=None, user_id=None):
+    db = read_session(last_write_at, user_id)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def begin_write(db) -> None:
+    """これから書き込みを行うトランザクションを開始する
+
+    SQLite では BEGIN IMMEDIATE で最初に書き込みロックを取得する。
+    DEFERRED のまま読み取り後に書き込もうとすると、他のワーカーの書き込みと競合した際に
+    busy_timeout で待たずに "database is locked" になるため。
+    PostgreSQL では何もしない（通常どおり最初のクエリでトランザクションが始まる）。
+    すでにトランザクションが始まっている場合も何もしない。
+    """
+    if db.in_transaction() or db.get_bind().dialect.name != "sqlite":
+        return
+    db.connection(execution_options={"sqlite_begin_mode": SQLITE_WRITE_BEGIN_MODE})
+
+
+def reset_id_sequences(connection, tables) -> None:
+    """ID を明示して投入した後、PostgreSQL のシーケンスを最大値に合わせる"""
+    if connection.dialect.name != "postgresql":
+        return
+    for table in tables:
+        connection.execute(
+            text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"(SELECT COALESCE(MAX(id), 1) FROM {table}))"
+            )
+        )
+
+
+# 初期データとして投入する廃棄理由
+DEFAULT_LOSS_REASONS = ("期限切れ", "調理中の廃棄", "料理後の廃棄", "調理失敗", "その他", "食べ残し")
+
+
 def init_db():
     # PostgreSQL/Supabaseの場合はディレクトリ作成不要
     Base.metadata.create_all(bind=engine)
@@ -45,14 +300,7 @@ def init_db():
     try:
         # 1. 初期廃棄理由の投入 (既存ロジック)
         if not db.query(LossReason).first():
-            reasons = [
-                LossReason(reason_text="期限切れ"),
-                LossReason(reason_text="調理中の廃棄"),
-                LossReason(reason_text="料理後の廃棄"),
-                LossReason(reason_text="調理失敗"),
-                LossReason(reason_text="その他"),
-                LossReason(reason_text="食べ残し")
-            ]
+            reasons = [LossReason(reason_text=text) for text in DEFAULT_LOSS_REASONS]
             db.add_all(reasons)
             db.commit()
             print("Loss reasons added.")
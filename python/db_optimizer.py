@@ -1,145 +1,768 @@
 """
 データベース最適化とバックアップスクリプト
+
+DATABASE_URL のバックエンド（PostgreSQL / SQLite）に応じて動作する。
+
+- statistics.py / services.py / final_report.py のよく使うクエリを実際に実行して取得し、
+  実行計画（PostgreSQL は EXPLAIN (ANALYZE)、SQLite は EXPLAIN QUERY PLAN）を確認する
+- シーケンシャルスキャン・不要行（bloat）・未使用/重複インデックスを報告する（PostgreSQL は pg_stat_*）
+- models.py で宣言したインデックスのうち不足しているものを作成する（PostgreSQL は CREATE INDEX CONCURRENTLY）
+- 更新量に応じて VACUUM / ANALYZE を実行する（cron から maintain を定期実行する）
+- 稼働中のまま重複排除・圧縮したバックアップを作成し、復元を検証する（backup_store.py）
+
+使用例:
+    python db_optimizer.py report --output db_report.json
+    python db_optimizer.py indexes --apply
+    python db_optimizer.py maintain --create-indexes
+    python db_optimizer.py backup
+    python db_optimizer.py restore-verify
+    python db_optimizer.py restore --id 20250101_020000_000000
 """
 import sqlite3
 import os
-import shutil
 import datetime
+import json
+import subprocess
+import sys
+import tempfile
+import time
 from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import click
+
+# この行数未満のテーブルのシーケンシャルスキャンは問題にしない
+SEQ_SCAN_MIN_ROWS = 1000
+# 最後の ANALYZE 以降に変更された行の割合がこれを超えたら ANALYZE する
+ANALYZE_CHANGE_RATIO = 0.1
+# 不要行（dead tuple）の割合がこれを超えたら VACUUM する
+VACUUM_DEAD_RATIO = 0.2
+# SQLite の空きページの割合がこれを超えたら VACUUM する
+SQLITE_VACUUM_FREE_RATIO = 0.2
+
+
+def backup_sqlite_database(source_path, dest_path):
+    """稼働中（WAL モード）の SQLite データベースを一貫した状態でコピーする"""
+    source = sqlite3.connect(source_path)
+    dest = sqlite3.connect(dest_path)
+    try:
+        with dest:
+            source.backup(dest)
+    finally:
+        dest.close()
+        source.close()
+
+
+def hot_query_sources(db, user_id: int) -> List[tuple]:
+    """実行計画を確認するクエリの呼び出し元（名前, 関数）"""
+    import clock
+    import services
+    import statistics
+    from final_report import FinalReportGenerator
+
+    report = FinalReportGenerator(db)
+    return [
+        ("statistics.calculate_weekly_statistics", lambda: statistics.calculate_weekly_statistics(db, user_id, clock.now())),
+        ("statistics.get_last_two_weeks", lambda: statistics.get_last_two_weeks(db, user_id)),
+        ("statistics.get_total_grams_for_weeks", lambda: statistics.get_total_grams_for_weeks(db, user_id, 8)),
+        ("services.get_all_loss_reasons", lambda: services.get_all_loss_reasons(db)),
+        ("final_report.get_reason_analysis", report.get_reason_analysis),
+        ("final_report.get_timeline_analysis", report.get_timeline_analysis),
+        ("final_report.get_overall_summary", report.get_overall_summary),
+        ("final_report.get_weekly_comparison", report.get_weekly_comparison),
+        ("final_report.get_top_performers", report.get_top_performers),
+        ("final_report.participation_days", lambda: report._get_participation_days(user_id)),
+    ]
+
+
+def _walk_plan(node: Dict[str, Any]):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _walk_plan(child)
+
+
+def _sqlite_full_scan_table(detail: str) -> Optional[str]:
+    """EXPLAIN QUERY PLAN の行がテーブル全体のスキャンならテーブル名を返す"""
+    parts = detail.split()
+    if len(parts) < 2 or parts[0] != "SCAN" or "USING" in parts:
+        return None
+    return parts[2] if parts[1] == "TABLE" and len(parts) > 2 else parts[1]
+
 
 class DatabaseOptimizer:
     """データベース最適化クラス"""
-    
-    def __init__(self, db_path=None):
+
+    def __init__(self, db_path=None, engine=None):
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        project_root = os.path.dirname(current_dir)
+        if engine is None:
+            from database import engine
+        self.engine = engine
+        self.backend = engine.dialect.name
+        if db_path is None and self.backend == "sqlite":
+            db_path = engine.url.database and os.path.abspath(engine.url.database)
         if db_path is None:
-            # データベースファイルのパスを正しく設定
-            current_dir = os.path.dirname(__file__)
-            project_root = os.path.dirname(current_dir)
-            self.db_path = os.path.join(project_root, "db", "food_loss.db")
-        else:
-            self.db_path = db_path
-        
-        self.backup_dir = Path(os.path.dirname(current_dir)) / "backups"
-        self.backup_dir.mkdir(exist_ok=True)
-    
+            db_path = os.path.join(project_root, "db", "food_loss.db")
+        self.db_path = db_path
+
+        self.backup_dir = Path(os.getenv("BACKUP_DIR") or Path(project_root) / "backups")
+
+    @property
+    def is_postgres(self) -> bool:
+        return self.backend == "postgresql"
+
+    def _autocommit_connection(self):
+        """VACUUM / CREATE INDEX CONCURRENTLY はトランザクション外で実行する必要がある"""
+        return self.engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+
+    # --- バックアップ ---
+
+    @property
+    def backup_store(self):
+        from backup_store import BackupStore
+
+        return BackupStore(self.backup_dir)
+
+    def _pg_url(self) -> str:
+        return self.engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+
+    def _pg_dump_chunks(self):
+        """pg_dump の SQL 出力をそのまま（ファイルに書かずに）チャンクに分ける"""
+        from backup_store import line_chunks
+
+        process = subprocess.Popen(
+            ["pg_dump", "--format=plain", "--no-owner", "--no-privileges", self._pg_url()],
+            stdout=subprocess.PIPE,
+        )
+        try:
+            yield from line_chunks(process.stdout)
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+        if returncode != 0:
+            # 例外でマニフェストが書かれないため、不完全なバックアップは残らない
+            raise subprocess.CalledProcessError(returncode, "pg_dump")
+
     def create_backup(self):
-        """データベースのバックアップを作成"""
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        db_name = os.path.splitext(os.path.basename(self.db_path))[0]
-        backup_filename = f"{db_name}_backup_{timestamp}.db"
-        backup_path = self.backup_dir / backup_filename
-        
+        """データベースのオンラインバックアップを作成（変更のないチャンクは再利用して圧縮保存）"""
+        from backup_store import fixed_chunks, sqlite_snapshot
+
+        store = self.backup_store
         try:
-            if not os.path.exists(self.db_path):
-                print(f"データベースファイルが見つかりません: {self.db_path}")
-                return None
-                
-            shutil.copy2(self.db_path, backup_path)
-            print(f"バックアップ作成成功: {backup_path}")
-            return str(backup_path)
+            if self.is_postgres:
+                manifest = store.write(
+                    self._pg_dump_chunks(),
+                    {"backend": "postgresql", "database": self.engine.url.database, "format": "sql"},
+                )
+            else:
+                if not os.path.exists(self.db_path):
+                    print(f"データベースファイルが見つかりません: {self.db_path}")
+                    return None
+
+                # WAL モードではファイルのコピーだと未チェックポイントの書き込みが漏れるため、
+                # SQLite のオンラインバックアップ API でスナップショットを作ってからチャンクに分ける
+                self.backup_dir.mkdir(parents=True, exist_ok=True)
+                fd, snapshot_path = tempfile.mkstemp(dir=self.backup_dir, prefix=".snapshot-", suffix=".db")
+                os.close(fd)
+                try:
+                    sqlite_snapshot(self.db_path, snapshot_path)
+                    with open(snapshot_path, "rb") as f:
+                        manifest = store.write(
+                            fixed_chunks(f),
+                            {"backend": "sqlite", "database": os.path.basename(self.db_path), "format": "sqlite"},
+                        )
+                finally:
+                    os.remove(snapshot_path)
+
+            print(
+                f"バックアップ作成成功: {manifest['id']} "
+                f"({manifest['size_bytes']} bytes, 新規チャンク {manifest['new_chunks']}/{len(manifest['chunks'])}, "
+                f"保存 {manifest['stored_bytes']} bytes, {manifest['seconds']}秒)"
+            )
+            return str(store.manifest_dir / f"{manifest['id']}.json")
         except Exception as e:
             print(f"バックアップ作成エラー: {e}")
             return None
-    
-    def optimize_database(self):
-        """データベースの最適化"""
+
+    def restore_backup(self, backup_id=None, target=None) -> Dict[str, Any]:
+        """バックアップを復元する
+
+        SQLite は target のファイルに、PostgreSQL は target の URL に psql で流し込む
+        （target は空のデータベースを指定する）。
+        """
+        store = self.backup_store
+        manifest = store.get(backup_id)
+        started = time.perf_counter()
+        if manifest["backend"] == "sqlite":
+            temp_path = f"{target}.restoring"
+            with open(temp_path, "wb") as f:
+                for data in store.read(manifest):
+                    f.write(data)
+            os.replace(temp_path, target)
+        else:
+            process = subprocess.Popen(
+                ["psql", "--quiet", "--single-transaction", "-v", "ON_ERROR_STOP=1", target],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+            )
+            try:
+                for data in store.read(manifest):
+                    process.stdin.write(data)
+            finally:
+                process.stdin.close()
+                if process.wait() != 0:
+                    raise subprocess.CalledProcessError(process.returncode, "psql")
+        return {"id": manifest["id"], "restore_seconds": round(time.perf_counter() - started, 3)}
+
+    def restore_live(self, backup_id=None) -> Dict[str, Any]:
+        """稼働中のデータベースをバックアップの内容に置き換える（デプロイのロールバック用）
+
+        アプリを停止してから実行する。SQLite はファイルを置き換え、古い WAL・共有メモリの
+        ファイルを削除する（残っていると置き換えた後のファイルに古い WAL が適用されるため）。
+        PostgreSQL は public スキーマを作り直してから psql で流し込む。
+        """
+        if self.is_postgres:
+            with self._autocommit_connection() as conn:
+                conn.exec_driver_sql("DROP SCHEMA public CASCADE")
+                conn.exec_driver_sql("CREATE SCHEMA public")
+            return self.restore_backup(backup_id, self._pg_url())
+
+        self.engine.dispose()
+        result = self.restore_backup(backup_id, self.db_path)
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+        return result
+
+    def verify_restore(self, backup_id=None, target_url=None) -> Dict[str, Any]:
+        """バックアップを一時的な場所に復元して検証し、復旧にかかる時間を計測する
+
+        SQLite は一時ファイルに復元して integrity_check と行数を確認する。
+        PostgreSQL は target_url（検証用の空のデータベース）があれば psql で復元し、
+        なければチャンクの展開とハッシュの検証のみ行う。
+        """
+        store = self.backup_store
+        manifest = store.get(backup_id)
+        result = {"id": manifest["id"], "backend": manifest["backend"], "size_bytes": manifest["size_bytes"]}
+
+        if manifest["backend"] == "sqlite":
+            with tempfile.TemporaryDirectory() as temp_dir:
+                target = os.path.join(temp_dir, "restore.db")
+                result.update(self.restore_backup(manifest["id"], target))
+                started = time.perf_counter()
+                conn = sqlite3.connect(target)
+                try:
+                    result["integrity"] = conn.execute("PRAGMA integrity_check").fetchone()[0]
+                    tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+                    result["row_counts"] = {
+                        table: conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in tables
+                    }
+                finally:
+                    conn.close()
+                result["verify_seconds"] = round(time.perf_counter() - started, 3)
+        elif target_url:
+            result.update(self.restore_backup(manifest["id"], target_url))
+            result["integrity"] = "ok"
+        else:
+            started = time.perf_counter()
+            for _ in store.read(manifest):
+                pass
+            result["restore_seconds"] = round(time.perf_counter() - started, 3)
+            result["integrity"] = "ok"
+
+        seconds = result["restore_seconds"] + result.get("verify_seconds", 0.0)
+        result["recovery_seconds"] = round(seconds, 3)
+        result["mb_per_second"] = round(manifest["size_bytes"] / 1024 / 1024 / seconds, 1) if seconds else 0.0
+        return result
+
+    # --- 実行計画 ---
+
+    def capture_hot_queries(self, user_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """よく使うクエリを実行し、発行された SELECT 文とパラメータを重複なしで取得する"""
+        from sqlalchemy import event, func
+        from sqlalchemy.orm import Session
+
+        from models import FoodLossRecord
+        from sql_instrumentation import normalize_statement
+
+        captured: Dict[str, Dict[str, Any]] = {}
+        current = {"source": None}
+
+        def _capture(conn, cursor, statement, parameters, context, executemany):
+            if executemany or not statement.lstrip().upper().startswith("SELECT"):
+                return
+            shape = normalize_statement(statement)
+            if shape not in captured:
+                captured[shape] = {"source": current["source"], "statement": statement, "parameters": parameters}
+
+        db = Session(bind=self.engine)
         try:
-            conn = sqlite3.connect(self.db_path)
-            
-            # VACUUMでデータベースを最適化
-            print("データベースを最適化中...")
-            conn.execute("VACUUM")
-            
-            # 統計情報を更新
-            conn.execute("ANALYZE")
-            
-            conn.close()
-            print("データベース最適化完了")
-            
-        except Exception as e:
-            print(f"データベース最適化エラー: {e}")
-    
+            if user_id is None:
+                # 記録が最も多いユーザーで計測する（履歴の多いユーザーほど遅くなるため）
+                user_id = (
+                    db.query(FoodLossRecord.user_id)
+                    .group_by(FoodLossRecord.user_id)
+                    .order_by(func.count(FoodLossRecord.id).desc())
+                    .limit(1)
+                    .scalar()
+                ) or 0
+            event.listen(self.engine, "before_cursor_execute", _capture)
+            try:
+                for source, call in hot_query_sources(db, user_id):
+                    current["source"] = source
+                    call()
+            finally:
+                event.remove(self.engine, "before_cursor_execute", _capture)
+        finally:
+            db.rollback()
+            db.close()
+        return list(captured.values())
+
+    def explain_query(self, statement: str, parameters, row_counts: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        """1つのクエリの実行計画と実行時間、テーブル全体のスキャンを返す"""
+        with self.engine.connect() as conn:
+            if self.is_postgres:
+                rows = conn.exec_driver_sql(
+                    "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement, parameters
+                ).scalar()
+                plan = rows[0] if isinstance(rows, list) else json.loads(rows)[0]
+                seq_scans = [
+                    {"table": node["Relation Name"], "rows": node.get("Actual Rows", 0) + node.get("Rows Removed by Filter", 0)}
+                    for node in _walk_plan(plan["Plan"])
+                    if node.get("Node Type") == "Seq Scan"
+                ]
+                return {
+                    "execution_ms": round(plan.get("Execution Time", 0.0), 3),
+                    "seq_scans": seq_scans,
+                    "plan": plan["Plan"],
+                }
+
+            details = [
+                row[3]
+                for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+            ]
+            started = time.perf_counter()
+            conn.exec_driver_sql(statement, parameters).fetchall()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            # SQLite の実行計画には行数がないため、テーブルの行数で判断する
+            counts = row_counts if row_counts is not None else self.get_table_row_counts()
+            seq_scans = [
+                {"table": table, "rows": counts.get(table, 0)}
+                for table in filter(None, map(_sqlite_full_scan_table, details))
+            ]
+            return {"execution_ms": round(elapsed_ms, 3), "seq_scans": seq_scans, "plan": details}
+
+    def explain_hot_queries(self, user_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        results = []
+        row_counts = None if self.is_postgres else self.get_table_row_counts()
+        for query in self.capture_hot_queries(user_id):
+            explained = self.explain_query(query["statement"], query["parameters"], row_counts)
+            explained["large_seq_scans"] = [
+                scan for scan in explained["seq_scans"] if scan["rows"] >= SEQ_SCAN_MIN_ROWS
+            ]
+            results.append({"source": query["source"], "statement": query["statement"], **explained})
+        results.sort(key=lambda r: r["execution_ms"], reverse=True)
+        return results
+
+    # --- インデックス ---
+
+    def get_indexes(self) -> Dict[str, List[Dict[str, Any]]]:
+        """テーブルごとのインデックス（主キー・一意制約を含む）"""
+        from sqlalchemy import inspect
+
+        inspector = inspect(self.engine)
+        indexes = {}
+        for table in inspector.get_table_names():
+            entries = [
+                {"name": index["name"], "columns": tuple(index["column_names"]), "unique": bool(index.get("unique"))}
+                for index in inspector.get_indexes(table)
+            ]
+            primary_key = inspector.get_pk_constraint(table).get("constrained_columns")
+            if primary_key:
+                entries.append({"name": f"{table}_pkey", "columns": tuple(primary_key), "unique": True})
+            for constraint in inspector.get_unique_constraints(table):
+                entries.append({"name": constraint["name"], "columns": tuple(constraint["column_names"]), "unique": True})
+            indexes[table] = entries
+        return indexes
+
+    def missing_indexes(self) -> List[Dict[str, Any]]:
+        """models.py で宣言したインデックスのうち、先頭の列が一致する既存インデックスがないもの"""
+        from db_migration import model_indexes
+
+        indexes = self.get_indexes()
+        missing = []
+        for name, table, columns in model_indexes():
+            if table not in indexes:
+                continue
+            covered = any(index["columns"][: len(columns)] == columns for index in indexes[table])
+            if not covered:
+                missing.append({"name": name, "table": table, "columns": columns})
+        return missing
+
+    def redundant_indexes(self) -> List[Dict[str, Any]]:
+        """列が他のインデックスの先頭部分と一致する（不要な）インデックス"""
+        redundant = []
+        for table, entries in self.get_indexes().items():
+            for index in entries:
+                if index["unique"]:
+                    continue
+                for other in entries:
+                    if other is not index and len(other["columns"]) > len(index["columns"]) \
+                            and other["columns"][: len(index["columns"])] == index["columns"]:
+                        redundant.append({"table": table, "name": index["name"], "covered_by": other["name"]})
+                        break
+        return redundant
+
+    def index_ddl(self, index: Dict[str, Any]) -> str:
+        from db_migration import index_ddl
+
+        return index_ddl(self.backend, index["name"], index["table"], index["columns"])
+
+    def optimize_indexes(self, apply: bool = True) -> List[str]:
+        """不足しているインデックスを作成する（apply=False なら DDL を返すだけ）
+
+        通常は db_migration.py upgrade で作成される。マイグレーション導入前の DB や、
+        CONCURRENTLY の失敗で欠けた場合の補修用。
+        """
+        from db_migration import create_index
+
+        missing = self.missing_indexes()
+        statements = [self.index_ddl(index) for index in missing]
+        if not apply:
+            return statements
+        for index, statement in zip(missing, statements):
+            print(f"インデックス作成: {statement}")
+            if self.is_postgres:
+                # CONCURRENTLY は書き込みをブロックしないが、トランザクション内では実行できない
+                with self._autocommit_connection() as conn:
+                    create_index(conn, index["name"], index["table"], index["columns"])
+            else:
+                with self.engine.begin() as conn:
+                    create_index(conn, index["name"], index["table"], index["columns"])
+        return statements
+
     def add_indexes(self):
         """パフォーマンス向上のためのインデックス追加"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            indexes = [
-                "CREATE INDEX IF NOT EXISTS idx_food_loss_user_id ON food_loss_records(user_id)",
-                "CREATE INDEX IF NOT EXISTS idx_food_loss_record_date ON food_loss_records(record_date)",
-                "CREATE INDEX IF NOT EXISTS idx_user_username ON users(username)",
-                "CREATE INDEX IF NOT EXISTS idx_user_total_points ON users(total_points)",
-                "CREATE INDEX IF NOT EXISTS idx_user_last_points_week ON users(last_points_awarded_week_start)"
-            ]
-            
-            for index_sql in indexes:
-                cursor.execute(index_sql)
-                print(f"インデックス作成: {index_sql.split()[-1]}")
-            
-            conn.commit()
-            conn.close()
+            self.optimize_indexes(apply=True)
             print("全インデックス作成完了")
-            
         except Exception as e:
             print(f"インデックス作成エラー: {e}")
-    
+
+    # --- 統計情報・VACUUM ---
+
+    def get_table_row_counts(self) -> Dict[str, int]:
+        from sqlalchemy import inspect
+
+        counts = {}
+        with self.engine.connect() as conn:
+            for table in inspect(self.engine).get_table_names():
+                counts[table] = conn.exec_driver_sql(f"SELECT COUNT(*) FROM {table}").scalar()
+        return counts
+
+    def get_table_health(self) -> List[Dict[str, Any]]:
+        """テーブルごとのスキャン回数・不要行・前回の VACUUM / ANALYZE（PostgreSQL のみ）"""
+        if not self.is_postgres:
+            return []
+        query = """
+            SELECT relname, seq_scan, seq_tup_read, COALESCE(idx_scan, 0), n_live_tup, n_dead_tup,
+                   n_mod_since_analyze, GREATEST(last_vacuum, last_autovacuum),
+                   GREATEST(last_analyze, last_autoanalyze),
+                   pg_total_relation_size(relid), pg_indexes_size(relid)
+            FROM pg_stat_user_tables ORDER BY seq_tup_read DESC
+        """
+        tables = []
+        with self.engine.connect() as conn:
+            for row in conn.exec_driver_sql(query):
+                live, dead = row[4] or 0, row[5] or 0
+                tables.append({
+                    "table": row[0],
+                    "seq_scan": row[1],
+                    "seq_tup_read": row[2],
+                    "idx_scan": row[3],
+                    "live_rows": live,
+                    "dead_rows": dead,
+                    # 推定 bloat: 全行に占める不要行の割合
+                    "dead_ratio": round(dead / (live + dead), 3) if live + dead else 0.0,
+                    "modified_since_analyze": row[6] or 0,
+                    "last_vacuum": row[7].isoformat() if row[7] else None,
+                    "last_analyze": row[8].isoformat() if row[8] else None,
+                    "total_bytes": row[9],
+                    "index_bytes": row[10],
+                })
+        return tables
+
+    def get_unused_indexes(self) -> List[Dict[str, Any]]:
+        """統計リセット以降に一度も使われていないインデックス（主キー・一意制約を除く、PostgreSQL のみ）"""
+        if not self.is_postgres:
+            return []
+        query = """
+            SELECT s.relname, s.indexrelname, pg_relation_size(s.indexrelid)
+            FROM pg_stat_user_indexes s JOIN pg_index i ON i.indexrelid = s.indexrelid
+            WHERE s.idx_scan = 0 AND NOT i.indisunique AND NOT i.indisprimary
+            ORDER BY pg_relation_size(s.indexrelid) DESC
+        """
+        with self.engine.connect() as conn:
+            return [
+                {"table": row[0], "name": row[1], "bytes": row[2]}
+                for row in conn.exec_driver_sql(query)
+            ]
+
+    def update_statistics(self, force: bool = False) -> Dict[str, List[str]]:
+        """更新量に応じて ANALYZE / VACUUM を実行する（force=True なら全テーブル）"""
+        done = {"vacuum": [], "analyze": []}
+        if self.is_postgres:
+            with self._autocommit_connection() as conn:
+                for table in self.get_table_health():
+                    name = table["table"]
+                    if force or table["dead_ratio"] > VACUUM_DEAD_RATIO:
+                        # VACUUM (ANALYZE) は統計情報も更新する。FULL はテーブルをロックするため使わない
+                        conn.exec_driver_sql(f'VACUUM (ANALYZE) "{name}"')
+                        done["vacuum"].append(name)
+                    elif table["last_analyze"] is None or \
+                            table["modified_since_analyze"] > ANALYZE_CHANGE_RATIO * max(table["live_rows"], 1):
+                        conn.exec_driver_sql(f'ANALYZE "{name}"')
+                        done["analyze"].append(name)
+            return done
+
+        raw = self.engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            if force:
+                cursor.execute("ANALYZE")
+                done["analyze"].append("*")
+            else:
+                # 統計情報が古いテーブルのみ ANALYZE される
+                cursor.execute("PRAGMA optimize")
+                done["analyze"].append("optimize")
+            page_count = cursor.execute("PRAGMA page_count").fetchone()[0]
+            free_count = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+            if force or (page_count and free_count / page_count > SQLITE_VACUUM_FREE_RATIO):
+                cursor.execute("VACUUM")
+                done["vacuum"].append("*")
+            cursor.close()
+        finally:
+            raw.close()
+        return done
+
+    def optimize_database(self):
+        """データベースの最適化"""
+        try:
+            print("データベースを最適化中...")
+            # VACUUM と統計情報の更新
+            self.update_statistics(force=True)
+            print("データベース最適化完了")
+
+        except Exception as e:
+            print(f"データベース最適化エラー: {e}")
+
     def get_database_stats(self):
         """データベース統計情報を取得"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # テーブルごとの行数
-            tables = ['users', 'food_loss_records', 'loss_reasons', 'arrange_suggest']
-            stats = {}
-            
-            for table in tables:
-                try:
-                    cursor.execute(f"SELECT COUNT(*) FROM {table}")
-                    count = cursor.fetchone()[0]
-                    stats[table] = count
-                except:
-                    stats[table] = 0
-            
-            # データベースファイルサイズ
-            db_size = os.path.getsize(self.db_path) / 1024 / 1024  # MB
-            stats['file_size_mb'] = round(db_size, 2)
-            
-            conn.close()
+            stats = dict(self.get_table_row_counts())
+
+            if self.is_postgres:
+                with self.engine.connect() as conn:
+                    size = conn.exec_driver_sql("SELECT pg_database_size(current_database())").scalar()
+                stats['database_size_mb'] = round(size / 1024 / 1024, 2)
+            else:
+                # データベースファイルサイズ
+                db_size = os.path.getsize(self.db_path) / 1024 / 1024  # MB
+                stats['file_size_mb'] = round(db_size, 2)
             return stats
-            
+
         except Exception as e:
             print(f"❌ 統計情報取得エラー: {e}")
             return {}
 
-def run_database_maintenance():
+    def report(self, user_id: Optional[int] = None) -> Dict[str, Any]:
+        """実行計画・テーブルの状態・インデックスの推奨をまとめる"""
+        return {
+            "meta": {"timestamp": datetime.datetime.now().isoformat(), "database_backend": self.backend},
+            "stats": self.get_database_stats(),
+            "hot_queries": self.explain_hot_queries(user_id),
+            "tables": self.get_table_health(),
+            "unused_indexes": self.get_unused_indexes(),
+            "redundant_indexes": self.redundant_indexes(),
+            "recommended_indexes": [self.index_ddl(index) for index in self.missing_indexes()],
+        }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"=== データベースレポート ({report['meta']['database_backend']}) ===")
+    print("\n📊 データベース統計情報:")
+    for key, value in report["stats"].items():
+        print(f"  {key}: {value}")
+
+    print("\n🔍 よく使うクエリ（遅い順）:")
+    for query in report["hot_queries"]:
+        flag = " ⚠️ 全件スキャン: " + ", ".join(
+            f"{scan['table']}({scan['rows']}行)" for scan in query["large_seq_scans"]
+        ) if query["large_seq_scans"] else ""
+        print(f"  {query['execution_ms']:8.3f}ms  {query['source']}{flag}")
+
+    for table in report["tables"]:
+        if table["dead_ratio"] > VACUUM_DEAD_RATIO:
+            print(f"⚠️ {table['table']}: 不要行の割合 {table['dead_ratio']:.0%}（VACUUM 推奨）")
+    for index in report["unused_indexes"]:
+        print(f"⚠️ 未使用インデックス: {index['table']}.{index['name']} ({index['bytes']} bytes)")
+    for index in report["redundant_indexes"]:
+        print(f"⚠️ 重複インデックス: {index['table']}.{index['name']}（{index['covered_by']} で代替可能）")
+    for statement in report["recommended_indexes"]:
+        print(f"💡 推奨: {statement}")
+
+
+def run_database_maintenance(create_indexes: bool = False, force: bool = False, backup: bool = True):
     """データベースメンテナンスを実行"""
     print("=== データベースメンテナンス開始 ===")
-    
+
     optimizer = DatabaseOptimizer()
-    
-    # バックアップ作成
-    backup_path = optimizer.create_backup()
-    
+
+    # バックアップ作成（保持期間を過ぎたバックアップは削除）
+    backup_path = optimizer.create_backup() if backup else "skipped"
+    if backup and backup_path:
+        pruned = optimizer.backup_store.prune()
+        print(f"古いバックアップを削除: {pruned['removed_backups']} 件 ({pruned['freed_bytes']} bytes)")
+
     if backup_path:
         # 統計情報表示
         print("\n📊 データベース統計情報:")
         stats = optimizer.get_database_stats()
         for key, value in stats.items():
             print(f"  {key}: {value}")
-        
+
         # インデックス追加
         print("\n🗂️ インデックス最適化:")
-        optimizer.add_indexes()
-        
+        if create_indexes:
+            optimizer.add_indexes()
+        else:
+            for statement in optimizer.optimize_indexes(apply=False):
+                print(f"  推奨: {statement}")
+
         # データベース最適化
-        print("\n⚡ データベース最適化:")
-        optimizer.optimize_database()
-        
+        print("\n⚡ VACUUM / ANALYZE:")
+        done = optimizer.update_statistics(force=force)
+        print(f"  VACUUM: {', '.join(done['vacuum']) or 'なし'} / ANALYZE: {', '.join(done['analyze']) or 'なし'}")
+
         print("\n=== データベースメンテナンス完了 ===")
+        return True
     else:
         print("❌ バックアップに失敗したため、メンテナンスを中止します")
+        return False
+
+
+@click.group()
+def cli():
+    """データベース最適化ツール"""
+    pass
+
+
+@cli.command("report")
+@click.option("--user-id", type=int, default=None, help="計測に使うユーザー（未指定なら記録が最も多いユーザー）")
+@click.option("--output", default=None, help="結果を保存する JSON ファイル")
+def report_command(user_id, output):
+    """よく使うクエリの実行計画・テーブルの状態・インデックスの推奨を表示する"""
+    report = DatabaseOptimizer().report(user_id)
+    print_report(report)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+        print(f"結果を保存しました: {output}")
+
+
+@cli.command("indexes")
+@click.option("--apply", is_flag=True, help="不足しているインデックスを作成する（未指定なら表示のみ）")
+def indexes_command(apply):
+    """推奨インデックスを表示・作成する"""
+    statements = DatabaseOptimizer().optimize_indexes(apply=apply)
+    if not statements:
+        print("推奨インデックスはすべて作成済みです")
+    elif not apply:
+        for statement in statements:
+            print(statement)
+
+
+@cli.command("backup")
+@click.option("--prune/--no-prune", default=True, show_default=True, help="保持ポリシーから外れたバックアップを削除する")
+@click.option("--id-file", default=None, type=click.Path(), help="作成したバックアップの ID を書き込むファイル")
+def backup_command(prune, id_file):
+    """オンラインバックアップを作成する"""
+    optimizer = DatabaseOptimizer()
+    manifest_path = optimizer.create_backup()
+    if not manifest_path:
+        sys.exit(1)
+    if id_file:
+        Path(id_file).write_text(Path(manifest_path).stem + "\n", encoding="utf-8")
+    if prune:
+        pruned = optimizer.backup_store.prune()
+        print(f"古いバックアップを削除: {pruned['removed_backups']} 件 ({pruned['freed_bytes']} bytes)")
+
+
+@cli.command("backups")
+def backups_command():
+    """保存されているバックアップと使用量を表示する"""
+    store = DatabaseOptimizer().backup_store
+    for manifest in store.manifests():
+        print(
+            f"{manifest['id']}  {manifest['backend']:10s} {manifest['size_bytes']:>12} bytes  "
+            f"新規チャンク {manifest['new_chunks']}/{len(manifest['chunks'])}"
+        )
+    usage = store.usage()
+    ratio = usage["logical_bytes"] / usage["stored_bytes"] if usage["stored_bytes"] else 0.0
+    print(f"{usage['backups']} 件, 保存量 {usage['stored_bytes']} bytes（個別に保存した場合の {ratio:.1f} 分の1）")
+
+
+@cli.command("prune")
+@click.option("--keep-last", default=None, type=int, help="直近の件数")
+@click.option("--keep-daily", default=None, type=int, help="日ごとに残す日数")
+@click.option("--keep-weekly", default=None, type=int, help="週ごとに残す週数")
+def prune_command(keep_last, keep_daily, keep_weekly):
+    """保持ポリシーから外れたバックアップと、参照されないチャンクを削除する"""
+    policy = {
+        key: value
+        for key, value in (("keep_last", keep_last), ("keep_daily", keep_daily), ("keep_weekly", keep_weekly))
+        if value is not None
+    }
+    pruned = DatabaseOptimizer().backup_store.prune(**policy)
+    print(
+        f"削除: バックアップ {pruned['removed_backups']} 件, チャンク {pruned['removed_chunks']} 件 "
+        f"({pruned['freed_bytes']} bytes)"
+    )
+
+
+@cli.command("restore-verify")
+@click.option("--id", "backup_id", default=None, help="検証するバックアップ（未指定なら最新）")
+@click.option("--target-url", default=None, help="PostgreSQL の場合に復元する検証用の空のデータベース")
+def restore_verify_command(backup_id, target_url):
+    """バックアップを一時的に復元して検証し、復旧にかかる時間を表示する"""
+    result = DatabaseOptimizer().verify_restore(backup_id, target_url)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    sys.exit(0 if result.get("integrity") == "ok" else 1)
+
+
+@cli.command("restore")
+@click.option("--id", "backup_id", default=None, help="復元するバックアップ（未指定なら最新）")
+@click.option("--yes", is_flag=True, help="確認せずに稼働中のデータベースを置き換える")
+def restore_command(backup_id, yes):
+    """稼働中のデータベースをバックアップの内容に置き換える（アプリを停止してから実行する）"""
+    optimizer = DatabaseOptimizer()
+    manifest = optimizer.backup_store.get(backup_id)
+    target = optimizer.engine.url.render_as_string(hide_password=True)
+    if not yes:
+        click.confirm(f"{target} を {manifest['id']} の内容に置き換えます。よろしいですか？", abort=True)
+    result = optimizer.restore_live(manifest["id"])
+    print(f"復元完了: {result['id']} → {target}（{result['restore_seconds']}秒）")
+
+
+@cli.command("maintain")
+@click.option("--create-indexes", is_flag=True, help="不足しているインデックスも作成する")
+@click.option("--force", is_flag=True, help="更新量に関係なく全テーブルを VACUUM / ANALYZE する")
+@click.option("--no-backup", is_flag=True, help="バックアップを作成しない")
+def maintain_command(create_indexes, force, no_backup):
+    """バックアップ・インデックス・VACUUM / ANALYZE（cron から定期実行する）"""
+    ok = run_database_maintenance(create_indexes=create_indexes, force=force, backup=not no_backup)
+    sys.exit(0 if ok else 1)
+
 
 if __name__ == "__main__":
-    run_database_maintenance()
\ No newline at end of file
+    sys.exit(cli())
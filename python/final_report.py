@@ -4,21 +4,26 @@
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 from sqlalchemy import func, desc
-from database import SessionLocal
-from models import User, FoodLossRecord, LossReason
+from archive import loss_rows
+from database import read_session
+from models import User, LossReason
+from sharding import ShardRouter, active_router
 from statistics import get_week_boundaries
 import json
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Tuple
 
 
 class FinalReportGenerator:
     """2週間運用終了後の最終レポート生成クラス"""
     
-    def __init__(self):
-        self.db = SessionLocal()
+    def __init__(self, db: Session = None):
+        # db を渡した場合はそのセッションを使い、閉じるのは呼び出し側に任せる
+        # 渡さない場合は読み取り専用のセッション（レプリカが設定されていればレプリカ）を使う
+        self._owns_session = db is None
+        self.db = db if db is not None else read_session()
     
     def __del__(self):
-        if hasattr(self, 'db'):
+        if hasattr(self, 'db') and self._owns_session:
             self.db.close()
     
     def generate_complete_report(self) -> Dict[str, Any]:
@@ -36,66 +41,106 @@ class FinalReportGenerator:
     
     def get_user_statistics(self) -> List[Dict[str, Any]]:
         """ユーザー別統計データ"""
-        users = self.db.query(User).all()
+        # 総廃棄量順にソート
+        return sorted(self._user_rows(), key=lambda x: x["total_weight_grams"], reverse=True)
+
+    # --- 集計（各セクションの元になる値。シャーディング時は ShardedFinalReportGenerator がシャードごとの値を合わせる） ---
+
+    def _user_rows(self) -> List[Dict[str, Any]]:
+        # 記録数・総廃棄量・記録日・参加日数は users の集計値（user_counters.py）を読む
         user_stats = []
-        
-        for user in users:
-            # 総廃棄量
-            total_weight = self.db.query(func.sum(FoodLossRecord.weight_grams))\
-                .filter(FoodLossRecord.user_id == user.id).scalar() or 0
-            
-            # 廃棄回数
-            record_count = self.db.query(func.count(FoodLossRecord.id))\
-                .filter(FoodLossRecord.user_id == user.id).scalar() or 0
-            
+        for user in self.db.query(User).all():
             # 平均廃棄量
-            avg_weight = total_weight / record_count if record_count > 0 else 0
-            
-            # 最初と最後の記録日
-            first_record = self.db.query(FoodLossRecord.record_date)\
-                .filter(FoodLossRecord.user_id == user.id)\
-                .order_by(FoodLossRecord.record_date.asc()).first()
-            
-            last_record = self.db.query(FoodLossRecord.record_date)\
-                .filter(FoodLossRecord.user_id == user.id)\
-                .order_by(FoodLossRecord.record_date.desc()).first()
-            
+            avg_weight = user.total_grams / user.record_count if user.record_count > 0 else 0
+
             user_stats.append({
                 "username": user.username,
                 "email": user.email,
-                "total_weight_grams": round(total_weight, 2),
-                "record_count": record_count,
+                "total_weight_grams": round(user.total_grams, 2),
+                "record_count": user.record_count,
                 "average_weight_grams": round(avg_weight, 2),
                 "total_points": user.total_points,
-                "first_record_date": first_record[0].strftime("%Y-%m-%d") if first_record else None,
-                "last_record_date": last_record[0].strftime("%Y-%m-%d") if last_record else None,
-                "participation_days": self._get_participation_days(user.id)
+                "first_record_date": user.first_record_date,
+                "last_record_date": user.last_record_date,
+                "participation_days": user.participation_days
             })
-        
-        # 総廃棄量順にソート
-        return sorted(user_stats, key=lambda x: x["total_weight_grams"], reverse=True)
-    
+        return user_stats
+
+    def _reason_totals(self) -> List[Tuple[str, float, int]]:
+        """廃棄理由ごとの (理由, 総廃棄量, 回数)"""
+        rows = loss_rows()
+        return [
+            tuple(row) for row in self.db.query(
+                LossReason.reason_text,
+                func.sum(rows.c.grams),
+                func.sum(rows.c.records)
+            ).join(rows, LossReason.id == rows.c.loss_reason_id)\
+             .group_by(LossReason.reason_text).all()
+        ]
+
+    def _daily_totals(self) -> List[Tuple[str, float, int]]:
+        """日ごとの (日付, 総廃棄量, 記録数)"""
+        rows = loss_rows()
+        return [
+            tuple(row) for row in self.db.query(
+                rows.c.day, func.sum(rows.c.grams), func.sum(rows.c.records)
+            ).group_by(rows.c.day).all()
+        ]
+
+    def _overall_totals(self) -> Dict[str, float]:
+        rows = loss_rows()
+        total_weight, total_records, active_users = self.db.query(
+            func.sum(rows.c.grams), func.sum(rows.c.records), func.count(func.distinct(rows.c.user_id))
+        ).one()
+        return {
+            "total_weight": total_weight or 0,
+            "total_records": total_records or 0,
+            "total_users": self.db.query(func.count(User.id)).scalar() or 0,
+            "total_points": self.db.query(func.sum(User.total_points)).scalar() or 0,
+            "active_users": active_users or 0,
+        }
+
+    def _week_totals(self, start_date, end_date) -> Dict[str, float]:
+        rows = loss_rows(start_date, end_date)
+        total_weight, record_count, active_users = self.db.query(
+            func.sum(rows.c.grams),
+            func.sum(rows.c.records),
+            func.count(func.distinct(rows.c.user_id))
+        ).one()
+        return {"total_weight": total_weight or 0, "record_count": record_count or 0, "active_users": active_users}
+
+    def _top_points(self, limit: int) -> List[Tuple[str, int]]:
+        return [
+            tuple(row) for row in self.db.query(User.username, User.total_points)
+            .order_by(desc(User.total_points)).limit(limit).all()
+        ]
+
+    def _least_waste(self, limit: int) -> List[Tuple[str, float]]:
+        rows = loss_rows()
+        total_waste = func.sum(rows.c.grams)
+        return [
+            tuple(row) for row in self.db.query(User.username, total_waste)
+            .join(rows, User.id == rows.c.user_id)
+            .group_by(User.username)
+            .order_by(total_waste).limit(limit).all()
+        ]
+
+    # --- ここまで集計 ---
+
     def get_reason_analysis(self) -> Dict[str, Any]:
         """廃棄理由別分析"""
-        reason_stats = self.db.query(
-            LossReason.reason_text,
-            func.sum(FoodLossRecord.weight_grams).label('total_weight'),
-            func.count(FoodLossRecord.id).label('count'),
-            func.avg(FoodLossRecord.weight_grams).label('avg_weight')
-        ).join(FoodLossRecord, LossReason.id == FoodLossRecord.loss_reason_id)\
-         .group_by(LossReason.reason_text)\
-         .order_by(desc('total_weight')).all()
+        reason_stats = sorted(self._reason_totals(), key=lambda stat: stat[1], reverse=True)
         
         reasons = []
-        total_all = sum(stat.total_weight for stat in reason_stats)
+        total_all = sum(total_weight for _, total_weight, _ in reason_stats)
         
-        for stat in reason_stats:
-            percentage = (stat.total_weight / total_all * 100) if total_all > 0 else 0
+        for reason_text, total_weight, count in reason_stats:
+            percentage = (total_weight / total_all * 100) if total_all > 0 else 0
             reasons.append({
-                "reason": stat.reason_text,
-                "total_weight_grams": round(stat.total_weight, 2),
-                "count": stat.count,
-                "average_weight_grams": round(stat.avg_weight, 2),
+                "reason": reason_text,
+                "total_weight_grams": round(total_weight, 2),
+                "count": count,
+                "average_weight_grams": round(total_weight / count, 2),
                 "percentage": round(percentage, 1)
             })
         
@@ -108,19 +153,12 @@ class FinalReportGenerator:
     def get_timeline_analysis(self) -> Dict[str, Any]:
         """時系列分析（日別・週別）"""
         # 日別統計
-        daily_stats = self.db.query(
-            func.date(FoodLossRecord.record_date).label('date'),
-            func.sum(FoodLossRecord.weight_grams).label('total_weight'),
-            func.count(FoodLossRecord.id).label('count')
-        ).group_by(func.date(FoodLossRecord.record_date))\
-         .order_by('date').all()
-        
         daily_data = []
-        for stat in daily_stats:
+        for date, total_weight, count in sorted(self._daily_totals()):
             daily_data.append({
-                "date": stat.date.strftime("%Y-%m-%d"),
-                "total_weight_grams": round(stat.total_weight, 2),
-                "record_count": stat.count
+                "date": date,
+                "total_weight_grams": round(total_weight, 2),
+                "record_count": count
             })
         
         return {
@@ -132,13 +170,14 @@ class FinalReportGenerator:
     def get_overall_summary(self) -> Dict[str, Any]:
         """全体サマリー"""
         # 全体統計
-        total_weight = self.db.query(func.sum(FoodLossRecord.weight_grams)).scalar() or 0
-        total_records = self.db.query(func.count(FoodLossRecord.id)).scalar() or 0
-        total_users = self.db.query(func.count(User.id)).scalar() or 0
-        total_points = self.db.query(func.sum(User.total_points)).scalar() or 0
+        totals = self._overall_totals()
+        total_weight = totals["total_weight"]
+        total_records = totals["total_records"]
+        total_users = totals["total_users"]
+        total_points = totals["total_points"]
         
         # 参加率計算
-        active_users = self.db.query(func.count(func.distinct(FoodLossRecord.user_id))).scalar() or 0
+        active_users = totals["active_users"]
         participation_rate = (active_users / total_users * 100) if total_users > 0 else 0
         
         return {
@@ -165,16 +204,13 @@ class FinalReportGenerator:
         
         # 各週のデータ取得
         def get_week_data(start_date, end_date):
-            records = self.db.query(FoodLossRecord)\
-                .filter(FoodLossRecord.record_date >= start_date)\
-                .filter(FoodLossRecord.record_date <= end_date).all()
-            
-            total_weight = sum(r.weight_grams for r in records)
-            unique_users = len(set(r.user_id for r in records))
+            totals = self._week_totals(start_date, end_date)
+            total_weight = totals["total_weight"]
+            unique_users = totals["active_users"]
             
             return {
                 "total_weight_grams": round(total_weight, 2),
-                "record_count": len(records),
+                "record_count": totals["record_count"],
                 "active_users": unique_users,
                 "average_per_user": round(total_weight / unique_users, 2) if unique_users > 0 else 0
             }
@@ -204,26 +240,20 @@ class FinalReportGenerator:
     def get_top_performers(self) -> Dict[str, Any]:
         """優秀者・改善者ランキング"""
         # ポイント獲得ランキング
-        top_points = self.db.query(User.username, User.total_points)\
-            .order_by(desc(User.total_points)).limit(5).all()
+        top_points = self._top_points(5)
         
         # 廃棄量削減ランキング（週別比較で計算）
         # ここでは簡略化して総廃棄量が少ない順
-        user_waste = self.db.query(
-            User.username,
-            func.sum(FoodLossRecord.weight_grams).label('total_waste')
-        ).join(FoodLossRecord, User.id == FoodLossRecord.user_id)\
-         .group_by(User.username)\
-         .order_by('total_waste').limit(5).all()
+        user_waste = self._least_waste(5)
         
         return {
             "top_points_earners": [
-                {"username": user.username, "points": user.total_points}
-                for user in top_points
+                {"username": username, "points": points}
+                for username, points in top_points
             ],
             "least_waste_producers": [
-                {"username": user.username, "total_waste_grams": round(user.total_waste, 2)}
-                for user in user_waste
+                {"username": username, "total_waste_grams": round(total_waste, 2)}
+                for username, total_waste in user_waste
             ]
         }
     
@@ -251,9 +281,8 @@ class FinalReportGenerator:
         }
     
     def _get_participation_days(self, user_id: int) -> int:
-        """ユーザーの参加日数を計算"""
-        days = self.db.query(func.count(func.distinct(func.date(FoodLossRecord.record_date))))\
-            .filter(FoodLossRecord.user_id == user_id).scalar()
+        """ユーザーの参加日数（users の集計値。保管した記録の日も含む）"""
+        days = self.db.query(User.participation_days).filter(User.id == user_id).scalar()
         return days or 0
     
     def export_to_excel(self, filename: str = None) -> str:
@@ -465,6 +494,8 @@ class FinalReportGenerator:
         # ファイル保存
         wb.save(filename)
         return filename
+    
+    def export_to_json(self, filename: str = None) -> str:
         """レポートをJSONファイルに出力"""
         if filename is None:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -527,11 +558,76 @@ class FinalReportGenerator:
         print("=" * 60)
 
 
+class ShardedFinalReportGenerator(FinalReportGenerator):
+    """シャーディング時の最終レポート（各集計を全シャードに並列に問い合わせて合わせる）
+
+    ユーザーとそのデータは1つのシャードにしかないため、件数・合計・参加者数は
+    シャードごとの値の和になる。平均と割合は合わせた後の合計から計算し直す。
+    """
+
+    def __init__(self, router: ShardRouter):
+        self.router = router
+        self._owns_session = False
+
+    def _fan_out(self, method: str, *args) -> List[Any]:
+        return list(self.router.fan_out(
+            lambda db: getattr(FinalReportGenerator(db), method)(*args)
+        ).values())
+
+    @staticmethod
+    def _sum_by_key(parts) -> List[Tuple[str, float, int]]:
+        merged: Dict[str, List[float]] = {}
+        for rows in parts:
+            for key, total, count in rows:
+                totals = merged.setdefault(key, [0, 0])
+                totals[0] += total
+                totals[1] += count
+        return [(key, total, count) for key, (total, count) in merged.items()]
+
+    def _user_rows(self):
+        return [row for rows in self._fan_out("_user_rows") for row in rows]
+
+    def _reason_totals(self):
+        return self._sum_by_key(self._fan_out("_reason_totals"))
+
+    def _daily_totals(self):
+        return self._sum_by_key(self._fan_out("_daily_totals"))
+
+    def _overall_totals(self):
+        parts = self._fan_out("_overall_totals")
+        return {key: sum(part[key] for part in parts) for key in parts[0]}
+
+    def _week_totals(self, start_date, end_date):
+        parts = self._fan_out("_week_totals", start_date, end_date)
+        return {key: sum(part[key] for part in parts) for key in parts[0]}
+
+    def _top_points(self, limit):
+        rows = [row for rows in self._fan_out("_top_points", limit) for row in rows]
+        return sorted(rows, key=lambda row: row[1], reverse=True)[:limit]
+
+    def _least_waste(self, limit):
+        rows = [row for rows in self._fan_out("_least_waste", limit) for row in rows]
+        return sorted(rows, key=lambda row: row[1])[:limit]
+
+    def _get_participation_days(self, user_id: int) -> int:
+        db = self.router.session_for(user_id)
+        try:
+            return FinalReportGenerator(db)._get_participation_days(user_id)
+        finally:
+            db.close()
+
+
+def create_report_generator() -> FinalReportGenerator:
+    """設定に合わせたレポート生成クラス（シャーディング時は全シャードを集計する）"""
+    router = active_router()
+    return ShardedFinalReportGenerator(router) if router is not None else FinalReportGenerator()
+
+
 def main():
     """メイン実行関数"""
     print("2週間運用統計レポートを生成中...")
     
-    generator = FinalReportGenerator()
+    generator = create_report_generator()
     
     # コンソール出力
     generator.print_summary_report()
@@ -4,6 +4,7 @@ import os
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from models import User, LossReason, FoodLossRecord  # 必要なモデルをインポート
+import user_counters
 import hashlib
 import logging
 
@@ -69,7 +70,7 @@ def add_test_data():
         )
 
         # 4. セッションに追加し、コミット
-        session.add_all([record1, record2])
+        user_counters.add_records(session, [record1, record2])
         session.commit()
         logger.info("Food loss test data added successfully for test_user!")
 
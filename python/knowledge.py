@@ -3,7 +3,7 @@ from flask import Blueprint, render_template, current_app, session, redirect, ur
 import os
 import csv
 # ---〇変更点---
-from database import get_db
+from database import get_read_db, LAST_WRITE_SESSION_KEY
 from models import arrange_suggest
 # ---ここまで---
 logger = logging.getLogger(__name__)
@@ -155,7 +155,8 @@ def knowledge():
     # ログインユーザーの保存済みアレンジレシピを取得
     arrange_list = []
     if 'user_id' in session:
-        db = next(get_db())
+        # 読み取りのみのため、レプリカから読む（直近に書き込んだ場合はプライマリ。シャーディング時はユーザーのシャード）
+        db = next(get_read_db(session.get(LAST_WRITE_SESSION_KEY), session['user_id']))
         try:
             # レシピが保存されているもの（空でないもの）を取得
             records = db.query(arrange_suggest).filter(
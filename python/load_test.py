@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+オープンループ負荷テスト（asyncio + aiohttp）
+
+- 仮想ユーザーはポアソン過程（平均 --rate 人/秒）で到着し、サーバーの応答を待たずに次々と開始する
+  （スレッド数固定のクローズドループでは、サーバーが遅くなると送信も遅れて待ち行列の遅延が隠れる）
+- 仮想ユーザーごとに Cookie を持つセッションで、登録 → ログイン → 入力 → 余りもの →
+  記録閲覧 → 豆知識 → ポイント交換 のシナリオを実行する
+- レイテンシは「本来送信すべきだった時刻」から計測する（coordinated omission の補正）。
+  送信自体が遅れた場合（接続待ちやイベントループの遅延）もその待ち時間が結果に含まれる
+- レイテンシは HDR 形式（対数・線形）のヒストグラムに記録する
+
+使用例:
+    python load_test.py run --url http://127.0.0.1:8000 --rate 5 --duration 60
+    python load_test.py sweep --url http://127.0.0.1:8000 --rates 1,2,5,10,20 --slo-ms 500
+"""
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import click
+
+LOAD_TEST_PASSWORD = "loadtest-pass"
+DEFAULT_STEPS = ["register", "login", "input", "leftover", "log", "knowledge", "redeem"]
+
+DISH_NAMES = ["カレー", "ご飯", "味噌汁", "サラダ", "パン", "牛乳", "焼き魚", "野菜炒め"]
+REASON_TEXTS = ["期限切れ", "調理中の廃棄", "料理後の廃棄", "調理失敗", "その他", "食べ残し"]
+
+
+class LatencyHistogram:
+    """HDR 形式のレイテンシヒストグラム（マイクロ秒単位）
+
+    2のべき乗ごとの区間を sub_bucket_bits ビット分の線形バケットに分割するため、
+    値の大きさによらず相対誤差が 2 / 2**sub_bucket_bits 程度に収まる。
+    """
+
+    def __init__(self, sub_bucket_bits: int = 7):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.half_count = self.sub_bucket_count >> 1
+        self.counts: Counter = Counter()
+        self.total = 0
+        self.sum_us = 0
+        self.max_us = 0
+        self.min_us: Optional[int] = None
+
+    def _index(self, value: int) -> int:
+        if value < self.sub_bucket_count:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return shift * self.half_count + (value >> shift)
+
+    def _highest_equivalent(self, index: int) -> int:
+        if index < self.sub_bucket_count:
+            return index
+        shift = index // self.half_count - 1
+        sub_bucket = index - shift * self.half_count
+        return ((sub_bucket + 1) << shift) - 1
+
+    def record(self, value_us: int, count: int = 1) -> None:
+        value_us = max(int(value_us), 0)
+        self.counts[self._index(value_us)] += count
+        self.total += count
+        self.sum_us += value_us * count
+        self.max_us = max(self.max_us, value_us)
+        self.min_us = value_us if self.min_us is None else min(self.min_us, value_us)
+
+    def record_seconds(self, seconds: float) -> None:
+        self.record(int(seconds * 1_000_000))
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        self.counts.update(other.counts)
+        self.total += other.total
+        self.sum_us += other.sum_us
+        self.max_us = max(self.max_us, other.max_us)
+        if other.min_us is not None:
+            self.min_us = other.min_us if self.min_us is None else min(self.min_us, other.min_us)
+
+    def value_at_percentile(self, pct: float) -> int:
+        if self.total == 0:
+            return 0
+        target = max(1, int(pct / 100.0 * self.total + 0.5))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._highest_equivalent(index), self.max_us)
+        return self.max_us
+
+    def to_dict(self) -> Dict[str, Any]:
+        def ms(value_us):
+            return round(value_us / 1000.0, 3)
+
+        return {
+            "count": self.total,
+            "mean_ms": ms(self.sum_us / self.total) if self.total else 0.0,
+            "min_ms": ms(self.min_us or 0),
+            "p50_ms": ms(self.value_at_percentile(50)),
+            "p90_ms": ms(self.value_at_percentile(90)),
+            "p99_ms": ms(self.value_at_percentile(99)),
+            "p999_ms": ms(self.value_at_percentile(99.9)),
+            "max_ms": ms(self.max_us),
+        }
+
+
+class LoadTestStats:
+    """ステップごとのヒストグラムとエラー数"""
+
+    def __init__(self):
+        # 応答時間（本来の送信時刻から）とサービス時間（実際の送信から）を分けて記録する
+        self.response = {}
+        self.service = {}
+        self.errors: Counter = Counter()
+        self.sessions_started = 0
+        self.sessions_completed = 0
+        self.sessions_dropped = 0
+        self.max_lag_ms = 0.0
+
+    def record(self, step: str, intended: float, sent: float, finished: float, ok: bool, status) -> None:
+        self.response.setdefault(step, LatencyHistogram()).record_seconds(finished - intended)
+        self.service.setdefault(step, LatencyHistogram()).record_seconds(finished - sent)
+        if not ok:
+            self.errors[f"{step}:{status}"] += 1
+
+    def overall(self, histograms: Dict[str, LatencyHistogram]) -> LatencyHistogram:
+        merged = LatencyHistogram()
+        for histogram in histograms.values():
+            merged.merge(histogram)
+        return merged
+
+    def to_dict(self, duration: float) -> Dict[str, Any]:
+        overall = self.overall(self.response)
+        return {
+            "sessions_started": self.sessions_started,
+            "sessions_completed": self.sessions_completed,
+            "sessions_dropped": self.sessions_dropped,
+            "requests": overall.total,
+            "throughput_rps": round(overall.total / duration, 2) if duration > 0 else 0.0,
+            "error_count": sum(self.errors.values()),
+            "errors": dict(self.errors),
+            "max_arrival_lag_ms": round(self.max_lag_ms, 3),
+            "response_time": overall.to_dict(),
+            "service_time": self.overall(self.service).to_dict(),
+            "steps": {
+                step: {
+                    "response_time": self.response[step].to_dict(),
+                    "service_time": self.service[step].to_dict(),
+                }
+                for step in self.response
+            },
+        }
+
+
+def _import_aiohttp():
+    try:
+        import aiohttp
+    except ImportError:
+        raise click.ClickException(
+            "負荷テストには aiohttp が必要です: pip install aiohttp"
+        )
+    return aiohttp
+
+
+class VirtualUser:
+    """Cookie を個別に持つ仮想ユーザー（1回の到着 = 1シナリオ実行）"""
+
+    def __init__(self, aiohttp, connector, base_url: str, username: str, rng: random.Random, think_time: float, timeout: float):
+        self.base_url = base_url.rstrip("/")
+        self.username = username
+        self.rng = rng
+        self.think_time = think_time
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            connector_owner=False,
+            cookie_jar=aiohttp.CookieJar(unsafe=True),  # IP アドレス宛てでも Cookie を保持する
+            timeout=aiohttp.ClientTimeout(total=timeout),
+        )
+
+    async def close(self) -> None:
+        await self.session.close()
+
+    async def _request(self, method: str, path: str, expected, **kwargs):
+        async with self.session.request(
+            method, f"{self.base_url}{path}", allow_redirects=False, **kwargs
+        ) as resp:
+            await resp.read()
+            return resp.status in expected, resp.status
+
+    # --- シナリオの各ステップ ---
+
+    async def register(self):
+        return await self._request(
+            "POST",
+            "/register",
+            (302, 303),
+            data={
+                "email": f"{self.username}@example.com",
+                "username": self.username,
+                "password": LOAD_TEST_PASSWORD,
+                "password_confirm": LOAD_TEST_PASSWORD,
+            },
+        )
+
+    async def login(self):
+        ok, status = await self._request(
+            "POST", "/login", (200,),
+            data={"username": self.username, "password": LOAD_TEST_PASSWORD},
+        )
+        # 失敗時もログイン画面が 200 で返るため、セッション Cookie の有無で判定する
+        return ok and len(self.session.cookie_jar) > 0, status
+
+    async def input(self):
+        return await self._request(
+            "POST", "/input", (200,),
+            data={
+                "item_name": self.rng.choice(DISH_NAMES),
+                "weight_grams": str(self.rng.randint(20, 400)),
+                "reason_text": self.rng.choice(REASON_TEXTS),
+            },
+        )
+
+    async def leftover(self):
+        return await self._request(
+            "POST", "/api/register_leftover", (201,),
+            json={"item_name": self.rng.choice(DISH_NAMES)},
+        )
+
+    async def log(self):
+        ok, status = await self._request("GET", "/log", (200,))
+        if not ok:
+            return ok, status
+        # 記録画面は表示後に週次統計 API を呼び出す
+        return await self._request(
+            "GET", f"/api/weekly_stats?date={datetime.now().strftime('%Y-%m-%d')}", (200,)
+        )
+
+    async def knowledge(self):
+        return await self._request("GET", "/knowledge/", (200,))
+
+    async def redeem(self):
+        # ポイント不足（403）も正常な応答として扱う
+        return await self._request(
+            "POST", "/api/redeem", (200, 403), json={"item_name": "エコバッグ", "cost": 1}
+        )
+
+
+async def run_virtual_user(user: VirtualUser, steps: List[str], intended_start: float, stats: LoadTestStats) -> None:
+    loop = asyncio.get_running_loop()
+    intended = intended_start
+    try:
+        for step in steps:
+            sent = loop.time()
+            try:
+                ok, status = await getattr(user, step)()
+            except Exception as e:
+                ok, status = False, type(e).__name__
+            finished = loop.time()
+            stats.record(step, intended, sent, finished, ok, status)
+            if not ok:
+                return
+            # 次のステップの本来の開始時刻は、応答を受け取ってから思考時間が経過した時刻
+            think = user.rng.expovariate(1.0 / user.think_time) if user.think_time > 0 else 0.0
+            intended = finished + think
+            await asyncio.sleep(think)
+        stats.sessions_completed += 1
+    finally:
+        await user.close()
+
+
+async def run_open_loop(
+    base_url: str,
+    rate: float,
+    duration: float,
+    steps: List[str] = None,
+    think_time: float = 0.5,
+    max_connections: int = 100,
+    max_sessions: int = 1000,
+    timeout: float = 30.0,
+    seed: int = 42,
+) -> Dict[str, Any]:
+    """平均 rate 人/秒のポアソン到着で duration 秒間シナリオを開始し、全シナリオの完了を待つ"""
+    aiohttp = _import_aiohttp()
+    steps = steps or DEFAULT_STEPS
+    rng = random.Random(seed)
+    run_id = f"{int(time.time())}_{seed}"
+    stats = LoadTestStats()
+    loop = asyncio.get_running_loop()
+
+    # 接続数の上限を超えたリクエストはコネクター内で待たされ、その時間も応答時間に含まれる
+    connector = aiohttp.TCPConnector(limit=max_connections)
+    tasks = set()
+    started = loop.time()
+    next_arrival = started
+    try:
+        while True:
+            next_arrival += rng.expovariate(rate)
+            if next_arrival - started > duration:
+                break
+            delay = next_arrival - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            stats.max_lag_ms = max(stats.max_lag_ms, (loop.time() - next_arrival) * 1000)
+
+            if len(tasks) >= max_sessions:
+                # 実行中のシナリオが多すぎる場合は飽和とみなして到着を破棄する
+                stats.sessions_dropped += 1
+                continue
+            stats.sessions_started += 1
+            user = VirtualUser(
+                aiohttp,
+                connector,
+                base_url,
+                f"lt_{run_id}_{stats.sessions_started}",
+                random.Random(rng.random()),
+                think_time,
+                timeout,
+            )
+            task = asyncio.ensure_future(run_virtual_user(user, steps, next_arrival, stats))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        await connector.close()
+
+    elapsed = loop.time() - started
+    result = stats.to_dict(elapsed)
+    result["offered_rate"] = rate
+    result["duration_s"] = round(elapsed, 2)
+    return result
+
+
+def find_saturation_point(results: List[Dict[str, Any]], slo_ms: float, max_error_rate: float = 0.01) -> Optional[float]:
+    """p99 応答時間が SLO を超えるか、エラー率・破棄が発生した最初の到着率を返す"""
+    for result in results:
+        requests = max(result["requests"], 1)
+        if (
+            result["response_time"]["p99_ms"] > slo_ms
+            or result["error_count"] / requests > max_error_rate
+            or result["sessions_dropped"] > 0
+        ):
+            return result["offered_rate"]
+    return None
+
+
+def _echo_summary(result: Dict[str, Any]) -> None:
+    rt = result["response_time"]
+    st = result["service_time"]
+    click.echo(
+        f"到着率 {result['offered_rate']}/s: {result['requests']} リクエスト "
+        f"({result['throughput_rps']} rps), エラー {result['error_count']}, 破棄 {result['sessions_dropped']}"
+    )
+    click.echo(
+        f"  応答時間 p50={rt['p50_ms']}ms p99={rt['p99_ms']}ms max={rt['max_ms']}ms "
+        f"/ サービス時間 p50={st['p50_ms']}ms p99={st['p99_ms']}ms"
+    )
+
+
+def _write_json(data: Dict[str, Any], output: Optional[str]) -> None:
+    if not output:
+        return
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    click.echo(f"結果を保存しました: {output}")
+
+
+def load_options(func):
+    """run / sweep 共通のオプション"""
+    options = [
+        click.option("--url", "base_url", required=True, help="対象サーバーのURL"),
+        click.option("--duration", default=60.0, show_default=True, help="到着を発生させる秒数"),
+        click.option("--think-time", default=0.5, show_default=True, help="ステップ間の平均思考時間（秒）"),
+        click.option("--max-connections", default=100, show_default=True),
+        click.option("--max-sessions", default=1000, show_default=True, help="同時実行シナリオ数の上限（超えた到着は破棄）"),
+        click.option("--timeout", default=30.0, show_default=True, help="リクエストのタイムアウト（秒）"),
+        click.option("--seed", default=42, show_default=True),
+        click.option("--skip", "skip_steps", multiple=True, type=click.Choice(DEFAULT_STEPS), help="実行しないステップ（例: LLM を呼ぶ leftover）"),
+        click.option("--output", default=None, help="結果を保存する JSON ファイル"),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+@click.group()
+def cli():
+    """オープンループ負荷テストツール"""
+    pass
+
+
+@cli.command("run")
+@load_options
+@click.option("--rate", default=5.0, show_default=True, help="仮想ユーザーの平均到着率（人/秒）")
+def run_command(base_url, duration, think_time, max_connections, max_sessions, timeout, seed, skip_steps, output, rate):
+    """一定の到着率で負荷をかける"""
+    steps = [s for s in DEFAULT_STEPS if s not in skip_steps]
+    result = asyncio.run(
+        run_open_loop(base_url, rate, duration, steps, think_time, max_connections, max_sessions, timeout, seed)
+    )
+    _echo_summary(result)
+    _write_json(result, output)
+
+
+@cli.command("sweep")
+@load_options
+@click.option("--rates", default="1,2,5,10,20", show_default=True, help="試す到着率（カンマ区切り）")
+@click.option("--slo-ms", default=1000.0, show_default=True, help="飽和とみなす p99 応答時間")
+def sweep_command(base_url, duration, think_time, max_connections, max_sessions, timeout, seed, skip_steps, output, rates, slo_ms):
+    """到着率を段階的に上げて飽和点を探す"""
+    steps = [s for s in DEFAULT_STEPS if s not in skip_steps]
+    results = []
+    for rate in [float(r) for r in rates.split(",") if r.strip()]:
+        result = asyncio.run(
+            run_open_loop(base_url, rate, duration, steps, think_time, max_connections, max_sessions, timeout, seed)
+        )
+        _echo_summary(result)
+        results.append(result)
+
+    saturation = find_saturation_point(results, slo_ms)
+    if saturation is None:
+        click.echo(f"試した到着率では飽和しませんでした（p99 <= {slo_ms}ms）")
+    else:
+        click.echo(f"飽和点: 到着率 {saturation}/s で SLO (p99 <= {slo_ms}ms) を満たせなくなりました")
+    _write_json({"slo_ms": slo_ms, "saturation_rate": saturation, "results": results}, output)
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
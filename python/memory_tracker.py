@@ -0,0 +1,182 @@
+"""
+ワーカーのメモリ使用量の計測とリーク調査（tracemalloc スナップショットの差分）
+
+- /admin/memory 系エンドポイント、または SIGUSR2 でスナップショットを取得する
+- 前回のスナップショットとの差分から、増加量の大きい割り当て箇所を報告する
+- RSS は process_resident_memory_bytes としてメトリクスに出力し、
+  gunicorn_config.py の post_request でメモリ量に応じたワーカー再起動に使う
+
+スナップショットはワーカーごとに保持されるため、レポートには pid を含める。
+"""
+import json
+import logging
+import os
+import signal
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+TRACEMALLOC_FRAMES = int(os.getenv("TRACEMALLOC_FRAMES", "10"))
+MEMORY_REPORT_DIR = os.getenv("MEMORY_REPORT_DIR", os.getenv("PROFILE_DIR", "profiles"))
+MEMORY_REPORT_LIMIT = 20
+# RSS を更新する最小間隔（秒）
+RSS_UPDATE_INTERVAL = 1.0
+
+# レポートから除外する割り当て元（計測自体によるもの）
+_IGNORED_TRACES = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def get_rss_bytes() -> int:
+    """現在のプロセスの常駐メモリ(RSS)をバイト単位で返す"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # /proc がない環境では最大RSSで代用する（Linux は KB 単位）
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _format_stat(stat, is_diff: bool) -> Dict[str, Any]:
+    frame = stat.traceback[0]
+    item = {
+        "location": f"{frame.filename}:{frame.lineno}",
+        "size_kb": round(stat.size / 1024, 1),
+        "count": stat.count,
+    }
+    if is_diff:
+        item["size_diff_kb"] = round(stat.size_diff / 1024, 1)
+        item["count_diff"] = stat.count_diff
+    return item
+
+
+class MemoryTracker:
+    """tracemalloc スナップショットを保持し、呼び出しごとに差分を報告する"""
+
+    def __init__(self, frames: int = TRACEMALLOC_FRAMES):
+        self.frames = frames
+        self._previous: Optional[tracemalloc.Snapshot] = None
+        self._previous_at: Optional[str] = None
+
+    @property
+    def is_tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            logger.info(f"tracemalloc を開始しました (pid={os.getpid()})")
+
+    def stop(self) -> None:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._previous = None
+        self._previous_at = None
+
+    def status(self) -> Dict[str, Any]:
+        status = {
+            "pid": os.getpid(),
+            "rss_mb": round(get_rss_bytes() / 1024 / 1024, 1),
+            "tracing": self.is_tracing,
+            "previous_snapshot_at": self._previous_at,
+        }
+        if self.is_tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            status["traced_current_mb"] = round(current / 1024 / 1024, 1)
+            status["traced_peak_mb"] = round(peak / 1024 / 1024, 1)
+        return status
+
+    def snapshot_report(
+        self, limit: int = MEMORY_REPORT_LIMIT, key_type: str = "lineno"
+    ) -> Dict[str, Any]:
+        """スナップショットを取得し、前回との差分と現在の上位割り当て箇所を返す"""
+        if not self.is_tracing:
+            self.start()
+            # 開始直後のスナップショットを比較の基準にする
+            self._previous = tracemalloc.take_snapshot().filter_traces(_IGNORED_TRACES)
+            self._previous_at = datetime.now().isoformat()
+            report = self.status()
+            report["message"] = "tracemalloc を開始しました。次回の呼び出しから差分を報告します。"
+            return report
+
+        snapshot = tracemalloc.take_snapshot().filter_traces(_IGNORED_TRACES)
+        report = self.status()
+        report["top_allocations"] = [
+            _format_stat(stat, is_diff=False)
+            for stat in snapshot.statistics(key_type)[:limit]
+        ]
+        if self._previous is not None:
+            diff = snapshot.compare_to(self._previous, key_type)
+            report["top_growth"] = [
+                _format_stat(stat, is_diff=True)
+                for stat in diff[:limit]
+                if stat.size_diff > 0
+            ]
+        self._previous = snapshot
+        self._previous_at = datetime.now().isoformat()
+        return report
+
+    def write_report(self, directory: str = MEMORY_REPORT_DIR) -> str:
+        """レポートをファイルに書き出す（シグナルハンドラー用）"""
+        os.makedirs(directory, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(directory, f"memory_{os.getpid()}_{timestamp}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot_report(), f, ensure_ascii=False, indent=2)
+        return path
+
+
+_tracker: Optional[MemoryTracker] = None
+
+
+def get_memory_tracker() -> MemoryTracker:
+    global _tracker
+    if _tracker is None:
+        _tracker = MemoryTracker()
+        if os.getenv("TRACEMALLOC_ENABLED", "0") == "1":
+            _tracker.start()
+    return _tracker
+
+
+def install_signal_handler(signum: int = signal.SIGUSR2) -> None:
+    """シグナル受信時にメモリレポートをファイルに書き出す
+
+    gunicorn はワーカー起動時にシグナルハンドラーを初期化するため、
+    post_worker_init フックから呼び出すこと。
+    """
+
+    def _handle(signum, frame):
+        try:
+            path = get_memory_tracker().write_report()
+            logger.warning(f"メモリレポートを書き出しました: {path}")
+        except Exception as e:
+            logger.error(f"メモリレポートの書き出しに失敗しました: {e}")
+
+    signal.signal(signum, _handle)
+
+
+def setup_memory_tracking(app):
+    """リクエストごとにワーカーのRSSをメトリクスに反映する"""
+    from metrics import PROCESS_RSS
+
+    state = {"last_update": 0.0}
+
+    @app.after_request
+    def update_rss_metric(response):
+        now = time.monotonic()
+        if now - state["last_update"] >= RSS_UPDATE_INTERVAL:
+            state["last_update"] = now
+            PROCESS_RSS.set(get_rss_bytes())
+        return response
+
+    return app
+
@@ -0,0 +1,438 @@
+"""
+Prometheus形式のメトリクス（エンドポイント別レイテンシ・DB時間・LLM呼び出し時間・接続待ち時間）
+
+gunicorn の複数ワーカーで集計するため、METRICS_MULTIPROC_DIR が設定されている場合は
+各ワーカーが自分の値を metrics_<pid>.json に定期的に書き出し、/metrics で全ファイルを合算する。
+終了したワーカーのファイルは gunicorn の child_exit フックから mark_process_dead() で
+metrics_archive.json に統合する（カウンターが巻き戻らないようにするため）。
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+# 設定されている場合は Authorization: Bearer <token> を要求する
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+ARCHIVE_FILENAME = "metrics_archive.json"
+
+# 秒単位のデフォルトバケット（Webリクエスト向け）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# LLM呼び出しは数秒かかるため広めのバケット
+LLM_BUCKETS = (0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labelnames: Iterable[str], labels: Dict[str, str]) -> LabelKey:
+    return tuple((name, str(labels.get(name, ""))) for name in labelnames)
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(
+    key: Iterable[Tuple[str, str]], extra: Optional[Dict[str, str]] = None
+) -> str:
+    pairs = list(key) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    body = ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs)
+    return "{" + body + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """単調増加カウンター"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+        _registry.maybe_flush()
+
+    def dump(self) -> Dict[str, float]:
+        return {json.dumps(key): value for key, value in self._values.items()}
+
+    @staticmethod
+    def merge(target: Dict[str, float], source: Dict[str, float]) -> None:
+        for key, value in source.items():
+            target[key] = target.get(key, 0.0) + value
+
+    def render(self, samples: Dict[str, float]) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(json.loads(key))} {_format_value(value)}"
+            for key, value in sorted(samples.items())
+        ]
+
+
+class Gauge:
+    """ワーカーごとの現在値（終了したワーカーの値はアーカイブせずに捨てる）"""
+
+    type_name = "gauge"
+    archive_on_exit = False
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        # マルチプロセス集計で値が混ざらないよう、pid ラベルを必ず付ける
+        self.labelnames = tuple(labelnames) + ("pid",)
+        self._values: Dict[LabelKey, float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        key = _label_key(self.labelnames, dict(labels, pid=os.getpid()))
+        with _lock:
+            self._values[key] = value
+        _registry.maybe_flush()
+
+    def dump(self) -> Dict[str, float]:
+        return {json.dumps(key): value for key, value in self._values.items()}
+
+    @staticmethod
+    def merge(target: Dict[str, float], source: Dict[str, float]) -> None:
+        target.update(source)
+
+    def render(self, samples: Dict[str, float]) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(json.loads(key))} {_format_value(value)}"
+            for key, value in sorted(samples.items())
+        ]
+
+
+class Histogram:
+    """バケット付きヒストグラム（Prometheus の histogram 型に対応）"""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [各バケットの件数(非累積)..., +Inf の件数, 合計値]
+        self._values: Dict[LabelKey, List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(self.labelnames, labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with _lock:
+            series = self._values.get(key)
+            if series is None:
+                series = [0.0] * (len(self.buckets) + 2)
+                self._values[key] = series
+            series[index] += 1
+            series[-1] += value
+        _registry.maybe_flush()
+
+    def time(self, **labels):
+        """with ブロックの所要時間を記録するコンテキストマネージャー"""
+        return _Timer(self, labels)
+
+    def dump(self) -> Dict[str, List[float]]:
+        return {json.dumps(key): list(series) for key, series in self._values.items()}
+
+    @staticmethod
+    def merge(target: Dict[str, List[float]], source: Dict[str, List[float]]) -> None:
+        for key, series in source.items():
+            if key not in target:
+                target[key] = list(series)
+            elif len(target[key]) == len(series):
+                target[key] = [a + b for a, b in zip(target[key], series)]
+
+    def render(self, samples: Dict[str, List[float]]) -> List[str]:
+        lines = []
+        for key, series in sorted(samples.items()):
+            label_key = json.loads(key)
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(label_key, {'le': _format_value(bound)})} "
+                    f"{_format_value(cumulative)}"
+                )
+            lines.append(f"{self.name}_sum{_format_labels(label_key)} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(label_key)} {_format_value(cumulative)}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class MetricsRegistry:
+    """メトリクスの登録・マルチプロセス集計・Prometheus テキスト出力"""
+
+    def __init__(self, multiproc_dir: Optional[str] = None):
+        self.metrics: Dict[str, object] = {}
+        self.multiproc_dir = multiproc_dir
+        self._last_flush = 0.0
+        if multiproc_dir:
+            os.makedirs(multiproc_dir, exist_ok=True)
+
+    def register(self, metric):
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    # --- マルチプロセス集計 ---
+
+    def _process_file(self, pid: Optional[int] = None) -> str:
+        return os.path.join(self.multiproc_dir, f"metrics_{pid or os.getpid()}.json")
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with _lock:
+            return {name: metric.dump() for name, metric in self.metrics.items()}
+
+    def maybe_flush(self) -> None:
+        """前回の書き出しから METRICS_FLUSH_INTERVAL 秒以上経っていればファイルに書き出す"""
+        if not self.multiproc_dir:
+            return
+        now = time.monotonic()
+        if now - self._last_flush < METRICS_FLUSH_INTERVAL:
+            return
+        self._last_flush = now
+        self.flush()
+
+    def flush(self) -> None:
+        if not self.multiproc_dir:
+            return
+        _write_json_atomic(self._process_file(), self.snapshot())
+
+    def mark_process_dead(self, pid: int) -> None:
+        """終了したワーカーの値をアーカイブに統合する（gunicorn master から呼ぶ）"""
+        if not self.multiproc_dir:
+            return
+        path = self._process_file(pid)
+        data = _read_json(path)
+        if data is None:
+            return
+        archive_path = os.path.join(self.multiproc_dir, ARCHIVE_FILENAME)
+        archive = _read_json(archive_path) or {}
+        data = {
+            name: samples
+            for name, samples in data.items()
+            if getattr(self.metrics.get(name), "archive_on_exit", True)
+        }
+        self._merge_into(archive, data)
+        _write_json_atomic(archive_path, archive)
+        os.remove(path)
+
+    def _merge_into(self, target: Dict[str, Dict], source: Dict[str, Dict]) -> None:
+        for name, samples in source.items():
+            metric = self.metrics.get(name)
+            if metric is None:
+                continue
+            metric.merge(target.setdefault(name, {}), samples)
+
+    def collect(self) -> Dict[str, Dict]:
+        """全ワーカー分を合算したサンプル（自プロセスは最新のメモリ上の値を使う）"""
+        merged: Dict[str, Dict] = {}
+        if self.multiproc_dir:
+            own_file = os.path.basename(self._process_file())
+            for filename in sorted(os.listdir(self.multiproc_dir)):
+                if not filename.startswith("metrics_") or not filename.endswith(".json"):
+                    continue
+                if filename == own_file:
+                    continue
+                data = _read_json(os.path.join(self.multiproc_dir, filename))
+                if data:
+                    self._merge_into(merged, data)
+        self._merge_into(merged, self.snapshot())
+        return merged
+
+    def render_prometheus(self) -> str:
+        samples = self.collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type_name}")
+            lines.extend(metric.render(samples.get(name, {})))
+        return "\n".join(lines) + "\n"
+
+
+def _read_json(path: str) -> Optional[Dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json_atomic(path: str, data: Dict) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"メトリクスの書き出しに失敗しました: {e}")
+
+
+_lock = threading.Lock()
+_registry = MetricsRegistry(METRICS_MULTIPROC_DIR)
+
+
+def get_registry() -> MetricsRegistry:
+    return _registry
+
+
+# --- アプリ共通のメトリクス ---
+REQUEST_LATENCY = _registry.histogram(
+    "http_request_duration_seconds",
+    "エンドポイント別のリクエスト処理時間",
+    ("endpoint", "method"),
+)
+REQUEST_COUNT = _registry.counter(
+    "http_requests_total",
+    "エンドポイント・ステータス別のリクエスト数",
+    ("endpoint", "method", "status"),
+)
+DB_TIME = _registry.histogram(
+    "db_time_per_request_seconds",
+    "1リクエストあたりの合計DB時間",
+    ("endpoint",),
+)
+DB_QUERIES = _registry.histogram(
+    "db_queries_per_request",
+    "1リクエストあたりのクエリ数",
+    ("endpoint",),
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100),
+)
+LLM_LATENCY = _registry.histogram(
+    "llm_call_duration_seconds",
+    "LLM(OpenAI)呼び出しの所要時間",
+    ("function", "outcome"),
+    buckets=LLM_BUCKETS,
+)
+POOL_WAIT = _registry.histogram(
+    "db_pool_wait_seconds",
+    "DB接続の取得（NullPool では新規接続の確立）にかかった時間",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+LOG_RECORDS_DROPPED = _registry.counter(
+    "log_records_dropped_total",
+    "ログキューで破棄・間引きされたレコード数",
+    ("reason",),
+)
+
+PROCESS_RSS = _registry.gauge(
+    "process_resident_memory_bytes",
+    "ワーカープロセスの常駐メモリ(RSS)",
+)
+WORKER_RECYCLES = _registry.counter(
+    "worker_recycles_total",
+    "理由別のワーカー再起動数",
+    ("reason",),
+)
+
+
+def _timed_connect(dialect, conn_rec, cargs, cparams):
+    start = time.perf_counter()
+    try:
+        return dialect.connect(*cargs, **cparams)
+    finally:
+        POOL_WAIT.observe(time.perf_counter() - start)
+
+
+def install_pool_wait_listener(engine) -> None:
+    """DB接続の確立時間を db_pool_wait_seconds に記録する（同じエンジンに2回登録しない）"""
+    from sqlalchemy import event
+
+    if not event.contains(engine, "do_connect", _timed_connect):
+        event.listen(engine, "do_connect", _timed_connect)
+
+
+def setup_metrics(app, engine=None):
+    """Flaskアプリにリクエスト計測と /metrics エンドポイントを設定"""
+    from flask import Response, abort, g, request
+
+    from sql_instrumentation import current_query_stats
+
+    if engine is not None:
+        install_pool_wait_listener(engine)
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start_time = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        start = g.get("metrics_start_time")
+        if start is None or request.path == METRICS_PATH:
+            return response
+        endpoint = request.endpoint or "unmatched"
+        REQUEST_LATENCY.observe(
+            time.perf_counter() - start, endpoint=endpoint, method=request.method
+        )
+        REQUEST_COUNT.inc(
+            endpoint=endpoint, method=request.method, status=response.status_code
+        )
+        stats = current_query_stats()
+        if stats is not None:
+            DB_TIME.observe(stats.total_time, endpoint=endpoint)
+            DB_QUERIES.observe(stats.count, endpoint=endpoint)
+        return response
+
+    @app.route(METRICS_PATH)
+    def metrics_endpoint():
+        if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+            abort(403)
+        return Response(
+            _registry.render_prometheus(),
+            mimetype="text/plain; version=0.0.4; charset=utf-8",
+        )
+
+    return app
@@ -1,6 +1,6 @@
 # models.py
 import datetime
-from sqlalchemy import Column, Integer, String, ForeignKey, REAL, Text
+from sqlalchemy import Column, Integer, String, ForeignKey, REAL, Text, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm import declarative_base
 
@@ -11,6 +11,11 @@ Base = declarative_base()
 # ユーザーテーブルに対応するクラスを定義します
 class User(Base):
     __tablename__ = "users"
+    # username / email はログイン時の検索に使う。unique=True で一意インデックスが作成される
+    __table_args__ = (
+        # ポイントランキング（final_report）
+        Index("idx_users_total_points", "total_points"),
+    )
 
     id = Column(Integer, primary_key=True)
     username = Column(String(255), nullable=False, unique=True)
@@ -20,9 +25,17 @@ class User(Base):
     # 最後にポイントを付与した週の開始日 (YYYY-MM-DD). idempotency 用
     last_points_awarded_week_start = Column(String(10), nullable=True)
     last_points_awarded_date = Column(String(10), nullable=True)  # 毎日最初の入力日（YYYY-MM-DD）
+    # 記録（保管した記録を含む）の集計値。記録の追加・変更・削除と同じトランザクションで user_counters.py が更新する
+    record_count = Column(Integer, nullable=False, default=0, server_default="0")
+    total_grams = Column(REAL, nullable=False, default=0, server_default="0")
+    first_record_date = Column(String(10), nullable=True)  # YYYY-MM-DD
+    last_record_date = Column(String(10), nullable=True)  # YYYY-MM-DD
+    participation_days = Column(Integer, nullable=False, default=0, server_default="0")
 
     # このユーザーに関連するフードロス記録を定義します
     records = relationship("FoodLossRecord", back_populates="user")
+    # total_points は points_ledger の合計のキャッシュ（更新は points_ledger.py 経由で行う）
+    ledger_entries = relationship("PointsLedger", back_populates="user")
 
 
 # 廃棄理由テーブルに対応するクラスを定義します
@@ -39,6 +52,12 @@ class LossReason(Base):
 # フードロス記録テーブルに対応するクラスを定義します
 class FoodLossRecord(Base):
     __tablename__ = "food_loss_records"
+    __table_args__ = (
+        # ユーザーごとの週次集計・ポイント計算（statistics / services）
+        Index("idx_food_loss_records_user_date", "user_id", "record_date"),
+        # 期間での全体集計（final_report）
+        Index("idx_food_loss_records_record_date", "record_date"),
+    )
 
     id = Column(Integer, primary_key=True)
     # 外部キー（FOREIGN KEY）を定義し、Userテーブルのidを参照します
@@ -62,6 +81,9 @@ class FoodLossRecord(Base):
 #残ったものを記録し、アレンジレシピを提案するためのテーブルを追加しました。
 class arrange_suggest(Base):
     __tablename__ = 'arrange_suggest'
+    __table_args__ = (
+        Index("idx_arrange_suggest_user_id", "user_id"),
+    )
     id = Column(Integer, primary_key=True)
 
     user_id = Column(Integer, ForeignKey('users.id'))
@@ -69,3 +91,62 @@ class arrange_suggest(Base):
 
     arrange_recipe = Column(Text, nullable=True)
 #---ここまで---
+
+
+# ポイントの増減の履歴（追記のみ。users.total_points はこの合計と一致する）
+class PointsLedger(Base):
+    __tablename__ = "points_ledger"
+    __table_args__ = (
+        # 履歴の表示（ユーザーごとに新しい順）
+        Index("idx_points_ledger_user_id", "user_id", "id"),
+        # 同じ週・同じ日の二重付与を防ぐ（交換は NULL のため制約の対象外）
+        UniqueConstraint("user_id", "idempotency_key", name="uq_points_ledger_idempotency"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    # weekly_award / weekly_adjustment / daily_bonus / redemption / adjustment / opening_balance
+    entry_type = Column(String(20), nullable=False)
+    # 付与は正、交換は負の値
+    points = Column(Integer, nullable=False)
+    balance_after = Column(Integer, nullable=False)
+    # 対象の週・日付や交換した景品名など
+    reference = Column(String(255), nullable=True)
+    idempotency_key = Column(String(64), nullable=True)
+    created_at = Column(String(32), nullable=False)
+
+    user = relationship("User", back_populates="ledger_entries")
+
+
+# 保管期間を過ぎた記録の移動先（archive.py が food_loss_records から移す。画面からは参照しない）
+class FoodLossRecordArchive(Base):
+    __tablename__ = "food_loss_records_archive"
+    __table_args__ = (
+        Index("idx_food_loss_records_archive_user_id", "user_id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    # 移動前の food_loss_records.id
+    record_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    item_name = Column(String(255), nullable=False)
+    weight_grams = Column(REAL, nullable=False)
+    loss_reason_id = Column(Integer, ForeignKey("loss_reasons.id"))
+    record_date = Column(String(255), nullable=False)
+    archived_at = Column(String(32), nullable=False)
+
+
+# 移動した記録のユーザー・日・廃棄理由ごとの集計（final_report は記録とこの表を合わせて集計する）
+class DailyLossSummary(Base):
+    __tablename__ = "daily_loss_summaries"
+    __table_args__ = (
+        Index("idx_daily_loss_summaries_user_day", "user_id", "day"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    # YYYY-MM-DD
+    day = Column(String(10), nullable=False)
+    loss_reason_id = Column(Integer, ForeignKey("loss_reasons.id"))
+    total_grams = Column(REAL, nullable=False)
+    record_count = Column(Integer, nullable=False)
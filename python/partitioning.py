@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+"""
+food_loss_records の月別パーティション
+
+statistics.py のよく使うクエリは record_date の範囲で記録を絞り込む。PostgreSQL では
+food_loss_records を record_date の月ごとのレンジパーティションにし（マイグレーション 0005）、
+範囲の条件で対象の月のパーティションだけを読むようにする（パーティションプルーニング）。
+record_date は ISO 8601 の文字列のため、月の境界は 'YYYY-MM' の文字列で表す
+（'2026-10' <= '2026-10-01T...' < '2026-11'）。
+
+- ensure: 今月から PARTITION_MONTHS_AHEAD か月先までのパーティションを作成する。範囲外の記録が
+  入る DEFAULT パーティションに行がある月は、その行を新しいパーティションに移してから追加する
+- detach: 保管期間（archive.py の ARCHIVE_HORIZON_WEEKS）より前の月のパーティションを、
+  日ごとの集計（daily_loss_summaries）を残してから切り離す。切り離しはデータを移動しないため
+  件数によらず一定時間で終わり、切り離したテーブルはそのまま保管用に残る
+
+SQLite にはパーティションがないため、同じ名前の月ごとのテーブル（food_loss_records_pYYYY_MM）に
+保管期間より前の月の記録を移す（detach）。ensure は何もしない。
+
+使用例:
+    python partitioning.py status
+    python partitioning.py ensure                  # 毎月実行（cron）
+    python partitioning.py detach --dry-run
+    python partitioning.py benchmark --users 2000 --weeks 52
+"""
+import os
+import random
+import re
+import tempfile
+import time
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import click
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import clock
+from archive import ARCHIVE_HORIZON_WEEKS, add_to_summaries, archive_cutoff
+
+TABLE = "food_loss_records"
+DEFAULT_PARTITION = f"{TABLE}_default"
+# 先に作成しておく月数（今月を含まない）
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+DETACH_BATCH_SIZE = 5000
+
+_PARTITION_NAME = re.compile(rf"^{TABLE}_p(\d{{4}})_(\d{{2}})$")
+_COLUMNS = "id, user_id, item_name, weight_grams, loss_reason_id, record_date"
+
+
+# --- 月の計算 ---
+
+def add_months(month: str, count: int) -> str:
+    year, number = map(int, month.split("-"))
+    index = year * 12 + number - 1 + count
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def month_range(first: str, last: str) -> List[str]:
+    months = []
+    while first <= last:
+        months.append(first)
+        first = add_months(first, 1)
+    return months
+
+
+def partition_name(month: str) -> str:
+    return f"{TABLE}_p{month.replace('-', '_')}"
+
+
+def partition_month(name: str) -> Optional[str]:
+    match = _PARTITION_NAME.match(name)
+    return f"{match.group(1)}-{match.group(2)}" if match else None
+
+
+def month_bounds(month: str) -> Tuple[str, str]:
+    """パーティションの範囲（下限を含み、上限を含まない）"""
+    return month, add_months(month, 1)
+
+
+# --- PostgreSQL ---
+
+def is_partitioned(conn) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    return conn.execute(
+        text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:table)"), {"table": TABLE}
+    ).scalar() or False
+
+
+def list_partitions(conn) -> List[str]:
+    """月のパーティション（PostgreSQL）または月ごとのテーブル（SQLite）の名前（月の順）"""
+    if conn.dialect.name == "postgresql":
+        names = conn.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:table)"
+        ), {"table": TABLE}).scalars().all()
+    else:
+        names = conn.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE :pattern"
+        ), {"pattern": f"{TABLE}_p%"}).scalars().all()
+    return sorted(name for name in names if partition_month(name))
+
+
+def _create_partition(conn, month: str) -> None:
+    lower, upper = month_bounds(month)
+    conn.exec_driver_sql(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {TABLE} "
+        f"FOR VALUES FROM ('{lower}') TO ('{upper}')"
+    )
+
+
+def _move_out_of_default(conn, month: str) -> int:
+    """DEFAULT パーティションにある month の行を新しいパーティションに移す（移した行数を返す）"""
+    lower, upper = month_bounds(month)
+    name = partition_name(month)
+    # 行のある範囲と重なるパーティションは作成できないため、別のテーブルに移してから接続する
+    conn.exec_driver_sql(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    moved = conn.exec_driver_sql(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+        f"WHERE record_date >= '{lower}' AND record_date < '{upper}' RETURNING {_COLUMNS}) "
+        f"INSERT INTO {name} ({_COLUMNS}) SELECT {_COLUMNS} FROM moved"
+    ).rowcount
+    conn.exec_driver_sql(
+        f"ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM ('{lower}') TO ('{upper}')"
+    )
+    return moved
+
+
+def ensure_partitions(conn, months_ahead: int = PARTITION_MONTHS_AHEAD) -> List[str]:
+    """今月から months_ahead か月先まで（と DEFAULT に行がある月）のパーティションを作成し、作成した名前を返す"""
+    if not is_partitioned(conn):
+        return []
+    existing = set(list_partitions(conn))
+    this_month = clock.now().strftime("%Y-%m")
+    wanted = set(month_range(this_month, add_months(this_month, months_ahead)))
+    stray = conn.exec_driver_sql(
+        f"SELECT DISTINCT substr(record_date, 1, 7) FROM {DEFAULT_PARTITION}"
+    ).scalars().all()
+    created = []
+    for month in sorted(wanted | {month for month in stray if re.fullmatch(r"\d{4}-\d{2}", month or "")}):
+        name = partition_name(month)
+        if name in existing:
+            continue
+        if month in stray:
+            _move_out_of_default(conn, month)
+        else:
+            _create_partition(conn, month)
+        created.append(name)
+    return created
+
+
+def convert_to_partitioned(conn, months_ahead: int = PARTITION_MONTHS_AHEAD) -> None:
+    """既存の food_loss_records を月別パーティションのテーブルに置き換える（PostgreSQL、マイグレーション 0005）"""
+    from db_migration import model_indexes
+
+    old = f"{TABLE}_unpartitioned"
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": TABLE}).scalar()
+    conn.exec_driver_sql(f"ALTER TABLE {TABLE} RENAME TO {old}")
+    # インデックス名はスキーマ内で一意のため、新しいテーブルで同じ名前を使えるよう削除する
+    conn.exec_driver_sql(f"ALTER TABLE {old} DROP CONSTRAINT IF EXISTS {TABLE}_pkey")
+    indexes = model_indexes((TABLE,))
+    for name, _, _ in indexes:
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+
+    # パーティションキーは主キーに含める必要がある
+    conn.exec_driver_sql(
+        f"CREATE TABLE {TABLE} (LIKE {old} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE (record_date)"
+    )
+    conn.exec_driver_sql(f"ALTER TABLE {TABLE} ADD PRIMARY KEY (id, record_date)")
+    conn.exec_driver_sql(f"ALTER TABLE {TABLE} ADD FOREIGN KEY (user_id) REFERENCES users (id)")
+    conn.exec_driver_sql(f"ALTER TABLE {TABLE} ADD FOREIGN KEY (loss_reason_id) REFERENCES loss_reasons (id)")
+    conn.exec_driver_sql(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT")
+
+    first, last = conn.exec_driver_sql(
+        f"SELECT min(substr(record_date, 1, 7)), max(substr(record_date, 1, 7)) FROM {old} "
+        f"WHERE record_date ~ '^[0-9]{{4}}-[0-9]{{2}}'"
+    ).one()
+    this_month = clock.now().strftime("%Y-%m")
+    for month in month_range(min(first or this_month, this_month), max(last or this_month, add_months(this_month, months_ahead))):
+        _create_partition(conn, month)
+
+    conn.exec_driver_sql(f"INSERT INTO {TABLE} ({_COLUMNS}) SELECT {_COLUMNS} FROM {old}")
+    # 親テーブルのインデックスは各パーティションにも作成される
+    for name, _, columns in indexes:
+        conn.exec_driver_sql(f"CREATE INDEX {name} ON {TABLE} ({', '.join(columns)})")
+    if sequence:
+        conn.exec_driver_sql(f"ALTER SEQUENCE {sequence} OWNED BY {TABLE}.id")
+    conn.exec_driver_sql(f"DROP TABLE {old}")
+
+
+def convert_to_plain(conn) -> None:
+    """月別パーティションのテーブルを通常のテーブルに戻す（マイグレーション 0005 の取り消し）"""
+    from sqlalchemy.schema import CreateTable
+
+    from database import reset_id_sequences
+    from db_migration import model_indexes
+    from models import Base
+
+    old = f"{TABLE}_partitioned"
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": TABLE}).scalar()
+    conn.exec_driver_sql(f"ALTER TABLE {TABLE} RENAME TO {old}")
+    # 新しいテーブルの主キー・インデックス・連番と名前が重ならないようにする
+    if sequence:
+        conn.exec_driver_sql(f"ALTER SEQUENCE {sequence} RENAME TO {TABLE}_id_seq_partitioned")
+    conn.exec_driver_sql(f"ALTER TABLE {old} DROP CONSTRAINT IF EXISTS {TABLE}_pkey")
+    indexes = model_indexes((TABLE,))
+    for name, _, _ in indexes:
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+    conn.execute(CreateTable(Base.metadata.tables[TABLE]))
+    conn.exec_driver_sql(f"INSERT INTO {TABLE} ({_COLUMNS}) SELECT {_COLUMNS} FROM {old}")
+    for name, _, columns in indexes:
+        conn.exec_driver_sql(f"CREATE INDEX {name} ON {TABLE} ({', '.join(columns)})")
+    reset_id_sequences(conn, (TABLE,))
+    # 切り離していないパーティションと、古い連番も削除される
+    conn.exec_driver_sql(f"DROP TABLE {old} CASCADE")
+
+
+# --- 切り離し ---
+
+def detachable_months(conn, horizon_weeks: int = ARCHIVE_HORIZON_WEEKS) -> List[str]:
+    """保管期間より前に終わる、記録の残っている月（PostgreSQL ではパーティションのある月）"""
+    limit = archive_cutoff(horizon_weeks)[:7]
+    if is_partitioned(conn):
+        months = [partition_month(name) for name in list_partitions(conn)]
+    else:
+        months = conn.exec_driver_sql(
+            f"SELECT DISTINCT substr(record_date, 1, 7) FROM {TABLE} WHERE record_date < '{limit}'"
+        ).scalars().all()
+    return sorted(month for month in months if month and add_months(month, 1) <= limit)
+
+
+def _summarize(db: Session, source: str, where: str = "") -> int:
+    """source の記録を日ごとの集計に加算する（ID 順に DETACH_BATCH_SIZE 件ずつ）"""
+    summarized = last_id = 0
+    while True:
+        rows = [
+            dict(row) for row in db.execute(text(
+                f"SELECT id, user_id, weight_grams, loss_reason_id, record_date FROM {source} "
+                f"WHERE id > :last_id {where} ORDER BY id LIMIT :limit"
+            ), {"last_id": last_id, "limit": DETACH_BATCH_SIZE}).mappings()
+        ]
+        if not rows:
+            return summarized
+        add_to_summaries(db, rows)
+        last_id = rows[-1]["id"]
+        summarized += len(rows)
+
+
+def detach_month(db: Session, month: str) -> int:
+    """month の記録を日ごとの集計に加算してから、月のテーブルとして切り離す（1トランザクション）。集計した件数を返す"""
+    from database import begin_write
+
+    name = partition_name(month)
+    lower, upper = month_bounds(month)
+    begin_write(db)
+    conn = db.connection()
+    if is_partitioned(conn):
+        summarized = _summarize(db, name)
+        conn.exec_driver_sql(f"ALTER TABLE {TABLE} DETACH PARTITION {name}")
+    else:
+        in_month = f"record_date >= '{lower}' AND record_date < '{upper}'"
+        summarized = _summarize(db, TABLE, f"AND {in_month}")
+        if name in list_partitions(conn):
+            conn.exec_driver_sql(f"INSERT INTO {name} SELECT {_COLUMNS} FROM {TABLE} WHERE {in_month}")
+        else:
+            conn.exec_driver_sql(f"CREATE TABLE {name} AS SELECT {_COLUMNS} FROM {TABLE} WHERE {in_month}")
+        conn.exec_driver_sql(f"DELETE FROM {TABLE} WHERE {in_month}")
+    db.commit()
+    return summarized
+
+
+def detach_old_months(db: Session, horizon_weeks: int = ARCHIVE_HORIZON_WEEKS, dry_run: bool = False) -> Dict[str, int]:
+    """保管期間より前の月をすべて切り離し、{月: 集計した件数} を返す"""
+    months = detachable_months(db.connection(), horizon_weeks)
+    db.rollback()
+    if dry_run:
+        return {month: 0 for month in months}
+    return {month: detach_month(db, month) for month in months}
+
+
+# --- ベンチマーク ---
+
+def _hot_queries(db: Session, user_id: int):
+    import statistics
+
+    now = clock.now()
+    return [
+        ("calculate_weekly_statistics", lambda: statistics.calculate_weekly_statistics(db, user_id, now)),
+        ("get_total_grams_for_weeks", lambda: statistics.get_total_grams_for_weeks(db, user_id, 8)),
+        ("get_last_two_weeks", lambda: statistics.get_last_two_weeks(db, user_id)),
+    ]
+
+
+def time_hot_queries(db: Session, user_ids: List[int]) -> Dict[str, float]:
+    """statistics.py の範囲クエリのユーザーあたりの平均時間（ミリ秒）"""
+    timings: Dict[str, float] = {}
+    for user_id in user_ids:
+        for name, query in _hot_queries(db, user_id):
+            started = time.perf_counter()
+            query()
+            timings[name] = timings.get(name, 0.0) + (time.perf_counter() - started) * 1000
+    db.rollback()
+    return {name: round(total / len(user_ids), 3) for name, total in timings.items()}
+
+
+def scanned_partitions(db: Session, user_id: int) -> Tuple[int, int]:
+    """8週間の合計のクエリが読むパーティション数と全体のパーティション数（PostgreSQL）"""
+    start = (clock.now() - timedelta(weeks=8)).strftime("%Y-%m-%d")
+    plan = db.execute(text(
+        f"EXPLAIN (FORMAT JSON) SELECT sum(weight_grams) FROM {TABLE} "
+        f"WHERE user_id = :user_id AND record_date >= :start"
+    ), {"user_id": user_id, "start": start}).scalar()
+    relations = set()
+
+    def walk(node):
+        if "Relation Name" in node:
+            relations.add(node["Relation Name"])
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(plan[0]["Plan"])
+    return len(relations), len(list_partitions(db.connection())) + 1
+
+
+def benchmark_pruning(engine, sample_users: int = 50, seed: int = 1) -> Dict[str, Any]:
+    """範囲クエリの時間を、プルーニングあり・なし（SQLite は古い月の切り離し前・後）で比較する"""
+    db = Session(engine)
+    try:
+        user_ids = db.execute(text("SELECT id FROM users ORDER BY id")).scalars().all()
+        user_ids = random.Random(seed).sample(user_ids, min(sample_users, len(user_ids)))
+        result: Dict[str, Any] = {
+            "backend": engine.dialect.name,
+            "records": db.execute(text(f"SELECT count(*) FROM {TABLE}")).scalar(),
+            "sample_users": len(user_ids),
+        }
+        if is_partitioned(db.connection()):
+            db.execute(text("SET enable_partition_pruning = off"))
+            result["before"] = time_hot_queries(db, user_ids)
+            result["partitions_without_pruning"] = scanned_partitions(db, user_ids[0])[0]
+            db.execute(text("SET enable_partition_pruning = on"))
+            result["partitions_with_pruning"], result["partitions"] = scanned_partitions(db, user_ids[0])
+            result["after"] = time_hot_queries(db, user_ids)
+        else:
+            result["before"] = time_hot_queries(db, user_ids)
+            result["detached_months"] = len(detach_old_months(db))
+            result["hot_records"] = db.execute(text(f"SELECT count(*) FROM {TABLE}")).scalar()
+            result["after"] = time_hot_queries(db, user_ids)
+        return result
+    finally:
+        db.close()
+
+
+@click.group()
+def cli():
+    """food_loss_records の月別パーティションの管理ツール"""
+    pass
+
+
+@cli.command("status")
+def status_command():
+    """パーティション（SQLite では切り離した月のテーブル）の一覧"""
+    from database import engine
+
+    with engine.connect() as conn:
+        partitioned = is_partitioned(conn)
+        click.echo(f"{TABLE}: {'月別パーティション' if partitioned else '通常のテーブル'}")
+        for name in list_partitions(conn):
+            rows = conn.exec_driver_sql(f"SELECT count(*) FROM {name}").scalar()
+            click.echo(f"  {name}: {rows} 件")
+        months = detachable_months(conn)
+        click.echo(f"切り離せる月: {', '.join(months) if months else 'なし'}")
+
+
+@cli.command("ensure")
+@click.option("--months-ahead", default=PARTITION_MONTHS_AHEAD, show_default=True, help="先に作成しておく月数")
+def ensure_command(months_ahead):
+    """今月から先のパーティションを作成する（PostgreSQL）"""
+    from database import engine
+
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            click.echo("月別パーティションのテーブルではないため、何もしません")
+            return
+        created = ensure_partitions(conn, months_ahead)
+    click.echo(f"✓ {len(created)} 件のパーティションを作成しました" + (f": {', '.join(created)}" if created else ""))
+
+
+@cli.command("detach")
+@click.option("--horizon-weeks", default=ARCHIVE_HORIZON_WEEKS, show_default=True, help="記録をそのまま残す週数")
+@click.option("--dry-run", is_flag=True, help="切り離す月だけを表示する")
+def detach_command(horizon_weeks, dry_run):
+    """保管期間より前の月を、日ごとの集計を残してから切り離す"""
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        detached = detach_old_months(db, horizon_weeks=horizon_weeks, dry_run=dry_run)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    finally:
+        db.close()
+    for month, rows in detached.items():
+        click.echo(f"{partition_name(month)}" + ("" if dry_run else f": {rows} 件を集計して切り離しました"))
+    if not detached:
+        click.echo("✓ 切り離す月はありません")
+
+
+@cli.command("benchmark")
+@click.option("--users", default=2000, show_default=True, help="合成データのユーザー数")
+@click.option("--weeks", default=52, show_default=True, help="合成データの週数")
+@click.option("--records-per-week", default=5.0, show_default=True)
+@click.option("--sample-users", default=50, show_default=True, help="クエリを実行するユーザー数")
+@click.option("--database-url", default=None, help="空のデータベース（未指定なら一時的な SQLite）")
+def benchmark_command(users, weeks, records_per_week, sample_users, database_url):
+    """合成データで、statistics.py の範囲クエリのプルーニングの効果を計測する"""
+    from database import create_database_engine
+    from db_migration import upgrade
+    from synthetic_data import SyntheticDataGenerator, load_synthetic_data
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_database_engine(database_url or f"sqlite:///{tmp}/partitioning.db")
+        upgrade(engine)
+        load_synthetic_data(engine, SyntheticDataGenerator(users, weeks, records_per_week=records_per_week))
+        with engine.begin() as conn:
+            ensure_partitions(conn)
+        result = benchmark_pruning(engine, sample_users=sample_users)
+        engine.dispose()
+
+    click.echo(f"{result['backend']}: 記録 {result['records']} 件、{result['sample_users']} 人で計測")
+    if "partitions" in result:
+        click.echo(
+            f"読むパーティション: {result['partitions_without_pruning']} → {result['partitions_with_pruning']}"
+            f"（全 {result['partitions']}）"
+        )
+    else:
+        click.echo(f"古い {result['detached_months']} か月を切り離し、記録 {result['hot_records']} 件")
+    for name, before in result["before"].items():
+        after = result["after"][name]
+        click.echo(f"  {name}: {before:.3f} ms → {after:.3f} ms（{before / after if after else 0:.1f} 倍）")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+ポイント台帳（points_ledger）
+
+ポイントの付与・交換はすべて台帳に1行ずつ追記し、users.total_points はその合計の
+キャッシュとして扱う。残高の更新は読み込み→計算→書き込みではなく、1つの
+UPDATE ... RETURNING で行うため、同時のリクエストでも更新が失われない。
+交換は WHERE total_points >= cost の条件付き UPDATE のため、残高が負になることもない。
+
+ここの関数は commit しない（呼び出し側のトランザクションで確定する）。
+
+使用例:
+    python points_ledger.py reconcile          # キャッシュと台帳の合計を照合
+    python points_ledger.py reconcile --fix    # 不一致のキャッシュを台帳の合計に合わせる
+"""
+import sys
+from typing import Any, Dict, List, Optional
+
+import click
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+import clock
+from database import begin_write
+from models import PointsLedger, User
+
+# 台帳の種類
+WEEKLY_AWARD = "weekly_award"
+DAILY_BONUS = "daily_bonus"
+REDEMPTION = "redemption"
+ADJUSTMENT = "adjustment"
+# 付与済みの週の記録を変更・削除した後の週次ポイントの差分（reference はその週の開始日）
+WEEKLY_ADJUSTMENT = "weekly_adjustment"
+OPENING_BALANCE = "opening_balance"
+
+HISTORY_DEFAULT_LIMIT = 20
+HISTORY_MAX_LIMIT = 100
+
+
+def lock_user(db: Session, user_id: int) -> Optional[User]:
+    """ユーザー単位でポイントの更新を直列化するロックを取り、ユーザーを返す
+
+    PostgreSQL では users の行を SELECT ... FOR UPDATE でロックする（コミットまで保持）。
+    SQLite では行ロックがないため、BEGIN IMMEDIATE でデータベースの書き込みロックを取る。
+    同じユーザーの2つ目のリクエストは、1つ目のコミット後に最新のデータで評価される。
+    """
+    begin_write(db)
+    return db.execute(
+        select(User)
+        .where(User.id == user_id)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    ).scalar_one_or_none()
+
+
+def _timestamp() -> str:
+    return clock.now().isoformat(timespec="seconds")
+
+
+def _append(db: Session, user_id: int, entry_type: str, points: int, balance: int, reference: Optional[str], idempotency_key: Optional[str]) -> PointsLedger:
+    entry = PointsLedger(
+        user_id=user_id,
+        entry_type=entry_type,
+        points=points,
+        balance_after=balance,
+        reference=reference,
+        idempotency_key=idempotency_key,
+        created_at=_timestamp(),
+    )
+    db.add(entry)
+    db.flush()
+    return entry
+
+
+def _insert_entry(db: Session, user_id: int, entry_type: str, points: int, balance: int, reference: Optional[str], idempotency_key: str) -> Optional[PointsLedger]:
+    """台帳に1行追加する。同じ idempotency_key の記録が既にあれば追加せず None を返す"""
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    statement = (
+        insert(PointsLedger)
+        .values(
+            user_id=user_id,
+            entry_type=entry_type,
+            points=points,
+            balance_after=balance,
+            reference=reference,
+            idempotency_key=idempotency_key,
+            created_at=_timestamp(),
+        )
+        .on_conflict_do_nothing(index_elements=["user_id", "idempotency_key"])
+        .returning(PointsLedger)
+    )
+    return db.execute(statement).scalar_one_or_none()
+
+
+def credit(db: Session, user_id: int, points: int, entry_type: str, reference: Optional[str] = None, idempotency_key: Optional[str] = None) -> Optional[PointsLedger]:
+    """ポイントを加算（負の値で減算）して台帳に記録する
+
+    idempotency_key が同じ記録が既にある場合（同じ週・同じ日の再付与）は何もせず None を返す。
+    ユーザーが存在しない場合も None。
+    キーの重複は事前に SELECT せず、一意制約（INSERT ... ON CONFLICT DO NOTHING）で判定する。
+    重複はまれなため、その場合だけ加算を取り消す（通常は UPDATE と INSERT の2文で済む）。
+    """
+    balance = db.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(total_points=User.total_points + points)
+        .returning(User.total_points)
+    ).scalar()
+    if balance is None:
+        return None
+    entry = _insert_entry(db, user_id, entry_type, points, balance, reference, idempotency_key)
+    if entry is None:
+        db.execute(update(User).where(User.id == user_id).values(total_points=User.total_points - points))
+    return entry
+
+
+def redeem(db: Session, user_id: int, cost: int, item_name: str) -> Optional[PointsLedger]:
+    """残高が cost 以上の場合だけ減算して台帳に記録する（不足またはユーザーなしなら None）"""
+    balance = db.execute(
+        update(User)
+        .where(User.id == user_id, User.total_points >= cost)
+        .values(total_points=User.total_points - cost)
+        .returning(User.total_points)
+    ).scalar()
+    if balance is None:
+        return None
+    return _append(db, user_id, REDEMPTION, -cost, balance, item_name, None)
+
+
+def get_history(db: Session, user_id: int, limit: int = HISTORY_DEFAULT_LIMIT, before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """新しい順の履歴（before_id より前の limit 件。続きは最後の id を before_id に渡す）"""
+    query = select(PointsLedger).where(PointsLedger.user_id == user_id)
+    if before_id is not None:
+        query = query.where(PointsLedger.id < before_id)
+    entries = db.execute(query.order_by(PointsLedger.id.desc()).limit(limit)).scalars()
+    return [
+        {
+            "id": entry.id,
+            "entry_type": entry.entry_type,
+            "points": entry.points,
+            "balance_after": entry.balance_after,
+            "reference": entry.reference,
+            "created_at": entry.created_at,
+        }
+        for entry in entries
+    ]
+
+
+def record_opening_balances(conn) -> int:
+    """台帳の記録がないユーザーの現在のポイントを期首残高として記録する（台帳導入前のデータ用）"""
+    has_entries = select(PointsLedger.id).where(PointsLedger.user_id == User.id).exists()
+    rows = conn.execute(
+        select(User.id, User.total_points).where(User.total_points != 0, ~has_entries)
+    ).all()
+    if rows:
+        created_at = _timestamp()
+        conn.execute(
+            PointsLedger.__table__.insert(),
+            [
+                {
+                    "user_id": user_id,
+                    "entry_type": OPENING_BALANCE,
+                    "points": points,
+                    "balance_after": points,
+                    "reference": None,
+                    "idempotency_key": None,
+                    "created_at": created_at,
+                }
+                for user_id, points in rows
+            ],
+        )
+    return len(rows)
+
+
+def reconcile(db: Session, fix: bool = False) -> List[Dict[str, int]]:
+    """users.total_points と台帳の合計が一致しないユーザーを返す（fix=True ならキャッシュを台帳に合わせる）"""
+    ledger = (
+        select(PointsLedger.user_id, func.sum(PointsLedger.points).label("points"))
+        .group_by(PointsLedger.user_id)
+        .subquery()
+    )
+    ledger_points = func.coalesce(ledger.c.points, 0)
+    rows = db.execute(
+        select(User.id, User.total_points, ledger_points)
+        .outerjoin(ledger, ledger.c.user_id == User.id)
+        .where(User.total_points != ledger_points)
+        .order_by(User.id)
+    ).all()
+    mismatches = [
+        {"user_id": user_id, "cached": cached, "ledger": points} for user_id, cached, points in rows
+    ]
+    if fix:
+        for mismatch in mismatches:
+            db.execute(
+                update(User).where(User.id == mismatch["user_id"]).values(total_points=mismatch["ledger"])
+            )
+        db.commit()
+    return mismatches
+
+
+@click.group()
+def cli():
+    """ポイント台帳の管理ツール"""
+    pass
+
+
+@cli.command("reconcile")
+@click.option("--fix", is_flag=True, help="不一致の users.total_points を台帳の合計に合わせる")
+def reconcile_command(fix):
+    """users.total_points を台帳の合計と照合する（不一致があれば終了コード 1）"""
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        mismatches = reconcile(db, fix=fix)
+    finally:
+        db.close()
+
+    for mismatch in mismatches:
+        click.echo(
+            f"user_id={mismatch['user_id']}: キャッシュ {mismatch['cached']} / 台帳 {mismatch['ledger']}"
+            f"（差 {mismatch['cached'] - mismatch['ledger']:+d}）"
+        )
+    if not mismatches:
+        click.echo("✓ すべてのユーザーのポイントが台帳と一致しています")
+    elif fix:
+        click.echo(f"✓ {len(mismatches)} 人のポイントを台帳の合計に修正しました")
+    else:
+        click.echo(f"✗ {len(mismatches)} 人のポイントが台帳と一致しません（--fix で修正）")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
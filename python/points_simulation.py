@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+ポイント計算の複数週シミュレーション
+
+synthetic_data で生成した数か月分の利用者の行動を時刻順に再生し、
+/input と同じ経路（add_loss_record_with_points: 記録の追加とポイント計算を1トランザクション）で処理する。
+時刻は clock.FrozenClock で記録時刻に合わせるため、datetime.now() に依存せずに再現できる。
+
+- 週ごとのスループットと、1回あたりの実行時間・SQL 数（履歴の増加に伴う変化）
+- 最終的なポイント分布
+- 不変条件（付与ポイントの合計と total_points の一致、同一週の重複付与がないこと）
+を報告する。
+
+使用例:
+    python points_simulation.py run --users 200 --weeks 26 --output simulation.json
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import click
+
+# 少なすぎる週は統計に意味がないため、p95 を出す最小サンプル数
+MIN_SAMPLES_FOR_P95 = 20
+POINT_BUCKETS = [0, 1, 5, 10, 20, 50, 100, 200, 500]
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(len(sorted_values) * pct / 100.0), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class SimulationReport:
+    """呼び出しごとの計測値を週単位・ユーザー単位に集計する"""
+
+    def __init__(self):
+        self.weeks: Dict[str, Dict[str, List[float]]] = defaultdict(
+            lambda: {"ms": [], "queries": [], "history": []}
+        )
+        self.awarded: Dict[int, int] = defaultdict(int)
+        self.weekly_awards: Dict[tuple, int] = defaultdict(int)
+        self.outcomes: Dict[str, int] = defaultdict(int)
+        self.calls = 0
+        self.total_seconds = 0.0
+
+    def record(self, user_id: int, week_start: str, history: int, seconds: float, queries: int, result: Dict[str, Any]) -> None:
+        week = self.weeks[week_start]
+        week["ms"].append(seconds * 1000)
+        week["queries"].append(queries)
+        week["history"].append(history)
+        self.calls += 1
+        self.total_seconds += seconds
+
+        points = result.get("points_added", 0)
+        self.awarded[user_id] += points
+        daily_bonus = result.get("calculation_details", {}).get("daily_bonus", 0)
+        weekly_points = points - daily_bonus
+        if result.get("onboarding_applied"):
+            self.outcomes["onboarding"] += 1
+        elif weekly_points > 0:
+            self.outcomes["reduction"] += 1
+        if daily_bonus:
+            self.outcomes["daily_bonus"] += 1
+        if result.get("message") == "already_awarded":
+            self.outcomes["already_awarded"] += 1
+        if weekly_points > 0:
+            self.weekly_awards[(user_id, week_start)] += 1
+
+    def weekly_summary(self) -> List[Dict[str, Any]]:
+        summary = []
+        for week_start in sorted(self.weeks):
+            week = self.weeks[week_start]
+            durations = sorted(week["ms"])
+            row = {
+                "week_start": week_start,
+                "calls": len(durations),
+                "mean_history_records": round(sum(week["history"]) / len(durations), 1),
+                "mean_ms": round(sum(durations) / len(durations), 3),
+                "mean_queries": round(sum(week["queries"]) / len(durations), 2),
+                "max_queries": max(week["queries"]),
+                "calls_per_second": round(len(durations) / (sum(durations) / 1000), 1),
+            }
+            if len(durations) >= MIN_SAMPLES_FOR_P95:
+                row["p95_ms"] = round(_percentile(durations, 95), 3)
+            summary.append(row)
+        return summary
+
+    def point_distribution(self, totals: Dict[int, int]) -> Dict[str, Any]:
+        values = sorted(totals.values())
+        buckets = {}
+        for lower, upper in zip(POINT_BUCKETS, POINT_BUCKETS[1:] + [None]):
+            label = f"{lower}+" if upper is None else f"{lower}-{upper - 1}"
+            buckets[label] = sum(
+                1 for v in values if v >= lower and (upper is None or v < upper)
+            )
+        return {
+            "users": len(values),
+            "mean": round(sum(values) / len(values), 2) if values else 0.0,
+            "p50": _percentile(values, 50),
+            "p90": _percentile(values, 90),
+            "p99": _percentile(values, 99),
+            "max": values[-1] if values else 0,
+            "buckets": buckets,
+            "outcomes": dict(self.outcomes),
+        }
+
+    def invariant_violations(self, totals: Dict[int, int]) -> List[str]:
+        violations = []
+        for user_id, total in totals.items():
+            if total != self.awarded[user_id]:
+                violations.append(
+                    f"user {user_id}: total_points={total} だが付与合計は {self.awarded[user_id]}"
+                )
+        for (user_id, week_start), count in self.weekly_awards.items():
+            if count > 1:
+                violations.append(f"user {user_id}: 週 {week_start} に {count} 回付与")
+        return violations
+
+
+def run_simulation(users: int, weeks: int, records_per_week: float, seed: int, end_date=None) -> Dict[str, Any]:
+    """DATABASE_URL で指定されたデータベースに対してシミュレーションを実行する"""
+    import clock
+    from auth_service import generate_password_hash
+    from database import SessionLocal, engine, init_db
+    from models import LossReason, User
+    from services import add_loss_record_with_points
+    from sql_instrumentation import collect_queries, install_query_listeners
+    from statistics import get_week_boundaries
+    from synthetic_data import SyntheticDataGenerator, SYNTHETIC_PASSWORD, bulk_insert
+
+    init_db()
+    install_query_listeners(engine)
+    generator = SyntheticDataGenerator(
+        users, weeks, records_per_week=records_per_week, seed=seed,
+        end_date=end_date, prefix=f"sim{seed}",
+    )
+
+    db = SessionLocal()
+    try:
+        reasons = {r.reason_text: r.id for r in db.query(LossReason).all()}
+        reason_texts = {reason_id: text for text, reason_id in reasons.items()}
+        first_user_id = (db.query(User.id).order_by(User.id.desc()).limit(1).scalar() or 0) + 1
+    finally:
+        db.close()
+
+    with engine.begin() as connection:
+        bulk_insert(
+            connection,
+            "users",
+            ("id", "username", "email", "password", "total_points"),
+            generator.user_rows(first_user_id, generate_password_hash(SYNTHETIC_PASSWORD)),
+        )
+
+    # 全ユーザーの行動を時刻順に並べて再生する
+    events = sorted(
+        (row for row, _ in generator.record_rows(first_user_id, 1, reasons)),
+        key=lambda row: row[5],
+    )
+    click.echo(f"{users} 人・{weeks} 週・{len(events)} 件の記録を再生します")
+
+    report = SimulationReport()
+    history: Dict[int, int] = defaultdict(int)
+    frozen = clock.FrozenClock(datetime.fromisoformat(events[0][5]) if events else datetime.now())
+    started = time.perf_counter()
+    db = SessionLocal()
+    try:
+        with clock.use_clock(frozen):
+            for _, user_id, item_name, weight_grams, reason_id, record_date in events:
+                frozen.set(datetime.fromisoformat(record_date))
+                history[user_id] += 1
+                t0 = time.perf_counter()
+                with collect_queries("points_simulation") as stats:
+                    _, result = add_loss_record_with_points(
+                        db,
+                        {
+                            "user_id": user_id,
+                            "item_name": item_name,
+                            "weight_grams": weight_grams,
+                            "reason_text": reason_texts[reason_id],
+                        },
+                    )
+                elapsed = time.perf_counter() - t0
+                if "error" in result:
+                    # アプリでは記録だけを保存して続行するが、シミュレーションでは見逃さない
+                    raise RuntimeError(f"ポイント計算エラー: {result['error']}")
+                week_start = get_week_boundaries(frozen())[0].strftime("%Y-%m-%d")
+                report.record(user_id, week_start, history[user_id], elapsed, stats.count, result)
+
+        totals = dict(
+            db.query(User.id, User.total_points)
+            .filter(User.id >= first_user_id, User.id < first_user_id + users)
+            .all()
+        )
+    finally:
+        db.close()
+
+    wall = time.perf_counter() - started
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "users": users,
+            "weeks": weeks,
+            "records_per_week": records_per_week,
+            "seed": seed,
+            "end_date": generator.end_date.isoformat(),
+            "database_backend": engine.dialect.name,
+        },
+        "calls": report.calls,
+        "wall_seconds": round(wall, 3),
+        "points_calls_per_second": round(report.calls / report.total_seconds, 1) if report.total_seconds else 0.0,
+        "weeks": report.weekly_summary(),
+        "point_distribution": report.point_distribution(totals),
+        "invariant_violations": report.invariant_violations(totals),
+    }
+
+
+@click.group()
+def cli():
+    """ポイント計算シミュレーター"""
+    pass
+
+
+@cli.command("run")
+@click.option("--users", default=100, show_default=True)
+@click.option("--weeks", default=16, show_default=True)
+@click.option("--records-per-week", default=5.0, show_default=True)
+@click.option("--seed", default=42, show_default=True)
+@click.option("--end-date", default=None, help="最終日 (YYYY-MM-DD)。未指定なら今日")
+@click.option("--database-url", default=None, help="未指定の場合は一時的な SQLite ファイルを使用")
+@click.option("--output", default=None, help="結果を保存する JSON ファイル")
+def run_command(users, weeks, records_per_week, seed, end_date, database_url, output):
+    """合成データを再生してポイント計算の正しさと性能を確認する"""
+    import logging
+
+    temp_path: Optional[str] = None
+    if database_url:
+        os.environ["DATABASE_URL"] = database_url
+    else:
+        fd, temp_path = tempfile.mkstemp(prefix="points_simulation_", suffix=".db")
+        os.close(fd)
+        os.environ["DATABASE_URL"] = f"sqlite:///{temp_path}"
+    # 再生中の大量のログは結果に影響しないため抑制する
+    logging.getLogger("sql_instrumentation").setLevel(logging.ERROR)
+
+    try:
+        result = run_simulation(
+            users,
+            weeks,
+            records_per_week,
+            seed,
+            end_date=datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else None,
+        )
+    finally:
+        if temp_path:
+            from database import engine, remove_sqlite_files
+
+            engine.dispose()
+            remove_sqlite_files(temp_path)
+
+    for week in result["weeks"]:
+        click.echo(
+            f"{week['week_start']}: {week['calls']} 回, 履歴 {week['mean_history_records']} 件, "
+            f"平均 {week['mean_ms']}ms, SQL {week['mean_queries']} 回"
+        )
+    distribution = result["point_distribution"]
+    click.echo(
+        f"ポイント分布: 平均 {distribution['mean']}, p50 {distribution['p50']}, "
+        f"p90 {distribution['p90']}, 最大 {distribution['max']}"
+    )
+    click.echo(f"スループット: {result['points_calls_per_second']} 回/秒")
+    for violation in result["invariant_violations"]:
+        click.echo(f"不整合: {violation}")
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        click.echo(f"結果を保存しました: {output}")
+    sys.exit(1 if result["invariant_violations"] else 0)
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -1,16 +1,195 @@
 """
 本番環境用ログ設定
+
+ログの書き込みはリクエストスレッドでは行わず、有界キューに積んでバックグラウンドの
+書き込みスレッドがまとめて書き出す（キューが溢れた場合は破棄して件数を数える）。
 """
+import atexit
 import logging
 import logging.handlers
 import os
+import queue
+import random
+import threading
 from datetime import datetime
 import json
+from metrics import LOG_RECORDS_DROPPED
+
+# キュー・バッチ・サンプリング設定
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "256"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "0.5"))  # 秒
+# INFO以下のアプリログを間引く割合（1.0 = 間引かない, 0.1 = 10%だけ残す）
+LOG_INFO_SAMPLE_RATE = float(os.getenv("LOG_INFO_SAMPLE_RATE", "1.0"))
+
+
+class BatchingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """バッチ単位で flush する RotatingFileHandler（書き込みスレッド専用）"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._in_batch = False
+
+    def flush(self):
+        if not self._in_batch:
+            super().flush()
+
+    def handle_batch(self, records):
+        self._in_batch = True
+        try:
+            for record in records:
+                self.handle(record)
+        finally:
+            self._in_batch = False
+            self.flush()
+
+
+class QueuedHandler(logging.handlers.QueueHandler):
+    """ログレコードを非同期パイプラインに積むだけのハンドラー（ブロックしない）"""
+
+    def __init__(self, pipeline, targets, sample_rate=1.0):
+        super().__init__(pipeline.queue)
+        self.pipeline = pipeline
+        self.targets = tuple(targets)
+        self.sample_rate = sample_rate
+
+    def emit(self, record):
+        if (
+            self.sample_rate < 1.0
+            and record.levelno <= logging.INFO
+            and random.random() >= self.sample_rate
+        ):
+            self.pipeline.count("sampled_out")
+            LOG_RECORDS_DROPPED.inc(reason="sampled")
+            return
+        try:
+            self.pipeline.enqueue(self.targets, self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+
+class AsyncLogPipeline:
+    """有界キュー + バックグラウンド書き込みスレッドによるログパイプライン"""
+
+    def __init__(
+        self,
+        queue_size=LOG_QUEUE_SIZE,
+        batch_size=LOG_BATCH_SIZE,
+        flush_interval=LOG_FLUSH_INTERVAL,
+    ):
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.counters = {"enqueued": 0, "written": 0, "dropped": 0, "sampled_out": 0}
+        self._handlers = []
+        self._reset()
+        # gunicorn(preload_app) で fork された場合、スレッドは子プロセスに引き継がれないため作り直す
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+        atexit.register(self.stop)
+
+    def _reset(self):
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self._thread = None
+        self._stopping = threading.Event()
+        self._counter_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        for handler in self._handlers:
+            handler.queue = self.queue
+
+    def count(self, name, amount=1):
+        with self._counter_lock:
+            self.counters[name] += amount
+
+    def stats(self):
+        with self._counter_lock:
+            return dict(self.counters, queued=self.queue.qsize())
+
+    def make_handler(self, *targets, sample_rate=1.0):
+        handler = QueuedHandler(self, targets, sample_rate=sample_rate)
+        self._handlers.append(handler)
+        return handler
+
+    def enqueue(self, targets, record):
+        if self._thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait((targets, record))
+            self.count("enqueued")
+        except queue.Full:
+            self.count("dropped")
+            LOG_RECORDS_DROPPED.inc(reason="queue_full")
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="log-writer", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """残っているレコードを書き出してからスレッドを止める"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    def _next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+            elif self._stopping.is_set():
+                return
+
+    def _write(self, batch):
+        # 出力先ハンドラーごとにまとめて書き込み、flush はバッチ単位で1回にする
+        grouped = {}
+        for targets, record in batch:
+            for handler in targets:
+                grouped.setdefault(handler, []).append(record)
+        for handler, records in grouped.items():
+            try:
+                if isinstance(handler, BatchingRotatingFileHandler):
+                    handler.handle_batch(records)
+                else:
+                    for record in records:
+                        handler.handle(record)
+            except Exception:
+                logging.getLogger(__name__).exception("ログ書き込みエラー")
+        self.count("written", len(batch))
+
+
+_pipeline = None
+
+
+def get_log_pipeline():
+    """プロセス共通の非同期ログパイプライン"""
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = AsyncLogPipeline()
+    return _pipeline
+
 
 class ProductionLogger:
     """本番環境用ログ設定"""
     
-    def __init__(self, app_name="foodloss_app", log_dir="logs"):
+    def __init__(self, app_name="foodloss_app", log_dir="logs", pipeline=None):
         self.app_name = app_name
         self.log_dir = log_dir
         
@@ -21,6 +200,13 @@ class ProductionLogger:
         self.app_log_file = os.path.join(log_dir, f"{app_name}.log")
         self.error_log_file = os.path.join(log_dir, f"{app_name}_error.log")
         self.access_log_file = os.path.join(log_dir, f"{app_name}_access.log")
+        self.performance_log_file = os.path.join(log_dir, f"{app_name}_performance.log")
+        
+        self.pipeline = pipeline or get_log_pipeline()
+        self.access_logger = self._json_line_logger("access", self.access_log_file)
+        self.performance_logger = self._json_line_logger(
+            "performance", self.performance_log_file
+        )
     
     def setup_loggers(self):
         """ロガーセットアップ"""
@@ -28,9 +214,11 @@ class ProductionLogger:
         # アプリケーションログ（INFO以上）
         app_logger = logging.getLogger(self.app_name)
         app_logger.setLevel(logging.INFO)
+        app_logger.propagate = False
         
         # ローテーティングファイルハンドラー（10MB、5ファイルまで保持）
-        app_handler = logging.handlers.RotatingFileHandler(
+        # 書き込みは書き込みスレッドで行うため、ここではキューに積むハンドラーだけを登録する
+        app_handler = BatchingRotatingFileHandler(
             self.app_log_file,
             maxBytes=10*1024*1024,  # 10MB
             backupCount=5,
@@ -40,8 +228,9 @@ class ProductionLogger:
         # エラーログ（ERROR以上）
         error_logger = logging.getLogger(f"{self.app_name}_error")
         error_logger.setLevel(logging.ERROR)
+        error_logger.propagate = False
         
-        error_handler = logging.handlers.RotatingFileHandler(
+        error_handler = BatchingRotatingFileHandler(
             self.error_log_file,
             maxBytes=10*1024*1024,
             backupCount=5,
@@ -56,11 +245,33 @@ class ProductionLogger:
         app_handler.setFormatter(detailed_formatter)
         error_handler.setFormatter(detailed_formatter)
         
-        app_logger.addHandler(app_handler)
-        error_logger.addHandler(error_handler)
+        # INFO以下の大量ログのみ LOG_INFO_SAMPLE_RATE で間引く（WARNING以上は常に残す）
+        app_logger.addHandler(
+            self.pipeline.make_handler(app_handler, sample_rate=LOG_INFO_SAMPLE_RATE)
+        )
+        # ルートロガーにも付け替えるため、ハンドラー側でも ERROR 以上に絞る
+        error_queue_handler = self.pipeline.make_handler(error_handler)
+        error_queue_handler.setLevel(logging.ERROR)
+        error_logger.addHandler(error_queue_handler)
         
         return app_logger, error_logger
     
+    def _json_line_logger(self, name, log_file):
+        """1レコード1行のJSONログ用ロガー（ファイルは開いたまま、キュー経由で書き込む）"""
+        json_logger = logging.getLogger(f"{self.app_name}.{name}")
+        if not json_logger.handlers:
+            json_logger.setLevel(logging.INFO)
+            json_logger.propagate = False
+            file_handler = BatchingRotatingFileHandler(
+                log_file,
+                maxBytes=10*1024*1024,
+                backupCount=5,
+                encoding='utf-8'
+            )
+            file_handler.setFormatter(logging.Formatter('%(message)s'))
+            json_logger.addHandler(self.pipeline.make_handler(file_handler))
+        return json_logger
+    
     def log_access(self, user_id, action, details=None, ip_address=None):
         """アクセスログを記録"""
         access_data = {
@@ -71,8 +282,7 @@ class ProductionLogger:
             'ip_address': ip_address
         }
         
-        with open(self.access_log_file, 'a', encoding='utf-8') as f:
-            f.write(json.dumps(access_data, ensure_ascii=False) + '\n')
+        self.access_logger.info(json.dumps(access_data, ensure_ascii=False))
     
     def log_performance(self, endpoint, duration, user_id=None):
         """パフォーマンスログを記録"""
@@ -83,9 +293,11 @@ class ProductionLogger:
             'user_id': user_id
         }
         
-        perf_log_file = os.path.join(self.log_dir, f"{self.app_name}_performance.log")
-        with open(perf_log_file, 'a', encoding='utf-8') as f:
-            f.write(json.dumps(perf_data, ensure_ascii=False) + '\n')
+        self.performance_logger.info(json.dumps(perf_data, ensure_ascii=False))
+    
+    def get_pipeline_stats(self):
+        """ログキューの統計（書き込み数・破棄数・間引き数など）"""
+        return self.pipeline.stats()
 
 class HealthChecker:
     """アプリケーションヘルスチェック"""
@@ -154,14 +366,22 @@ class HealthChecker:
         }
 
 # Flask用のログセットアップ関数
-def setup_production_logging(app):
-    """Flaskアプリに本番ログを設定"""
-    logger_manager = ProductionLogger()
+def setup_production_logging(app, log_dir="logs", pipeline=None):
+    """Flaskアプリに本番ログを設定
+
+    app.py・services.py などのモジュールのロガーはルートロガーに伝播するため、
+    ルートロガーのハンドラーをキューに積むハンドラーに置き換える（リクエストスレッドでは書き込まない）。
+    """
+    logger_manager = ProductionLogger(log_dir=log_dir, pipeline=pipeline)
     app_logger, error_logger = logger_manager.setup_loggers()
     
-    # Flaskのデフォルトロガーを置き換え
+    root_logger = logging.getLogger()
+    root_logger.handlers = app_logger.handlers + error_logger.handlers
+    root_logger.setLevel(logging.INFO)
+    
+    # Flaskのデフォルトロガーはルートロガーに伝播させる
     app.logger.handlers = []
-    app.logger.addHandler(app_logger.handlers[0])
+    app.logger.propagate = True
     app.logger.setLevel(logging.INFO)
     
     return logger_manager
\ No newline at end of file
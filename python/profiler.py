@@ -0,0 +1,275 @@
+"""
+本番リクエスト用のサンプリングプロファイラー（オプトイン）
+
+- 署名付きヘッダー (X-Profile-Token) を付けたリクエスト
+- 全リクエストのうち sample_rate の割合
+- slow_ms を超えたリクエスト（超えた時点からサンプリングを開始）
+のいずれかに当てはまるリクエストのスタックを一定間隔で採取し、
+エンドポイントごとに flamegraph.pl 互換の collapsed-stack ファイルへ追記する。
+
+設定は PROFILE_DIR/control.json に保存され、管理者画面から変更すると全ワーカーに反映される。
+無効時は before_request で設定を確認するだけなので、ほぼオーバーヘッドはない。
+"""
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_HEADER = "X-Profile-Token"
+PROFILE_TOKEN_MAX_AGE = 3600  # 秒
+CONTROL_FILENAME = "control.json"
+# control.json を確認する間隔（秒）
+CONTROL_CHECK_INTERVAL = 1.0
+
+
+class ProfilerConfig:
+    """プロファイラー設定（control.json と同期する）"""
+
+    def __init__(self, profile_dir: str = PROFILE_DIR):
+        self.profile_dir = profile_dir
+        self.control_path = os.path.join(profile_dir, CONTROL_FILENAME)
+        self.enabled = os.getenv("PROFILING_ENABLED", "0") == "1"
+        self.sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+        self.slow_ms = float(os.getenv("PROFILE_SLOW_MS", "0"))
+        self._control_mtime = None
+        self._last_check = 0.0
+
+    def refresh(self) -> None:
+        """他のワーカーで変更された設定を取り込む（最大 CONTROL_CHECK_INTERVAL 秒に1回）"""
+        now = time.monotonic()
+        if now - self._last_check < CONTROL_CHECK_INTERVAL:
+            return
+        self._last_check = now
+        try:
+            mtime = os.stat(self.control_path).st_mtime
+        except OSError:
+            return
+        if mtime == self._control_mtime:
+            return
+        self._control_mtime = mtime
+        try:
+            with open(self.control_path, "r", encoding="utf-8") as f:
+                self._apply(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.warning(f"プロファイラー設定の読み込みに失敗しました: {e}")
+
+    def _apply(self, data: Dict[str, Any]) -> None:
+        """設定を検証してから反映する（不正な値があれば何も変更せずに例外を送出する）"""
+        if not isinstance(data, dict):
+            raise TypeError("設定は JSON オブジェクトで指定してください")
+        enabled = data.get("enabled", self.enabled)
+        # "false" や 0 を有効と解釈しないよう、JSON の真偽値だけを受け付ける
+        if not isinstance(enabled, bool):
+            raise ValueError("enabled は true または false で指定してください")
+        sample_rate = min(max(float(data.get("sample_rate", self.sample_rate)), 0.0), 1.0)
+        slow_ms = max(float(data.get("slow_ms", self.slow_ms)), 0.0)
+        self.enabled, self.sample_rate, self.slow_ms = enabled, sample_rate, slow_ms
+
+    def update(self, data: Dict[str, Any]) -> None:
+        """設定を変更して control.json に保存する（全ワーカーに反映される）"""
+        self._apply(data)
+        os.makedirs(self.profile_dir, exist_ok=True)
+        tmp_path = f"{self.control_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, self.control_path)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "slow_ms": self.slow_ms,
+        }
+
+
+class ActiveProfile:
+    """プロファイル中の1リクエスト"""
+
+    def __init__(self, thread_id: int, endpoint: str, start_after: float, forced: bool):
+        self.thread_id = thread_id
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.start_after = start_after  # この時刻以降にサンプリングを開始する
+        self.forced = forced
+        self.stacks: Counter = Counter()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = os.path.basename(code.co_filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ":")
+
+
+def collapse_stack(frame) -> str:
+    """フレームを root;...;leaf 形式の1行に変換する"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class StackSampler:
+    """登録されたスレッドのスタックを一定間隔で採取するバックグラウンドスレッド"""
+
+    def __init__(self, profile_dir: str = PROFILE_DIR, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.profile_dir = profile_dir
+        self.interval = interval_ms / 1000.0
+        self._active: Dict[int, ActiveProfile] = {}
+        self._finished = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_thread(self) -> None:
+        # fork 後の子プロセスではスレッドを作り直す
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def begin(self, endpoint: str, delay: float = 0.0, forced: bool = False) -> ActiveProfile:
+        self._ensure_thread()
+        profile = ActiveProfile(
+            threading.get_ident(), endpoint, time.perf_counter() + delay, forced
+        )
+        with self._lock:
+            self._active[profile.thread_id] = profile
+        self._wakeup.set()
+        return profile
+
+    def end(self, profile: ActiveProfile, keep: bool) -> None:
+        with self._lock:
+            self._active.pop(profile.thread_id, None)
+            if keep and profile.stacks:
+                self._finished.append(profile)
+        if keep:
+            self._wakeup.set()
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                active = list(self._active.values())
+                finished, self._finished = self._finished, []
+            for profile in finished:
+                self._write(profile)
+
+            if not active:
+                # プロファイル対象がない間は起こされるまで待機
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            now = time.perf_counter()
+            next_start = min(p.start_after for p in active)
+            if next_start > now:
+                # slow_ms 未満のリクエストしかない場合は、最初に閾値を超える時刻まで眠る
+                self._wakeup.wait(next_start - now)
+                self._wakeup.clear()
+                continue
+
+            frames = sys._current_frames()
+            for profile in active:
+                if profile.start_after <= now:
+                    frame = frames.get(profile.thread_id)
+                    if frame is not None:
+                        profile.stacks[collapse_stack(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+    def _write(self, profile: ActiveProfile) -> None:
+        os.makedirs(self.profile_dir, exist_ok=True)
+        safe_endpoint = "".join(
+            c if c.isalnum() or c in "-_." else "_" for c in profile.endpoint
+        )
+        path = os.path.join(self.profile_dir, f"{safe_endpoint}.collapsed")
+        try:
+            with open(path, "a", encoding="utf-8") as f:
+                for stack, count in profile.stacks.items():
+                    f.write(f"{stack} {count}\n")
+        except OSError as e:
+            logger.warning(f"プロファイルの書き出しに失敗しました: {e}")
+
+
+_config: Optional[ProfilerConfig] = None
+_sampler: Optional[StackSampler] = None
+
+
+def get_profiler_config() -> ProfilerConfig:
+    global _config
+    if _config is None:
+        _config = ProfilerConfig()
+    return _config
+
+
+def get_sampler() -> StackSampler:
+    global _sampler
+    if _sampler is None:
+        _sampler = StackSampler()
+    return _sampler
+
+
+def _serializer(secret_key):
+    from itsdangerous import URLSafeTimedSerializer
+
+    return URLSafeTimedSerializer(secret_key, salt="request-profile")
+
+
+def make_profile_token(secret_key, issued_by: str = "admin") -> str:
+    """X-Profile-Token ヘッダー用の署名付きトークンを発行する"""
+    return _serializer(secret_key).dumps({"by": issued_by})
+
+
+def verify_profile_token(secret_key, token: str) -> bool:
+    from itsdangerous import BadSignature
+
+    try:
+        _serializer(secret_key).loads(token, max_age=PROFILE_TOKEN_MAX_AGE)
+        return True
+    except BadSignature:
+        return False
+
+
+def setup_profiling(app):
+    """Flaskアプリにリクエストプロファイリングを設定"""
+    from flask import g, request
+
+    config = get_profiler_config()
+
+    @app.before_request
+    def start_profiling():
+        token = request.headers.get(PROFILE_HEADER)
+        forced = bool(token) and verify_profile_token(app.secret_key, token)
+        if not forced:
+            config.refresh()
+            if not config.enabled:
+                return
+            forced = config.sample_rate > 0 and random.random() < config.sample_rate
+            if not forced and config.slow_ms <= 0:
+                return
+        delay = 0.0 if forced else config.slow_ms / 1000.0
+        g.active_profile = get_sampler().begin(
+            request.endpoint or "unmatched", delay=delay, forced=forced
+        )
+
+    @app.teardown_request
+    def finish_profiling(exc):
+        profile = g.pop("active_profile", None)
+        if profile is None:
+            return
+        elapsed_ms = (time.perf_counter() - profile.started) * 1000
+        keep = profile.forced or elapsed_ms >= config.slow_ms
+        get_sampler().end(profile, keep=keep)
+
+    return app
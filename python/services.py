@@ -1,16 +1,22 @@
 from sqlalchemy import func
 from sqlalchemy.orm import Session
-from models import User, FoodLossRecord, LossReason,arrange_suggest
+from models import User, FoodLossRecord, LossReason, PointsLedger,arrange_suggest
 # schemas削除：Renderビルド問題対応
 from datetime import datetime, timedelta, date, time
 from typing import Dict, Any, List, Optional, Tuple
 import hashlib
+import traceback
+
+import clock
+import points_ledger
+import user_counters
 
 # main-test を優先した実装（競合で main-test のコードを採用）
 from statistics import (
     calculate_weekly_statistics,
-    get_total_grams_for_weeks,
     get_last_two_weeks,
+    get_rolling_weekly_totals,
+    get_week_boundaries,
 )
 
 # user 関連は既存の `user_service.py` を使う
@@ -33,7 +39,21 @@ def get_user_profile(db: Session, user_id: int) -> Optional[Dict[str, Any]]:
     return get_user_profile_internal(db, user_id)
 
 
-def add_new_loss_record_direct(db: Session, record_data: Dict[str, Any]) -> int:
+def redeem_points(db: Session, user_id: int, cost: int, item_name: str) -> Optional[int]:
+    """残高が足りれば cost を減算して確定し、残りのポイントを返す（不足なら None）"""
+    entry = points_ledger.redeem(db, user_id, cost, item_name)
+    if entry is None:
+        db.rollback()
+        return None
+    db.commit()
+    return entry.balance_after
+
+
+def get_points_history(db: Session, user_id: int, limit: int = points_ledger.HISTORY_DEFAULT_LIMIT, before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    return points_ledger.get_history(db, user_id, limit=limit, before_id=before_id)
+
+
+def _insert_loss_record(db: Session, record_data: Dict[str, Any]) -> int:
     reason = (
         db.query(LossReason).filter_by(reason_text=record_data["reason_text"]).first()
     )
@@ -45,40 +65,173 @@ def add_new_loss_record_direct(db: Session, record_data: Dict[str, Any]) -> int:
         item_name=record_data["item_name"],
         weight_grams=record_data["weight_grams"],
         loss_reason_id=reason.id,
+        record_date=clock.now().isoformat(),
     )
 
     db.add(new_record)
-    db.commit()
-    db.refresh(new_record)
+    db.flush()
+    user_counters.record_added(db, new_record)
     return new_record.id
 
 
+def add_new_loss_record_direct(db: Session, record_data: Dict[str, Any]) -> int:
+    # 集計値の参加日数の判定を同じユーザーの同時の入力と競合させない
+    points_ledger.lock_user(db, record_data["user_id"])
+    record_id = _insert_loss_record(db, record_data)
+    db.commit()
+    return record_id
+
+
+def add_loss_record_with_points(db: Session, record_data: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    """記録の追加とポイントの評価・付与を、ユーザー単位のロックの下で1つのトランザクションで行う
+
+    同じユーザーの同時の入力は順番に評価されるため、同じ週・同じ日のポイントが二重に付与されない。
+    ポイントの評価で例外が発生した場合は SAVEPOINT まで戻し、記録だけを保存する
+    （その場合の結果は points_added=0 と error）。
+    """
+    user_id = record_data["user_id"]
+    points_ledger.lock_user(db, user_id)
+    record_id = _insert_loss_record(db, record_data)
+    try:
+        with db.begin_nested():
+            result = _evaluate_weekly_points(db, user_id)
+    except Exception as e:
+        result = {"points_added": 0, "error": f"{type(e).__name__}: {e}", "traceback": traceback.format_exc()}
+    db.commit()
+    return record_id, result
+
+
+EDITABLE_RECORD_FIELDS = ("item_name", "weight_grams", "reason_text")
+
+
+def _validate_record_changes(db: Session, changes: Dict[str, Any]) -> Dict[str, Any]:
+    """PATCH の入力を検証し、変更する列の値を返す（無効なら ValueError）"""
+    unknown = set(changes) - set(EDITABLE_RECORD_FIELDS)
+    if unknown:
+        raise ValueError(f"変更できない項目: {', '.join(sorted(unknown))}")
+    if not changes:
+        raise ValueError(f"変更する項目（{', '.join(EDITABLE_RECORD_FIELDS)}）を指定してください。")
+
+    values: Dict[str, Any] = {}
+    if "item_name" in changes:
+        item_name = changes["item_name"]
+        if not isinstance(item_name, str) or not item_name.strip():
+            raise ValueError("品目名を空白にすることはできません。")
+        values["item_name"] = item_name
+    if "weight_grams" in changes:
+        weight = changes["weight_grams"]
+        if isinstance(weight, bool) or not isinstance(weight, (int, float)):
+            raise ValueError("重量は数値で指定してください。")
+        if weight < 0:
+            raise ValueError("重量は負の値であってはなりません。")
+        values["weight_grams"] = float(weight)
+    if "reason_text" in changes:
+        reason_text = str(changes["reason_text"]).strip()
+        reason = db.query(LossReason).filter_by(reason_text=reason_text).first()
+        if not reason:
+            raise ValueError(f"無効な廃棄理由: {reason_text}")
+        values["loss_reason_id"] = reason.id
+    return values
+
+
+def _find_user_record(db: Session, user_id: int, record_id: int) -> Optional[FoodLossRecord]:
+    # 他のユーザーの記録は存在しないものとして扱う
+    return db.query(FoodLossRecord).filter_by(id=record_id, user_id=user_id).first()
+
+
+def _record_row(record: FoodLossRecord) -> Dict[str, Any]:
+    """/api/weekly_stats の dish_table と同じ形の1行"""
+    return {
+        "id": record.id,
+        "dish_name": record.item_name,
+        "weight_grams": round(record.weight_grams, 1),
+        "reason": record.reason.reason_text if record.reason else "不明",
+        "date": record.record_date[:10],
+    }
+
+
+def update_loss_record(db: Session, user_id: int, record_id: int, changes: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """記録の品目名・重量・廃棄理由を変更する（記録が見つからなければ None、入力が無効なら ValueError）
+
+    ユーザーの集計値には重量の差分だけを加える。ポイントを付与済みの週の重量を変更した場合は
+    その週の週次ポイントを計算し直し、差分を台帳に記録する（points_adjusted）。
+    """
+    user = points_ledger.lock_user(db, user_id)
+    record = _find_user_record(db, user_id, record_id)
+    if user is None or record is None:
+        db.rollback()
+        return None
+    values = _validate_record_changes(db, changes)
+
+    grams_delta = values.get("weight_grams", record.weight_grams) - record.weight_grams
+    for column, value in values.items():
+        setattr(record, column, value)
+    db.flush()
+
+    points_adjusted = 0
+    if grams_delta:
+        user_counters.record_updated(db, user_id, grams_delta)
+        points_adjusted = _resettle_week_if_awarded(db, user, record.record_date)
+    row = _record_row(record)
+    db.commit()
+    return {"record": row, "points_adjusted": points_adjusted}
+
+
+def delete_loss_record(db: Session, user_id: int, record_id: int) -> Optional[Dict[str, Any]]:
+    """記録を削除する（記録が見つからなければ None）
+
+    ユーザーの集計値からその記録の分だけを除き、ポイントを付与済みの週の記録であれば
+    その週の週次ポイントを計算し直す。
+    """
+    user = points_ledger.lock_user(db, user_id)
+    record = _find_user_record(db, user_id, record_id)
+    if user is None or record is None:
+        db.rollback()
+        return None
+
+    db.delete(record)
+    db.flush()
+    user_counters.record_removed(db, record)
+    points_adjusted = _resettle_week_if_awarded(db, user, record.record_date)
+    db.commit()
+    return {"record_id": record_id, "points_adjusted": points_adjusted}
+
+
 # ポイント付与の設定（寛容モード）
 ONBOARDING_POINTS = 10
 MIN_RECORD_WEIGHT = 50  # g
 BASELINE_MIN = 300  # g
 MIN_REDUCTION_PERCENT = 5  # %
 MAX_WEEKLY_POINTS = 200
+DAILY_BONUS_POINTS = 1  # 毎日最初の入力で付与
 
 
 def calculate_weekly_points_logic(db: Session, user_id: int) -> Dict[str, Any]:
+    """週次ポイントを評価・付与する（ユーザー単位のロックを取り、1回のコミットで確定する）"""
+    points_ledger.lock_user(db, user_id)
+    result = _evaluate_weekly_points(db, user_id)
+    db.commit()
+    return result
+
+
+def _calculate_weekly_award(db: Session, user_id: int, now: Optional[datetime] = None) -> Dict[str, Any]:
+    """now（省略時は現在）を含む週の週次ポイントを計算する（付与はしない）"""
     # main-test 由来のロジックを採用
-    last_week_grams, this_week_grams = get_last_two_weeks(db, user_id)
+    # 集計の基準日（現在の場合は渡さない）
+    as_of = {} if now is None else {"today": now}
+    now = now or clock.now()
+    last_week_grams, this_week_grams = get_last_two_weeks(db, user_id, **as_of)
     
     # 改良版ベースライン計算：実際に記録がある週数に基づく
     # 過去の記録から実際にデータがある週数を計算
-    from statistics import get_week_boundaries
-    from datetime import datetime, timedelta
-    
-    current_week_start, _ = get_week_boundaries(datetime.now())
+    current_week_start, _ = get_week_boundaries(now)
     
-    # 過去8週間のデータを週別に集計して、実際に記録がある週を特定
-    weekly_totals = []
-    for weeks_back in range(2, 9):  # 先週から過去7週間（今週は除外）
-        week_date = current_week_start - timedelta(weeks=weeks_back-1)
-        week_total = get_total_grams_for_weeks(db, user_id, weeks_ago=weeks_back) - get_total_grams_for_weeks(db, user_id, weeks_ago=weeks_back-1)
-        if week_total > 0:  # 記録がある週のみ
-            weekly_totals.append(week_total)
+    # 過去8週間のデータを週別に1回のクエリで集計して、実際に記録がある週を特定
+    # 先週から過去7週間（直近7日間は除外）
+    weekly_totals = [
+        week_total for week_total in get_rolling_weekly_totals(db, user_id, 8, **as_of)[1:]
+        if week_total > 0  # 記録がある週のみ
+    ]
     
     # ベースライン計算：記録がある週数に基づく
     if len(weekly_totals) >= 3:
@@ -141,11 +294,31 @@ def calculate_weekly_points_logic(db: Session, user_id: int) -> Dict[str, Any]:
             else:
                 points_to_add = 0
 
-    # --- idempotency: 同じ週に対する二重付与を防ぐ ---
-    from statistics import get_week_boundaries
-    from datetime import datetime
+    return {
+        "points_to_add": points_to_add,
+        "final_reduction_rate": final_reduction_rate,
+        "rate_last_week": rate_last_week,
+        "rate_baseline": rate_baseline,
+        "last_week_grams": last_week_grams,
+        "this_week_grams": this_week_grams,
+        "baseline": baseline,
+        "baseline_weeks_count": len(weekly_totals),
+        "comparison_method": comparison_method,
+        "onboarding_applied": onboarding_applied,
+    }
+
+
+def _evaluate_weekly_points(db: Session, user_id: int) -> Dict[str, Any]:
+    # 呼び出し側で lock_user を取得済みであること（ここでは commit しない）
+    award = _calculate_weekly_award(db, user_id)
+    points_to_add = award["points_to_add"]
+    final_reduction_rate = award["final_reduction_rate"]
+    rate_last_week = award["rate_last_week"]
+    rate_baseline = award["rate_baseline"]
+    onboarding_applied = award["onboarding_applied"]
 
-    today = datetime.now()
+    # --- idempotency: 同じ週に対する二重付与を防ぐ ---
+    today = clock.now()
     week_start_dt, _ = get_week_boundaries(today)
     week_start_str = week_start_dt.strftime("%Y-%m-%d")
 
@@ -159,21 +332,8 @@ def calculate_weekly_points_logic(db: Session, user_id: int) -> Dict[str, Any]:
             "message": "user_not_found",
         }
 
-    # --- データ一貫性の自動修復 ---
-    # ポイントが0なのに last_points_awarded_week_start が設定されている場合は不整合
-    # ただし、実際に記録があり計算すべきポイントが存在する場合は修復対象
-    if user.total_points == 0 and user.last_points_awarded_week_start is not None:
-        # 実際に今週の記録があるか確認して、ポイント付与条件を満たしているかチェック
-        if this_week_grams >= MIN_RECORD_WEIGHT and (last_week_grams == 0 and baseline == 0):
-            # 条件を満たしているのにポイントが0 = 不整合なので修復
-            user.last_points_awarded_week_start = None
-            db.commit()
-            print(f"[AUTO-REPAIR] User {user_id} ({user.username}): Cleared inconsistent last_points_awarded_week_start (has records but no points)")
-        elif this_week_grams == 0:
-            # 記録がないのに last_points_awarded_week_start が設定されている = 不整合
-            user.last_points_awarded_week_start = None  
-            db.commit()
-            print(f"[AUTO-REPAIR] User {user_id} ({user.username}): Cleared inconsistent last_points_awarded_week_start (no records)")
+    # 週・日のフラグと記録の不整合の検出・修復はリクエストの処理では行わない
+    # （consistency_checker.py のバッチで一括して行う）
 
     # すでにその週に付与済みかをチェック
     if user.last_points_awarded_week_start == week_start_str:
@@ -186,33 +346,39 @@ def calculate_weekly_points_logic(db: Session, user_id: int) -> Dict[str, Any]:
             "week_start": week_start_str,
         }
 
-    # 付与処理をトランザクション内で実施
-    if points_to_add > 0:
-        user.total_points += points_to_add
+    # 付与処理をトランザクション内で実施（残高の更新と台帳への記録）
+    # 台帳に同じ週の付与が既にあれば二重に付与しない
+    if points_to_add > 0 and not points_ledger.credit(
+        db, user_id, points_to_add, points_ledger.WEEKLY_AWARD,
+        reference=week_start_str, idempotency_key=f"week:{week_start_str}",
+    ):
+        points_to_add = 0
 
     # 処理を行ったことを示すため、付与が0でも週のフラグを更新する
     user.last_points_awarded_week_start = week_start_str
-    db.commit()
     
     # 詳細情報をログ出力（app.pyで出力できるように詳細を返す）
     calculation_details = {
         "user_id": user_id,
-        "last_week_grams": last_week_grams,
-        "this_week_grams": this_week_grams,
-        "baseline_grams": baseline,
-        "baseline_weeks_count": len(weekly_totals) if 'weekly_totals' in locals() else 0,
-        "comparison_method": comparison_method if 'comparison_method' in locals() else "unknown"
+        "last_week_grams": award["last_week_grams"],
+        "this_week_grams": award["this_week_grams"],
+        "baseline_grams": award["baseline"],
+        "baseline_weeks_count": award["baseline_weeks_count"],
+        "comparison_method": award["comparison_method"],
     }
 
     # --- 毎日最初の入力は必ず1ポイント付与 ---
-    today_str = datetime.now().strftime('%Y-%m-%d')
+    today_str = clock.now().strftime('%Y-%m-%d')
     if user.last_points_awarded_date != today_str:
-        user.total_points += 1
+        bonus = points_ledger.credit(
+            db, user_id, DAILY_BONUS_POINTS, points_ledger.DAILY_BONUS,
+            reference=today_str, idempotency_key=f"day:{today_str}",
+        )
         user.last_points_awarded_date = today_str
-        db.commit()
-        # 既存ロジックのポイントと合算して返す
-        calculation_details['daily_bonus'] = 1
-        points_to_add += 1
+        if bonus:
+            # 既存ロジックのポイントと合算して返す
+            calculation_details['daily_bonus'] = DAILY_BONUS_POINTS
+            points_to_add += DAILY_BONUS_POINTS
 
     return {
         "points_added": points_to_add,
@@ -225,6 +391,65 @@ def calculate_weekly_points_logic(db: Session, user_id: int) -> Dict[str, Any]:
     }
 
 
+def _weekly_award_total(db: Session, user_id: int, week_start: str) -> int:
+    """その週の週次ポイント（付与と、記録の変更による差分）の合計"""
+    return db.query(func.coalesce(func.sum(PointsLedger.points), 0)).filter(
+        PointsLedger.user_id == user_id,
+        PointsLedger.entry_type.in_((points_ledger.WEEKLY_AWARD, points_ledger.WEEKLY_ADJUSTMENT)),
+        PointsLedger.reference == week_start,
+    ).scalar()
+
+
+def _award_evaluated_at(db: Session, user_id: int, week_start: str) -> Optional[datetime]:
+    """その週の週次ポイントを付与した時刻（台帳の weekly_award。付与がなければ None）
+
+    台帳の時刻は秒単位のため、その秒の終わりを返す（付与のきっかけになった記録を含めるため）。
+    """
+    created_at = db.query(PointsLedger.created_at).filter(
+        PointsLedger.user_id == user_id,
+        PointsLedger.entry_type == points_ledger.WEEKLY_AWARD,
+        PointsLedger.reference == week_start,
+    ).scalar()
+    if created_at is None:
+        return None
+    return datetime.fromisoformat(created_at).replace(microsecond=999999)
+
+
+def _resettle_week_if_awarded(db: Session, user: User, record_date: str) -> int:
+    """記録を変更・削除した週がポイントを付与済みなら、その週の週次ポイントを計算し直す
+
+    呼び出し側で lock_user を取得済みであること（ここでは commit しない）。
+    付与したときと同じ時点（台帳の weekly_award の時刻）の記録で計算し直し、付与済みの合計との差を
+    weekly_adjustment として台帳に記録して、差を返す。付与の後に追加した記録は含めないため、
+    差は変更・削除した記録による分だけになる。その時点の記録がなくなった週は 0 ポイントにする。
+    0 ポイントで評価した週は評価した時刻が台帳に残らないため、計算し直さない。
+    交換済みのポイントは取り消せないため、減らす場合は残高までに抑える（差し引けなかった分は、
+    次にその週を計算し直すときの差に含まれる）。
+    後の週の評価（先週比・ベースライン）は、その時点の記録で確定したものとして計算し直さない。
+    """
+    week_start, _ = get_week_boundaries(datetime.strptime(record_date[:10], "%Y-%m-%d"))
+    week_start_str = week_start.strftime("%Y-%m-%d")
+    if user.last_points_awarded_week_start is None or week_start_str > user.last_points_awarded_week_start:
+        return 0
+    evaluated_at = _award_evaluated_at(db, user.id, week_start_str)
+    if evaluated_at is None:
+        return 0
+
+    has_records = db.query(FoodLossRecord.id).filter(
+        FoodLossRecord.user_id == user.id,
+        FoodLossRecord.record_date >= week_start_str,
+        FoodLossRecord.record_date <= evaluated_at.isoformat(),
+    ).first()
+    expected = _calculate_weekly_award(db, user.id, evaluated_at)["points_to_add"] if has_records else 0
+    difference = expected - _weekly_award_total(db, user.id, week_start_str)
+    if difference < 0:
+        balance = db.query(User.total_points).filter(User.id == user.id).scalar()
+        difference = max(difference, -max(balance, 0))
+    if difference:
+        points_ledger.credit(db, user.id, difference, points_ledger.WEEKLY_ADJUSTMENT, reference=week_start_str)
+    return difference
+
+
 def get_weekly_stats(db: Session, user_id: int, target_date: date) -> Dict[str, Any]:
     # target_date を calculate_weekly_statistics に渡す（APIの ?date= を反映する）
     return calculate_weekly_statistics(db, user_id, target_date)
@@ -239,7 +464,7 @@ def add_test_loss_records(db: Session, user_id: int) -> bool:
     if not reason_expired or not reason_eaten:
         return False
 
-    today = datetime.now()
+    today = clock.now()
     a_week_ago = today - timedelta(days=7)
 
     records = [
@@ -266,7 +491,7 @@ def add_test_loss_records(db: Session, user_id: int) -> bool:
         )
     ]
 
-    db.add_all(records)
+    user_counters.add_records(db, records)
     db.commit()
     return True
 
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+ユーザー ID によるシャーディング
+
+DATABASE_SHARD_URLS を設定すると、ユーザーとそのデータ（記録・余りもの・ポイント台帳・保管した記録と集計）を
+ユーザー ID のコンシステントハッシュで複数のデータベースに分散する。
+各シャードには同じスキーマ（db_migration の upgrade）と同じ廃棄理由がある。
+
+    DATABASE_SHARD_URLS="shard0=postgresql://.../school_a,shard1=postgresql://.../school_b"
+
+名前を省略した場合は並び順に shard0, shard1, ... になる。ハッシュリングは名前から作るため、
+シャードを末尾に追加した場合に移動が必要なのは、新しいシャードに割り当てられるユーザーだけ
+（約 1/N）。追加後は rebalance で移動する。
+
+- get_db(user_id) / read_session(user_id=...) はそのユーザーのシャードのセッションを返す
+- ユーザー ID は最初のシャードの user_id_allocator で採番する（シャードをまたいで一意）
+- ユーザー名・メールアドレスは採番と同じトランザクションで最初のシャードの user_identity_reservations に
+  登録する（一意制約により、同時に登録しても重複しない）
+- ログイン（ユーザー名での検索）と final_report は全シャードに並列に問い合わせて結果を合わせる
+
+使用例:
+    python sharding.py init                 # 全シャードにマイグレーションを適用し、採番を合わせる
+    python sharding.py status               # シャードごとのユーザー数と移動が必要な人数
+    python sharding.py rebalance --dry-run
+    python sharding.py rebalance            # メンテナンス中に実行（移動中のユーザーは書き込まないこと）
+"""
+import bisect
+import hashlib
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import click
+from sqlalchemy import Column, Integer, MetaData, String, Table, delete, func, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
+
+from models import DailyLossSummary, FoodLossRecord, FoodLossRecordArchive, PointsLedger, User, arrange_suggest
+
+logger = logging.getLogger(__name__)
+
+# 1つのシャードあたりのハッシュリング上の点の数（多いほど分散が均等になる）
+VIRTUAL_NODES = 64
+REBALANCE_BATCH_SIZE = 200
+
+# ユーザーに属するテーブル（移動時は users の後に子テーブルを投入し、逆順に削除する）
+USER_CHILD_TABLES = (
+    FoodLossRecord.__table__,
+    arrange_suggest.__table__,
+    PointsLedger.__table__,
+    FoodLossRecordArchive.__table__,
+    DailyLossSummary.__table__,
+)
+
+# シャードをまたいで一意なユーザー ID の採番（最初のシャードに置く）
+allocator_metadata = MetaData()
+user_id_allocator = Table(
+    "user_id_allocator",
+    allocator_metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+)
+# 登録済みのユーザー名・メールアドレス（最初のシャードに置く。users の一意制約はシャード内でしか効かないため）
+user_identity_reservations = Table(
+    "user_identity_reservations",
+    allocator_metadata,
+    Column("user_id", Integer, primary_key=True),
+    Column("username", String(255), nullable=False, unique=True),
+    Column("email", String(255), nullable=False, unique=True),
+)
+
+
+def parse_shard_urls(value: str) -> List[Tuple[str, str]]:
+    """"name=url,name=url" または "url,url" を [(name, url)] にする"""
+    shards = []
+    for i, item in enumerate(part.strip() for part in value.split(",") if part.strip()):
+        name, sep, url = item.partition("=")
+        if not sep or "://" in name:
+            name, url = f"shard{i}", item
+        shards.append((name.strip(), url.strip()))
+    return shards
+
+
+def _hash(key: str) -> int:
+    return int(hashlib.md5(key.encode()).hexdigest()[:16], 16)
+
+
+class ShardRouter:
+    """ユーザー ID からシャードを選び、シャードごとのセッションを作る"""
+
+    def __init__(self, engines: Dict[str, Any], virtual_nodes: int = VIRTUAL_NODES):
+        if not engines:
+            raise ValueError("シャードが1つもありません")
+        self.engines = dict(engines)
+        self.names = list(self.engines)
+        self._sessions = {
+            name: sessionmaker(autocommit=False, autoflush=False, bind=engine) for name, engine in self.engines.items()
+        }
+        ring = sorted((_hash(f"{name}#{i}"), name) for name in self.names for i in range(virtual_nodes))
+        self._ring_keys = [key for key, _ in ring]
+        self._ring_names = [name for _, name in ring]
+
+    @classmethod
+    def from_urls(cls, shards: List[Tuple[str, str]], create_engine: Callable, **kwargs) -> "ShardRouter":
+        return cls({name: create_engine(url) for name, url in shards}, **kwargs)
+
+    @property
+    def home(self) -> str:
+        """採番テーブルを置くシャード"""
+        return self.names[0]
+
+    def shard_for(self, user_id: int) -> str:
+        index = bisect.bisect(self._ring_keys, _hash(str(user_id))) % len(self._ring_keys)
+        return self._ring_names[index]
+
+    def session(self, name: str) -> Session:
+        return self._sessions[name]()
+
+    def session_for(self, user_id: int) -> Session:
+        return self.session(self.shard_for(user_id))
+
+    def fan_out(self, func: Callable[[Session], Any], max_workers: Optional[int] = None) -> Dict[str, Any]:
+        """全シャードで func(session) を並列に実行し、{シャード名: 結果} を返す"""
+
+        def run(name):
+            db = self.session(name)
+            try:
+                return func(db)
+            finally:
+                db.close()
+
+        with ThreadPoolExecutor(max_workers=max_workers or len(self.names)) as executor:
+            results = executor.map(run, self.names)
+            return dict(zip(self.names, results))
+
+    def dispose(self) -> None:
+        for engine in self.engines.values():
+            engine.dispose()
+
+
+def active_router() -> Optional[ShardRouter]:
+    """DATABASE_SHARD_URLS が設定されている場合のルーター（未設定なら None）"""
+    import database
+
+    return database.shard_router
+
+
+# --- ユーザーの登録・検索 ---
+
+def allocate_user_id(router: ShardRouter, username: str, email: str) -> int:
+    """ユーザー ID を採番し、同じトランザクションでユーザー名・メールアドレスを予約する"""
+    try:
+        with router.engines[router.home].begin() as conn:
+            user_id = conn.execute(insert(user_id_allocator).returning(user_id_allocator.c.id)).scalar()
+            conn.execute(insert(user_identity_reservations).values(user_id=user_id, username=username, email=email))
+            return user_id
+    except IntegrityError:
+        raise ValueError("ユーザー名またはメールアドレスは既に登録されています。")
+
+
+def release_user_id(router: ShardRouter, user_id: int) -> None:
+    """シャードへの登録に失敗したユーザーの予約を取り消す"""
+    with router.engines[router.home].begin() as conn:
+        conn.execute(delete(user_identity_reservations).where(user_identity_reservations.c.user_id == user_id))
+
+
+def sync_user_id_allocator(router: ShardRouter) -> int:
+    """採番を全シャードの最大のユーザー ID より後にし、既存ユーザーの名前・メールアドレスを予約する
+    （シャーディング導入時・シャード追加時）"""
+    from database import reset_id_sequences
+
+    users = [
+        row for rows in router.fan_out(lambda db: db.query(User.id, User.username, User.email).all()).values()
+        for row in rows
+    ]
+    highest = max((user_id for user_id, _, _ in users), default=0)
+    with router.engines[router.home].begin() as conn:
+        allocator_metadata.create_all(conn)
+        current = conn.execute(select(func.max(user_id_allocator.c.id))).scalar() or 0
+        if current < highest:
+            conn.execute(insert(user_id_allocator).values(id=highest))
+            reset_id_sequences(conn, ("user_id_allocator",))
+        reserved = set(conn.execute(select(user_identity_reservations.c.user_id)).scalars())
+        missing = [
+            {"user_id": user_id, "username": username, "email": email}
+            for user_id, username, email in users
+            if user_id not in reserved
+        ]
+        if missing:
+            conn.execute(insert(user_identity_reservations), missing)
+    return max(current, highest)
+
+
+def find_user_by_username(router: ShardRouter, username: str) -> Optional[User]:
+    """全シャードからユーザー名で検索する（返すオブジェクトはセッションから切り離されている）"""
+    found = router.fan_out(lambda db: db.query(User).filter_by(username=username).first())
+    return next((user for user in found.values() if user is not None), None)
+
+
+def register_user(router: ShardRouter, username: str, email: str, password: str) -> int:
+    """ユーザー名・メールアドレスを予約して ID を採番し、そのユーザーのシャードに登録する"""
+    from user_service import register_new_user
+
+    if len(password) < 8:
+        raise ValueError("パスワードは8文字以上で入力してください。")
+    user_id = allocate_user_id(router, username, email)
+    db = router.session_for(user_id)
+    try:
+        return register_new_user(db, username, email, password, user_id=user_id)
+    except Exception:
+        release_user_id(router, user_id)
+        raise
+    finally:
+        db.close()
+
+
+# --- リバランス ---
+
+def misplaced_users(router: ShardRouter, name: str, batch_size: int = REBALANCE_BATCH_SIZE):
+    """シャード name にあるが、ハッシュリング上は別のシャードに属するユーザー ID を返す（ID 順）"""
+    with router.engines[name].connect() as conn:
+        last_id = 0
+        while True:
+            ids = conn.execute(
+                select(User.id).where(User.id > last_id).order_by(User.id).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                return
+            last_id = ids[-1]
+            for user_id in ids:
+                if router.shard_for(user_id) != name:
+                    yield user_id
+
+
+def move_users(router: ShardRouter, source: str, target: str, user_ids: List[int]) -> Dict[str, int]:
+    """ユーザーとそのデータを source から target に移す
+
+    target に前回の途中までのコピーが残っていれば削除してからコピーし、コミット後に source から
+    削除する。途中で失敗しても再実行すれば正しい状態になる。子テーブルの ID は target で採番し直す
+    （シャードごとに独立した連番のため）。
+    """
+    users = User.__table__
+    with router.engines[source].connect() as src:
+        user_rows = [dict(row) for row in src.execute(select(users).where(users.c.id.in_(user_ids))).mappings()]
+        children = {
+            table.name: [
+                {key: value for key, value in row.items() if key != "id"}
+                for row in src.execute(
+                    select(table).where(table.c.user_id.in_(user_ids)).order_by(table.c.id)
+                ).mappings()
+            ]
+            for table in USER_CHILD_TABLES
+        }
+
+    with router.engines[target].begin() as dst:
+        for table in reversed(USER_CHILD_TABLES):
+            dst.execute(delete(table).where(table.c.user_id.in_(user_ids)))
+        dst.execute(delete(users).where(users.c.id.in_(user_ids)))
+        if user_rows:
+            dst.execute(insert(users), user_rows)
+        for table in USER_CHILD_TABLES:
+            if children[table.name]:
+                dst.execute(insert(table), children[table.name])
+
+    with router.engines[source].begin() as src:
+        for table in reversed(USER_CHILD_TABLES):
+            src.execute(delete(table).where(table.c.user_id.in_(user_ids)))
+        src.execute(delete(users).where(users.c.id.in_(user_ids)))
+
+    return {"users": len(user_rows), **{name: len(rows) for name, rows in children.items()}}
+
+
+def rebalance(router: ShardRouter, dry_run: bool = False, batch_size: int = REBALANCE_BATCH_SIZE) -> Dict[str, Any]:
+    """ハッシュリング上の所属と異なるシャードにいるユーザーを、正しいシャードに移す"""
+    started = time.perf_counter()
+    moves: Dict[str, Dict[str, int]] = {}
+    for source in router.names:
+        pending: Dict[str, List[int]] = {}
+        for user_id in list(misplaced_users(router, source, batch_size)):
+            target = router.shard_for(user_id)
+            pending.setdefault(target, []).append(user_id)
+            if len(pending[target]) >= batch_size:
+                _record_move(moves, source, target, pending.pop(target), router, dry_run)
+        for target, user_ids in pending.items():
+            _record_move(moves, source, target, user_ids, router, dry_run)
+    if not dry_run:
+        sync_user_id_allocator(router)
+    return {"moves": moves, "dry_run": dry_run, "seconds": round(time.perf_counter() - started, 3)}
+
+
+def _record_move(moves, source, target, user_ids, router, dry_run) -> None:
+    key = f"{source} -> {target}"
+    counts = {"users": len(user_ids)} if dry_run else move_users(router, source, target, user_ids)
+    total = moves.setdefault(key, {})
+    for name, count in counts.items():
+        total[name] = total.get(name, 0) + count
+    if not dry_run:
+        logger.info(f"{key}: {total['users']} 人を移動しました")
+
+
+def shard_status(router: ShardRouter) -> Dict[str, Dict[str, int]]:
+    counts = router.fan_out(lambda db: db.query(func.count(User.id)).scalar())
+    return {
+        name: {"users": counts[name], "misplaced": sum(1 for _ in misplaced_users(router, name))}
+        for name in router.names
+    }
+
+
+def _require_router() -> ShardRouter:
+    router = active_router()
+    if router is None:
+        raise click.ClickException("DATABASE_SHARD_URLS が設定されていません")
+    return router
+
+
+@click.group()
+def cli():
+    """シャーディング管理ツール"""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+@cli.command("init")
+def init_command():
+    """全シャードにマイグレーションを適用し、ユーザー ID の採番を合わせる"""
+    from db_migration import upgrade
+
+    router = _require_router()
+    for name in router.names:
+        done = upgrade(router.engines[name])
+        click.echo(f"{name}: {len(done)} 件のマイグレーションを適用しました")
+    click.echo(f"✓ 次のユーザー ID は {sync_user_id_allocator(router) + 1} 以降です")
+
+
+@cli.command("status")
+def status_command():
+    """シャードごとのユーザー数と、移動が必要なユーザー数を表示する"""
+    for name, status in shard_status(_require_router()).items():
+        click.echo(f"{name}: ユーザー {status['users']} 人（移動が必要 {status['misplaced']} 人）")
+
+
+@cli.command("rebalance")
+@click.option("--dry-run", is_flag=True, help="移動するユーザー数だけを表示する")
+@click.option("--batch-size", default=REBALANCE_BATCH_SIZE, show_default=True, help="1回に移動するユーザー数")
+def rebalance_command(dry_run, batch_size):
+    """ハッシュリングと異なるシャードにいるユーザーを移動する（メンテナンス中に実行）"""
+    result = rebalance(_require_router(), dry_run=dry_run, batch_size=batch_size)
+    for key, counts in result["moves"].items():
+        details = ", ".join(f"{name} {count}" for name, count in counts.items())
+        click.echo(f"{key}: {details}")
+    if not result["moves"]:
+        click.echo("✓ すべてのユーザーが正しいシャードにいます")
+    elif not dry_run:
+        click.echo(f"✓ 移動が完了しました（{result['seconds']} 秒）")
+
+
+if __name__ == "__main__":
+    cli()
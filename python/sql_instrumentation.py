@@ -0,0 +1,182 @@
+"""
+リクエスト単位のSQL計測とN+1検出
+"""
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# 1リクエストあたりの許容クエリ数・DB時間（超えた場合にWARNINGログ）
+SQL_QUERY_BUDGET = int(os.getenv("SQL_QUERY_BUDGET", "20"))
+SQL_TIME_BUDGET_MS = float(os.getenv("SQL_TIME_BUDGET_MS", "200"))
+# 同じ形のステートメントがこの回数以上発行されたら N+1 の疑いとみなす
+SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "5"))
+# デバッグモード以外でもヘッダーを付与したい場合は 1 を設定
+SQL_STATS_HEADER = os.getenv("SQL_STATS_HEADER", "0") == "1"
+SQL_STATS_HEADER_NAME = "X-SQL-Stats"
+
+_current_stats: ContextVar[Optional["QueryStats"]] = ContextVar(
+    "sql_query_stats", default=None
+)
+
+# ステートメントの「形」を求めるための正規化パターン
+_IN_LIST_PATTERN = re.compile(r"\bIN\s*\((?:[^()]*)\)", re.IGNORECASE)
+_STRING_PATTERN = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_PATTERN = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAM_PATTERN = re.compile(r"%\(\w+\)s|:\w+|\?|%s")
+_SPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_statement(statement: str) -> str:
+    """リテラル・バインド変数・IN句の要素数を潰して、ステートメントの形を返す"""
+    shape = _STRING_PATTERN.sub("?", statement)
+    shape = _IN_LIST_PATTERN.sub("IN (?)", shape)
+    shape = _PARAM_PATTERN.sub("?", shape)
+    shape = _NUMBER_PATTERN.sub("?", shape)
+    return _SPACE_PATTERN.sub(" ", shape).strip()
+
+
+class QueryStats:
+    """1リクエスト（または任意の区間）で発行されたクエリの集計"""
+
+    def __init__(self, label: str = ""):
+        self.label = label
+        self.count = 0
+        self.total_time = 0.0  # 秒
+        self.slowest_time = 0.0
+        self.slowest_statement: Optional[str] = None
+        self.shapes: Dict[str, int] = {}
+
+    def record(self, statement: str, duration: float) -> None:
+        self.count += 1
+        self.total_time += duration
+        if duration >= self.slowest_time:
+            self.slowest_time = duration
+            self.slowest_statement = statement
+        shape = normalize_statement(statement)
+        self.shapes[shape] = self.shapes.get(shape, 0) + 1
+
+    def repeated_shapes(
+        self, threshold: int = SQL_N_PLUS_ONE_THRESHOLD
+    ) -> List[Dict[str, Any]]:
+        """同じ形で threshold 回以上発行されたステートメント（N+1候補）"""
+        repeated = [
+            {"statement": shape, "count": count}
+            for shape, count in self.shapes.items()
+            if count >= threshold
+        ]
+        return sorted(repeated, key=lambda x: x["count"], reverse=True)
+
+    def is_over_budget(
+        self,
+        query_budget: int = SQL_QUERY_BUDGET,
+        time_budget_ms: float = SQL_TIME_BUDGET_MS,
+    ) -> bool:
+        return self.count > query_budget or self.total_time * 1000 > time_budget_ms
+
+    def header_value(self) -> str:
+        return (
+            f"count={self.count}; time_ms={self.total_time * 1000:.1f}; "
+            f"slowest_ms={self.slowest_time * 1000:.1f}"
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "label": self.label,
+            "query_count": self.count,
+            "total_time_ms": round(self.total_time * 1000, 2),
+            "slowest_time_ms": round(self.slowest_time * 1000, 2),
+            "slowest_statement": self.slowest_statement,
+            "n_plus_one_candidates": self.repeated_shapes(),
+        }
+
+
+def current_query_stats() -> Optional[QueryStats]:
+    """現在のコンテキストで集計中の QueryStats（なければ None）"""
+    return _current_stats.get()
+
+
+@contextmanager
+def collect_queries(label: str = ""):
+    """with ブロック内で発行されたクエリを集計する（ベンチマーク・バッチ処理用）"""
+    stats = QueryStats(label)
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start_times = conn.info.get("query_start_time")
+    if not start_times:
+        return
+    duration = time.perf_counter() - start_times.pop()
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.record(statement, duration)
+
+
+def install_query_listeners(engine) -> None:
+    """エンジンにクエリ計測用のイベントリスナーを登録する（重複登録しない）"""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def log_query_stats(stats: QueryStats) -> None:
+    """予算超過・N+1候補をログに出力"""
+    if stats.is_over_budget():
+        logger.warning(
+            f"SQL予算超過 {stats.label}: {stats.count}クエリ "
+            f"(上限 {SQL_QUERY_BUDGET}), DB時間 {stats.total_time * 1000:.1f}ms "
+            f"(上限 {SQL_TIME_BUDGET_MS:.0f}ms), "
+            f"最遅 {stats.slowest_time * 1000:.1f}ms: {stats.slowest_statement}"
+        )
+    for candidate in stats.repeated_shapes():
+        logger.warning(
+            f"N+1の疑い {stats.label}: {candidate['count']}回 "
+            f"{candidate['statement']}"
+        )
+
+
+def setup_sql_instrumentation(app, engine):
+    """Flaskアプリにリクエスト単位のSQL計測を設定"""
+    from flask import g, request
+
+    install_query_listeners(engine)
+
+    @app.before_request
+    def start_sql_stats():
+        stats = QueryStats(f"{request.method} {request.path}")
+        g.sql_stats = stats
+        g.sql_stats_token = _current_stats.set(stats)
+
+    @app.after_request
+    def report_sql_stats(response):
+        stats = g.get("sql_stats")
+        if stats is None:
+            return response
+        log_query_stats(stats)
+        if app.debug or SQL_STATS_HEADER:
+            response.headers[SQL_STATS_HEADER_NAME] = stats.header_value()
+        return response
+
+    @app.teardown_request
+    def reset_sql_stats(exc):
+        token = g.pop("sql_stats_token", None)
+        if token is not None:
+            _current_stats.reset(token)
+
+    return app
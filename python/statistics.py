@@ -1,10 +1,12 @@
 # statistics.py (修正案)
 from datetime import datetime, timedelta
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import case, func
 from models import FoodLossRecord, LossReason  # models.pyからインポート
 
+import clock
+
 
 # --- 1. 週の境界計算ヘルパー (そのまま残す) ---
 def get_week_boundaries(today: datetime) -> tuple[datetime, datetime]:
@@ -79,7 +81,7 @@ def calculate_weekly_statistics(
     """
 
     if target_date is None:
-        target_date = datetime.now()
+        target_date = clock.now()
 
     # target_date が date の場合は datetime に変換しておく
     if not isinstance(target_date, datetime):
@@ -98,9 +100,11 @@ def calculate_weekly_statistics(
     week_start_str = week_start.isoformat()
     week_end_str = week_end.isoformat()
 
-    # 1. 週間の全記録を取得 (日付フィルター)
+    # 1. 週間の全記録を廃棄理由と一緒に取得 (日付フィルター)
+    # 理由はレコードごとに引かず JOIN で1回にまとめる（N+1 クエリの回避）
     weekly_records = (
-        db.query(FoodLossRecord)
+        db.query(FoodLossRecord, LossReason.reason_text)
+        .outerjoin(LossReason, LossReason.id == FoodLossRecord.loss_reason_id)
         .filter(FoodLossRecord.user_id == user_id)
         .filter(FoodLossRecord.record_date >= week_start_str)
         .filter(FoodLossRecord.record_date <= week_end_str)
@@ -119,13 +123,7 @@ def calculate_weekly_statistics(
     # 2. 廃棄された料理名リスト (表データ) の作成
     # 料理名と廃棄量、理由のリストを作成
     dish_table_data = []
-    for record in weekly_records:
-        reason_text = (
-            db.query(LossReason.reason_text)
-            .filter(LossReason.id == record.loss_reason_id)
-            .scalar()
-        )
-
+    for record, reason_text in weekly_records:
         dish_table_data.append(
             {
                 "id": record.id,
@@ -183,12 +181,12 @@ def calculate_weekly_statistics(
     }
 
 
-def get_total_grams_for_weeks(db: Session, user_id: int, weeks_ago: int) -> float:
+def get_total_grams_for_weeks(db: Session, user_id: int, weeks_ago: int, today: Optional[datetime] = None) -> float:
     """
     過去 N 週間分の合計廃棄重量（グラム）を取得する。
-    （weeks_ago=4なら、今週を含まない過去4週間を取得）
+    （weeks_ago=4なら、今週を含まない過去4週間を取得。today を指定するとその時点から数える）
     """
-    today = datetime.now()
+    today = today or clock.now()
 
     # 過去 N 週間の起点となる日時を計算
     # 例: 4週間前は today - 4週間
@@ -208,12 +206,37 @@ def get_total_grams_for_weeks(db: Session, user_id: int, weeks_ago: int) -> floa
     return total_grams or 0.0
 
 
-def get_last_two_weeks(db: Session, user_id: int) -> tuple[float, float]:
+def get_rolling_weekly_totals(db: Session, user_id: int, weeks: int, today: Optional[datetime] = None) -> list[float]:
+    """
+    today から7日ずつさかのぼった期間ごとの合計廃棄重量（グラム）を1回のクエリで取得する。
+    戻り値の i 番目は [today - (i+1)週, today - i週) の合計
+    （get_total_grams_for_weeks(i+1) - get_total_grams_for_weeks(i) と同じ期間）。
+    """
+    today = today or clock.now()
+    bounds = [(today - timedelta(weeks=i)).isoformat() for i in range(weeks + 1)]
+    totals = db.query(
+        *(
+            func.sum(case(
+                ((FoodLossRecord.record_date >= bounds[i + 1]) & (FoodLossRecord.record_date < bounds[i]), FoodLossRecord.weight_grams),
+                else_=0,
+            ))
+            for i in range(weeks)
+        )
+    ).filter(
+        FoodLossRecord.user_id == user_id,
+        FoodLossRecord.record_date >= bounds[-1],
+        FoodLossRecord.record_date < bounds[0],
+    ).one()
+    return [total or 0.0 for total in totals]
+
+
+def get_last_two_weeks(db: Session, user_id: int, today: Optional[datetime] = None) -> tuple[float, float]:
     """
     直近の2週間分の合計廃棄重量（グラム）を取得する。
-    戻り値は (先週の合計, 今週の合計) のタプル。
+    戻り値は (先週の合計, 今週の合計) のタプル。today を指定するとその日を含む週を今週とし、
+    today より後の記録は含めない（その時点の記録で評価し直す場合）。
     """
-    today = datetime.now()
+    today = today or clock.now()
 
     # 今週の月曜日と日曜日を取得
     this_monday, this_sunday = get_week_boundaries(today)
@@ -224,8 +247,12 @@ def get_last_two_weeks(db: Session, user_id: int) -> tuple[float, float]:
 
     # record_dateの型を統一して比較（datetimeとstrの両方に対応）
     # 先週の合計重量を取得
+    # 先週の月曜日から今週の日曜日までに絞り込む（インデックス・パーティションの範囲で読む）
     last_week_records = db.query(FoodLossRecord).filter(
-        FoodLossRecord.user_id == user_id
+        FoodLossRecord.user_id == user_id,
+        FoodLossRecord.record_date >= last_monday.strftime("%Y-%m-%d"),
+        FoodLossRecord.record_date < (this_sunday + timedelta(days=1)).strftime("%Y-%m-%d"),
+        FoodLossRecord.record_date <= today.isoformat(),
     ).all()
     
     last_week_grams = 0.0
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+スケールテスト用の合成データ生成ツール
+
+- N 人のユーザーと M 週分のフードロス記録、余りもの（arrange_suggest）を生成する
+- 廃棄理由・品目・重量・記録時刻は実データに近い分布（理由の偏り、品目ごとの対数正規分布の重量、
+  食事時間帯、ユーザーごとの記録頻度と削減傾向）で生成する
+- 同じシードと終了日からは常に同じデータが生成される
+- PostgreSQL では COPY、SQLite などではドライバーの executemany でまとめて投入する
+
+使用例:
+    python synthetic_data.py generate --users 10000 --weeks 12 --seed 42
+"""
+import bisect
+import csv
+import io
+import math
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+from itertools import accumulate, islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import click
+from sqlalchemy import inspect, text
+
+SYNTHETIC_PASSWORD = "synthetic-pass"
+BULK_CHUNK_SIZE = 10000
+
+# 廃棄理由の出現割合
+REASON_WEIGHTS = {
+    "食べ残し": 0.30,
+    "期限切れ": 0.25,
+    "料理後の廃棄": 0.15,
+    "調理中の廃棄": 0.15,
+    "調理失敗": 0.08,
+    "その他": 0.07,
+}
+
+# (品目名, 重量の中央値[g], 出現割合)
+ITEM_CATALOG = [
+    ("ご飯", 120, 0.14),
+    ("パン", 60, 0.08),
+    ("カレー", 200, 0.07),
+    ("味噌汁", 150, 0.07),
+    ("サラダ", 80, 0.08),
+    ("野菜くず", 50, 0.10),
+    ("牛乳", 300, 0.05),
+    ("焼き魚", 70, 0.05),
+    ("野菜炒め", 120, 0.06),
+    ("麺類", 150, 0.06),
+    ("果物", 100, 0.07),
+    ("豆腐", 150, 0.04),
+    ("卵", 60, 0.04),
+    ("肉", 100, 0.05),
+    ("お菓子", 40, 0.04),
+]
+
+# (時, 出現割合)：記録は食事の前後に集中する
+MEAL_HOURS = [(7, 0.2), (8, 0.1), (12, 0.2), (13, 0.1), (19, 0.25), (20, 0.1), (22, 0.05)]
+
+# 記録のうち余りものとして登録される割合
+LEFTOVER_RATIO = 0.1
+RECIPE_TEMPLATE = "{item}を使ったアレンジレシピ（合成データ）"
+
+
+def _normalized_cumulative(weights: Sequence[float]) -> List[float]:
+    total = sum(weights)
+    cumulative = [w / total for w in accumulate(weights)]
+    cumulative[-1] = 1.0
+    return cumulative
+
+
+def _poisson(rng: random.Random, lam: float) -> int:
+    """ポアソン乱数（Knuth 法。1週間あたりの件数程度の小さい λ を想定）"""
+    if lam <= 0:
+        return 0
+    threshold = math.exp(-lam)
+    k, p = 0, 1.0
+    while True:
+        p *= rng.random()
+        if p <= threshold:
+            return k
+        k += 1
+
+
+class SyntheticDataGenerator:
+    """シードから決定的に行データを生成する（DB には依存しない）"""
+
+    def __init__(
+        self,
+        users: int,
+        weeks: int,
+        records_per_week: float = 5.0,
+        seed: int = 42,
+        end_date: Optional[date] = None,
+        prefix: Optional[str] = None,
+    ):
+        self.users = users
+        self.weeks = weeks
+        self.records_per_week = records_per_week
+        self.seed = seed
+        self.end_date = end_date or date.today()
+        self.prefix = prefix or f"syn{seed}"
+
+        # 重み付き抽選は累積確率の二分探索で行う（random.choices より速い）
+        self._items = ITEM_CATALOG
+        self._item_cum = _normalized_cumulative([item[2] for item in ITEM_CATALOG])
+        self._reason_texts = list(REASON_WEIGHTS)
+        self._reason_cum = _normalized_cumulative(list(REASON_WEIGHTS.values()))
+        self._hours = [h for h, _ in MEAL_HOURS]
+        self._hour_cum = _normalized_cumulative([w for _, w in MEAL_HOURS])
+
+    def username(self, index: int) -> str:
+        return f"{self.prefix}_{index:07d}"
+
+    def user_rows(self, first_id: int, password_hash: str) -> Iterator[Tuple]:
+        """(id, username, email, password, total_points)"""
+        for i in range(self.users):
+            username = self.username(i)
+            yield (first_id + i, username, f"{username}@example.com", password_hash, 0)
+
+    def record_rows(
+        self, first_user_id: int, first_record_id: int, reason_ids: Dict[str, int]
+    ) -> Iterator[Tuple[Tuple, Optional[Tuple]]]:
+        """(記録行, 余りもの行 or None) を生成する
+
+        記録行: (id, user_id, item_name, weight_grams, loss_reason_id, record_date)
+        余りもの行: (user_id, item_name, arrange_recipe)
+        """
+        start = datetime.combine(self.end_date, datetime.min.time()) - timedelta(weeks=self.weeks)
+        reason_id_list = [reason_ids[text] for text in self._reason_texts]
+        record_id = first_record_id
+        for i in range(self.users):
+            # ユーザーごとに独立した乱数列を使うため、ユーザー数を変えても既存ユーザーのデータは変わらない
+            rng = random.Random(f"{self.seed}:{i}")
+            rand = rng.random
+            user_id = first_user_id + i
+            activity = rng.gammavariate(2.0, 0.5)  # 記録頻度の個人差（平均 1）
+            trend = rng.uniform(-0.02, 0.05)  # 週ごとの削減率（負なら増加）
+            for week in range(self.weeks):
+                scale = (1.0 - trend) ** week
+                week_start = start + timedelta(weeks=week)
+                for _ in range(_poisson(rng, self.records_per_week * activity)):
+                    item, median, _ = self._items[bisect.bisect(self._item_cum, rand())]
+                    grams = median * math.exp(rng.gauss(0.0, 0.5)) * scale
+                    hour = self._hours[bisect.bisect(self._hour_cum, rand())]
+                    offset = int(rand() * 7) * 86400 + hour * 3600 + int(rand() * 3600)
+                    recorded_at = week_start + timedelta(seconds=offset)
+                    row = (
+                        record_id,
+                        user_id,
+                        item,
+                        round(min(max(grams, 5.0), 3000.0), 1),
+                        reason_id_list[bisect.bisect(self._reason_cum, rand())],
+                        recorded_at.isoformat(),
+                    )
+                    leftover = None
+                    if rand() < LEFTOVER_RATIO:
+                        leftover = (user_id, item, RECIPE_TEMPLATE.format(item=item))
+                    record_id += 1
+                    yield row, leftover
+
+
+# --- 一括投入 ---
+
+
+def _chunks(rows: Iterable[Sequence], size: int) -> Iterator[List[Sequence]]:
+    iterator = iter(rows)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _copy_rows(connection, table: str, columns: Sequence[str], rows: List[Sequence]) -> None:
+    """PostgreSQL の COPY FROM STDIN で投入する"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer
+        )
+    finally:
+        cursor.close()
+
+
+def _placeholder(paramstyle: str) -> str:
+    return "?" if paramstyle == "qmark" else "%s"
+
+
+def bulk_insert(connection, table: str, columns: Sequence[str], rows: Iterable[Sequence], chunk_size: int = BULK_CHUNK_SIZE) -> int:
+    """行をまとめて投入し、投入件数を返す（ORM を介さずドライバーへ直接渡す）"""
+    use_copy = connection.dialect.name == "postgresql"
+    placeholder = _placeholder(connection.dialect.dbapi.paramstyle)
+    sql = (
+        f"INSERT INTO {table} ({', '.join(columns)}) "
+        f"VALUES ({', '.join([placeholder] * len(columns))})"
+    )
+    count = 0
+    for chunk in _chunks(rows, chunk_size):
+        if use_copy:
+            _copy_rows(connection, table, columns, chunk)
+        else:
+            connection.exec_driver_sql(sql, [tuple(row) for row in chunk])
+        count += len(chunk)
+    return count
+
+
+def _next_id(connection, table: str) -> int:
+    return connection.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {table}")).scalar() + 1
+
+
+class _LeftoverCollector:
+    """記録行を流しつつ、余りもの行を横に取り分ける"""
+
+    def __init__(self, rows: Iterator[Tuple[Tuple, Optional[Tuple]]]):
+        self._rows = rows
+        self.leftovers: List[Tuple] = []
+
+    def __iter__(self):
+        for row, leftover in self._rows:
+            if leftover is not None:
+                self.leftovers.append(leftover)
+            yield row
+
+
+def load_synthetic_data(engine, generator: SyntheticDataGenerator) -> Dict[str, Any]:
+    """生成したデータを1トランザクションで投入し、件数と所要時間を返す
+
+    同じ prefix のユーザーが既に存在する場合は投入せず、既存のユーザー名を返す。
+    """
+    from auth_service import generate_password_hash
+    from database import reset_id_sequences
+    from db_migration import upgrade
+    from points_ledger import record_opening_balances
+    from user_counters import backfill as backfill_user_counters
+
+    # 空のデータベースなら、渡されたエンジンにマイグレーションでスキーマと廃棄理由を作成する
+    # （既存のスキーマはそのバージョンのまま投入する）
+    if not inspect(engine).has_table("users"):
+        upgrade(engine)
+    usernames = [generator.username(i) for i in range(generator.users)]
+    started = time.perf_counter()
+    with engine.begin() as connection:
+        exists = usernames and connection.execute(
+            text("SELECT 1 FROM users WHERE username = :username"),
+            {"username": usernames[0]},
+        ).first()
+        if exists:
+            return {"usernames": usernames, "users": 0, "records": 0, "leftovers": 0, "seconds": 0.0, "skipped": True}
+
+        reason_ids = dict(
+            connection.execute(text("SELECT reason_text, id FROM loss_reasons")).all()
+        )
+        first_user_id = _next_id(connection, "users")
+        first_record_id = _next_id(connection, "food_loss_records")
+
+        # 全ユーザー共通のパスワード（ハッシュ計算は1回だけ）
+        password_hash = generate_password_hash(SYNTHETIC_PASSWORD)
+        user_count = bulk_insert(
+            connection,
+            "users",
+            ("id", "username", "email", "password", "total_points"),
+            generator.user_rows(first_user_id, password_hash),
+        )
+        # 生成したポイントを台帳にも記録する（reconcile で不一致にならないように）
+        if inspect(connection).has_table("points_ledger"):
+            record_opening_balances(connection)
+        collector = _LeftoverCollector(
+            generator.record_rows(first_user_id, first_record_id, reason_ids)
+        )
+        record_count = bulk_insert(
+            connection,
+            "food_loss_records",
+            ("id", "user_id", "item_name", "weight_grams", "loss_reason_id", "record_date"),
+            collector,
+        )
+        leftover_count = bulk_insert(
+            connection,
+            "arrange_suggest",
+            ("user_id", "item_name", "arrange_recipe"),
+            collector.leftovers,
+        )
+        # 生成した記録からユーザーの集計値を計算する（user_counters.py verify で不一致にならないように）
+        if "record_count" in {column["name"] for column in inspect(connection).get_columns("users")}:
+            backfill_user_counters(connection)
+        reset_id_sequences(connection, ("users", "food_loss_records"))
+
+    elapsed = time.perf_counter() - started
+    return {
+        "usernames": usernames,
+        "users": user_count,
+        "records": record_count,
+        "leftovers": leftover_count,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round((user_count + record_count + leftover_count) / elapsed) if elapsed > 0 else 0,
+        "skipped": False,
+    }
+
+
+@click.group()
+def cli():
+    """合成データ生成ツール"""
+    pass
+
+
+@cli.command("generate")
+@click.option("--users", default=1000, show_default=True, help="ユーザー数")
+@click.option("--weeks", default=12, show_default=True, help="記録を生成する週数")
+@click.option("--records-per-week", default=5.0, show_default=True, help="1ユーザー・1週あたりの平均記録数")
+@click.option("--seed", default=42, show_default=True)
+@click.option("--end-date", default=None, help="最終日 (YYYY-MM-DD)。未指定なら今日")
+@click.option("--prefix", default=None, help="ユーザー名の接頭辞（既定: syn<seed>）")
+@click.option("--database-url", default=None, help="投入先（未指定なら DATABASE_URL / db_* 環境変数）")
+def generate_command(users, weeks, records_per_week, seed, end_date, prefix, database_url):
+    """合成データを生成してデータベースに投入する"""
+    import os
+
+    if database_url:
+        os.environ["DATABASE_URL"] = database_url
+    from database import engine
+
+    generator = SyntheticDataGenerator(
+        users,
+        weeks,
+        records_per_week=records_per_week,
+        seed=seed,
+        end_date=datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else None,
+        prefix=prefix,
+    )
+    result = load_synthetic_data(engine, generator)
+    if result["skipped"]:
+        click.echo(f"接頭辞 {generator.prefix} のユーザーは既に存在するため、投入をスキップしました")
+        return
+    click.echo(
+        f"投入完了: ユーザー {result['users']} 件, 記録 {result['records']} 件, "
+        f"余りもの {result['leftovers']} 件 ({result['seconds']} 秒, {result['rows_per_second']} 行/秒)"
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
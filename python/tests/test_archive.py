@@ -0,0 +1,69 @@
+import pytest
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import statistics
+from archive import archive_cutoff, archive_records, archive_status
+from database import create_database_engine
+from db_migration import upgrade
+from final_report import FinalReportGenerator
+from models import DailyLossSummary, FoodLossRecord, FoodLossRecordArchive
+from synthetic_data import SyntheticDataGenerator, load_synthetic_data
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_database_engine(f"sqlite:///{tmp_path}/app.db")
+    upgrade(engine)
+    load_synthetic_data(engine, SyntheticDataGenerator(12, 16, records_per_week=6, seed=3))
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+def test_horizon_cannot_cut_into_points_baseline():
+    with pytest.raises(ValueError):
+        archive_cutoff(8)
+
+
+def test_archive_keeps_report_and_points_inputs(db):
+    before = FinalReportGenerator(db).generate_complete_report()
+    baseline = [statistics.get_total_grams_for_weeks(db, user_id, 8) for user_id in range(1, 13)]
+    total = db.query(func.count(FoodLossRecord.id)).scalar()
+
+    planned = archive_records(db, horizon_weeks=9, dry_run=True)["records_archived"]
+    assert planned > 0
+    report = archive_records(db, horizon_weeks=9, batch_size=100)
+    assert report["records_archived"] == planned
+    assert report["batches"] > 1
+
+    cutoff = report["cutoff"]
+    assert db.query(FoodLossRecord).filter(FoodLossRecord.record_date < cutoff).count() == 0
+    assert db.query(func.count(FoodLossRecordArchive.id)).scalar() == planned
+    assert db.query(func.sum(DailyLossSummary.record_count)).scalar() == planned
+    assert db.query(func.count(FoodLossRecord.id)).scalar() == total - planned
+
+    after = FinalReportGenerator(db).generate_complete_report()
+    for section in ("user_statistics", "reason_analysis", "timeline_analysis", "overall_summary", "weekly_comparison", "top_performers"):
+        assert after[section] == before[section]
+    assert [statistics.get_total_grams_for_weeks(db, user_id, 8) for user_id in range(1, 13)] == baseline
+
+    # 2回目は移す記録がない
+    assert archive_records(db, horizon_weeks=9)["records_archived"] == 0
+
+    # 保管期間より前の日付で後から入力された記録は、既存の集計行に加算される
+    summary = db.query(DailyLossSummary).filter(DailyLossSummary.loss_reason_id.isnot(None)).first()
+    grams, count = summary.total_grams, summary.record_count
+    db.add(FoodLossRecord(
+        user_id=summary.user_id, item_name="ご飯", weight_grams=40,
+        loss_reason_id=summary.loss_reason_id, record_date=f"{summary.day}T12:00:00",
+    ))
+    db.commit()
+    rows = db.query(func.count(DailyLossSummary.id)).scalar()
+    assert archive_records(db, horizon_weeks=9)["summary_rows_created"] == 0
+    db.refresh(summary)
+    assert (summary.total_grams, summary.record_count) == (grams + 40, count + 1)
+    assert db.query(func.count(DailyLossSummary.id)).scalar() == rows
+    status = archive_status(db, horizon_weeks=9)
+    assert status["archivable_records"] == 0
+    assert status["archived_records"] == planned + 1
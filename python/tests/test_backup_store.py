@@ -0,0 +1,75 @@
+import json
+import sqlite3
+from datetime import datetime, timedelta
+
+from backup_store import BackupStore, fixed_chunks, line_chunks, sqlite_snapshot
+
+
+def _make_database(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS t (id INTEGER PRIMARY KEY, v TEXT)")
+    conn.executemany("INSERT INTO t (v) VALUES (?)", [(f"value-{i}" * 20,) for i in range(rows)])
+    conn.commit()
+    return conn
+
+
+def _backup(store, source, snapshot):
+    sqlite_snapshot(str(source), str(snapshot))
+    with open(snapshot, "rb") as f:
+        return store.write(fixed_chunks(f, 16 * 1024), {"backend": "sqlite"})
+
+
+def test_incremental_backup_reuses_unchanged_chunks_and_restores(tmp_path):
+    source = tmp_path / "app.db"
+    conn = _make_database(source, 5000)
+    store = BackupStore(tmp_path / "backups")
+
+    first = _backup(store, source, tmp_path / "s1.db")
+    assert first["new_chunks"] == len(first["chunks"])
+    assert first["stored_bytes"] < first["size_bytes"]
+
+    # WAL に残ったまま（チェックポイント前）の変更もスナップショットに含まれる
+    conn.execute("UPDATE t SET v = 'changed' WHERE id = 1")
+    conn.commit()
+    second = _backup(store, source, tmp_path / "s2.db")
+    assert 0 < second["new_chunks"] < len(second["chunks"]) / 4
+
+    restored = tmp_path / "restored.db"
+    with open(restored, "wb") as f:
+        for data in store.read(second):
+            f.write(data)
+    check = sqlite3.connect(restored)
+    assert check.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    assert check.execute("SELECT v FROM t WHERE id = 1").fetchone()[0] == "changed"
+    check.close()
+    conn.close()
+
+
+def test_line_chunks_boundaries_survive_insertions():
+    lines = [f"{i}\tuser{i}\t{i * 7}\n".encode() for i in range(20000)]
+    before = list(line_chunks(lines, mask=(1 << 6) - 1, min_size=512, max_size=64 * 1024))
+    after = list(line_chunks(lines[:10] + [b"inserted\n"] + lines[10:], mask=(1 << 6) - 1, min_size=512, max_size=64 * 1024))
+    assert b"".join(after).count(b"inserted") == 1
+    # 先頭付近の変更でも、後ろのチャンクはほとんど同じになる
+    assert len(set(after) - set(before)) <= 2
+
+
+def test_prune_applies_retention_and_removes_unreferenced_chunks(tmp_path):
+    store = BackupStore(tmp_path / "backups")
+    now = datetime(2026, 10, 18, 3, 0)
+    for days_ago in range(10):
+        manifest = store.write([f"day-{days_ago}".encode(), b"shared"], {"backend": "sqlite"})
+        # 作成日時を過去にずらす
+        path = store.manifest_dir / f"{manifest['id']}.json"
+        manifest["created_at"] = (now - timedelta(days=days_ago)).isoformat()
+        path.write_text(json.dumps(manifest))
+
+    kept = store.retained(keep_last=1, keep_daily=3, keep_weekly=0, now=now)
+    assert len(kept) == 3
+
+    result = store.prune(keep_last=1, keep_daily=3, keep_weekly=0, now=now)
+    assert result["removed_backups"] == 7
+    assert result["removed_chunks"] == 7
+    assert len(store.manifests()) == 3
+    assert store.usage()["backups"] == 3
@@ -0,0 +1,60 @@
+from benchmark import (
+    ROUTE_BUDGETS,
+    compare_results,
+    parse_sql_stats_header,
+    percentile,
+    summarize,
+)
+
+
+def test_percentile_interpolates():
+    values = [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert percentile(values, 50) == 3.0
+    assert percentile(values, 95) == 4.8
+    assert percentile([], 99) == 0.0
+
+
+def test_parse_sql_stats_header():
+    assert parse_sql_stats_header("count=7; time_ms=1.2; slowest_ms=0.4") == 7
+    assert parse_sql_stats_header(None) is None
+
+
+def test_summarize_reports_queries():
+    result = summarize([2.0, 1.0, 3.0], [3, 5, 4], errors=1, elapsed=0.006)
+    assert result["p50_ms"] == 2.0
+    assert result["queries_max"] == 5
+    assert result["throughput_rps"] == 500.0
+
+
+def _scenario(p50, p95, queries, route="/api/weekly_stats", spread=0.1):
+    samples = [p50 - spread, p50, p50 + spread, p95]
+    return {
+        "route": route,
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "queries_mean": queries,
+        "queries_max": queries,
+        "samples_ms": samples,
+    }
+
+
+def _result(**scenarios):
+    return {"meta": {"target": "flask-test-client"}, "scenarios": scenarios}
+
+
+def test_compare_ignores_noise_and_flags_regressions():
+    baseline = _result(weekly_stats=_scenario(10.0, 12.0, 2))
+    noisy = _result(weekly_stats=_scenario(10.5, 12.5, 2))
+    assert compare_results(baseline, noisy)["passed"]
+
+    slower = _result(weekly_stats=_scenario(20.0, 25.0, 2))
+    report = compare_results(baseline, slower)
+    assert not report["passed"]
+    assert {f["metric"] for f in report["findings"]} == {"p50_ms", "p95_ms"}
+
+
+def test_compare_enforces_route_query_budget():
+    report = compare_results(None, _result(weekly_stats=_scenario(1.0, 1.0, 9)))
+    assert not report["passed"]
+    assert report["findings"][0]["kind"] == "budget"
+    assert report["findings"][0]["budget"] == ROUTE_BUDGETS["/api/weekly_stats"]["max_queries"]
@@ -0,0 +1,77 @@
+import uuid
+from datetime import datetime
+
+import clock
+import services
+from archive import archive_records
+from consistency_checker import check_consistency
+from models import FoodLossRecord, User
+
+NOW = datetime(2026, 10, 14, 12, 0)  # 水曜日（週の開始は 2026-10-12）
+
+
+def create_user(db, week=None, day=None, grams=()):
+    unique = f"cc_{uuid.uuid4().hex[:8]}"
+    u = User(
+        username=unique,
+        password="x",
+        email=f"{unique}@example.com",
+        last_points_awarded_week_start=week,
+        last_points_awarded_date=day,
+    )
+    db.add(u)
+    db.flush()
+    for record_date, weight in grams:
+        db.add(FoodLossRecord(user_id=u.id, item_name="ご飯", weight_grams=weight, loss_reason_id=1, record_date=record_date))
+    db.commit()
+    return u.id
+
+
+def test_detects_and_repairs_flags_in_bulk(db):
+    with clock.use_clock(clock.FrozenClock(NOW)):
+        ok = create_user(db)
+        services.add_loss_record_with_points(
+            db, {"user_id": ok, "item_name": "ご飯", "weight_grams": 120, "reason_text": "食べ残し"}
+        )
+        no_records = create_user(db, week="2026-10-12")
+        # 初回の週に 30g で評価されてフラグが立ち、その後の入力で 120g になった（付与漏れ）
+        missed = create_user(db, week="2026-10-12", day="2026-10-13", grams=[("2026-10-13T09:00:00", 30), ("2026-10-14T09:00:00", 90)])
+        future = create_user(db, day="2026-11-01", grams=[("2026-10-14T09:00:00", 90)])
+
+        report = check_consistency(db, chunk_size=2)
+        assert report["users_scanned"] >= 4
+        assert report["issues_by_type"] == {
+            "date_in_future": 1,
+            "week_missing_award": 1,
+            "week_without_records": 1,
+        }
+        assert {i["user_id"] for i in report["examples"]} == {no_records, missed, future}
+        assert report["repaired"] == 0
+
+        fixed = check_consistency(db, fix=True, chunk_size=2)
+        assert fixed["repaired"] == 3
+        assert db.get(User, missed).last_points_awarded_week_start is None
+        assert db.get(User, future).last_points_awarded_date is None
+        assert check_consistency(db)["issues"] == 0
+
+        # フラグを消したため、次の評価で初回ボーナスが付与される
+        result = services.calculate_weekly_points_logic(db, missed)
+        assert result["onboarding_applied"]
+
+
+def test_archived_records_still_count(db):
+    # 最後の記録が保管期間より前のユーザー（フラグはその週・その日を指したまま）
+    dormant = create_user(db)
+    with clock.use_clock(clock.FrozenClock(datetime(2026, 7, 8, 9, 0))):
+        services.add_loss_record_with_points(
+            db, {"user_id": dormant, "item_name": "ご飯", "weight_grams": 120, "reason_text": "食べ残し"}
+        )
+    with clock.use_clock(clock.FrozenClock(NOW)):
+        assert check_consistency(db)["issues"] == 0
+        archive_records(db, horizon_weeks=9)
+        assert db.query(FoodLossRecord).filter(FoodLossRecord.user_id == dormant).count() == 0
+
+        report = check_consistency(db, fix=True)
+        assert report["issues"] == 0
+    user = db.get(User, dormant, populate_existing=True)
+    assert (user.last_points_awarded_week_start, user.last_points_awarded_date) == ("2026-07-06", "2026-07-08")
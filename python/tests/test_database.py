@@ -0,0 +1,51 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from database import begin_write, create_database_engine, sqlite_path_from_url
+
+
+def test_sqlite_path_from_url(tmp_path):
+    assert sqlite_path_from_url("sqlite://") is None
+    assert sqlite_path_from_url("postgresql://u:p@localhost/db") is None
+    assert sqlite_path_from_url(f"sqlite:///{tmp_path}/app.db") == str(tmp_path / "app.db")
+
+
+def test_sqlite_file_engine_pragmas(tmp_path):
+    engine = create_database_engine(f"sqlite:///{tmp_path}/db/app.db")
+    try:
+        with engine.connect() as connection:
+            assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+            assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1  # NORMAL
+            assert connection.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+            assert connection.exec_driver_sql("PRAGMA cache_size").scalar() < 0
+    finally:
+        engine.dispose()
+
+
+def test_begin_write_takes_write_lock(tmp_path):
+    path = tmp_path / "app.db"
+    engine = create_database_engine(f"sqlite:///{path}")
+    try:
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TABLE t (v INTEGER)"))
+
+        db = sessionmaker(bind=engine)()
+        begin_write(db)
+        other = sqlite3.connect(path, timeout=0)
+        try:
+            # 読み取りは WAL によりブロックされない
+            assert other.execute("SELECT COUNT(*) FROM t").fetchone() == (0,)
+            with pytest.raises(sqlite3.OperationalError, match="locked"):
+                other.execute("BEGIN IMMEDIATE")
+            db.execute(text("INSERT INTO t VALUES (1)"))
+            db.commit()
+            other.execute("BEGIN IMMEDIATE")
+            other.rollback()
+        finally:
+            other.close()
+            db.close()
+    finally:
+        engine.dispose()
@@ -0,0 +1,103 @@
+import pytest
+from sqlalchemy import inspect
+
+from database import create_database_engine
+from db_migration import MIGRATIONS, applied_versions, downgrade, model_indexes, upgrade
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_database_engine(f"sqlite:///{tmp_path}/app.db")
+    yield engine
+    engine.dispose()
+
+
+def _index_names(engine):
+    inspector = inspect(engine)
+    return {index["name"] for table in inspector.get_table_names() for index in inspector.get_indexes(table)}
+
+
+def test_upgrade_applies_all_and_is_idempotent(engine):
+    assert upgrade(engine) == [m.version for m in MIGRATIONS]
+    assert applied_versions(engine) == [m.version for m in MIGRATIONS]
+    assert {name for name, _, _ in model_indexes()} <= _index_names(engine)
+    assert upgrade(engine) == []
+
+
+def test_model_indexes_declared():
+    indexes = {(table, columns) for _, table, columns in model_indexes()}
+    assert ("food_loss_records", ("user_id", "record_date")) in indexes
+    assert ("arrange_suggest", ("user_id",)) in indexes
+
+
+def test_upgrade_adopts_legacy_database(engine):
+    # マイグレーション導入前に init_db と旧 add_indexes で作成された DB
+    from models import Base
+
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("DROP INDEX idx_food_loss_records_user_date")
+        connection.exec_driver_sql("CREATE INDEX idx_food_loss_user_id ON food_loss_records(user_id)")
+    upgrade(engine)
+    names = _index_names(engine)
+    assert "idx_food_loss_records_user_date" in names
+    assert "idx_food_loss_user_id" not in names
+
+
+def test_downgrade_reverts_in_order(engine):
+    upgrade(engine)
+    assert downgrade(engine, "0001") == ["0006", "0005", "0004", "0003", "0002"]
+    assert "idx_food_loss_records_user_date" not in _index_names(engine)
+    assert applied_versions(engine) == ["0001"]
+    assert downgrade(engine, "0000") == ["0001"]
+    assert "users" not in inspect(engine).get_table_names()
+
+
+def _count(engine, table):
+    with engine.connect() as connection:
+        return connection.exec_driver_sql(f"SELECT COUNT(*) FROM {table}").scalar()
+
+
+@pytest.fixture
+def source_engine(tmp_path):
+    from synthetic_data import SyntheticDataGenerator, load_synthetic_data
+
+    engine = create_database_engine(f"sqlite:///{tmp_path}/source.db")
+    upgrade(engine)
+    load_synthetic_data(engine, SyntheticDataGenerator(4, 3, records_per_week=10, seed=7))
+    yield engine
+    engine.dispose()
+
+
+def test_migrate_data_preserves_ids_and_resumes(source_engine, engine, monkeypatch):
+    import db_migration
+
+    original = db_migration._insert_ignoring_conflicts
+    calls = {"n": 0}
+
+    def failing_insert(conn, table, rows):
+        calls["n"] += 1
+        if table.name == "food_loss_records" and calls["n"] == 5:
+            raise RuntimeError("接続断")
+        return original(conn, table, rows)
+
+    monkeypatch.setattr(db_migration, "_insert_ignoring_conflicts", failing_insert)
+    with pytest.raises(RuntimeError):
+        db_migration.migrate_data(source_engine, engine, "source", chunk_size=20)
+    partial = _count(engine, "food_loss_records")
+    assert 0 < partial < _count(source_engine, "food_loss_records")
+
+    result = db_migration.migrate_data(source_engine, engine, "source", chunk_size=20)
+    records = result["tables"]["food_loss_records"]
+    assert records["rows_read"] == _count(source_engine, "food_loss_records")
+    assert records["rows_skipped"] == 0
+    # 廃棄理由は upgrade で同じ ID の初期データが入っているため、すべて重複としてスキップされる
+    assert result["tables"]["loss_reasons"]["rows_inserted"] == 0
+
+    with source_engine.connect() as s, engine.connect() as t:
+        query = "SELECT id, user_id, weight_grams, record_date FROM food_loss_records ORDER BY id"
+        assert s.exec_driver_sql(query).all() == t.exec_driver_sql(query).all()
+
+    # 移行済みのため、再実行しても何も読み込まない
+    again = db_migration.migrate_data(source_engine, engine, "source", chunk_size=20)
+    assert again["rows_per_second"] == 0.0
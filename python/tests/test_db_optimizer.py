@@ -0,0 +1,53 @@
+import pytest
+
+from database import create_database_engine
+from db_migration import upgrade
+from db_optimizer import DatabaseOptimizer, _sqlite_full_scan_table
+from models import DailyLossSummary
+from synthetic_data import SyntheticDataGenerator, load_synthetic_data
+
+
+@pytest.fixture
+def optimizer(tmp_path):
+    engine = create_database_engine(f"sqlite:///{tmp_path}/app.db")
+    # インデックスを作成する前（0001）の状態に、旧 add_indexes のインデックスがある DB
+    upgrade(engine, target="0001")
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE INDEX idx_food_loss_user_id ON food_loss_records(user_id)")
+    # final_report は保管した記録の集計（0004）も参照する
+    DailyLossSummary.__table__.create(engine)
+    load_synthetic_data(engine, SyntheticDataGenerator(5, 4, records_per_week=10, seed=1))
+    yield DatabaseOptimizer(engine=engine)
+    engine.dispose()
+
+
+def test_sqlite_full_scan_table():
+    assert _sqlite_full_scan_table("SCAN food_loss_records") == "food_loss_records"
+    assert _sqlite_full_scan_table("SCAN TABLE users") == "users"
+    assert _sqlite_full_scan_table("SEARCH users USING INTEGER PRIMARY KEY (rowid=?)") is None
+    assert _sqlite_full_scan_table("SCAN users USING COVERING INDEX idx_users_total_points") is None
+
+
+def test_explain_hot_queries_covers_each_source(optimizer):
+    results = optimizer.explain_hot_queries()
+    sources = {result["source"] for result in results}
+    assert "statistics.calculate_weekly_statistics" in sources
+    assert "final_report.get_top_performers" in sources
+    assert all(result["plan"] for result in results)
+
+
+def test_optimize_indexes_creates_missing_once(optimizer):
+    statements = optimizer.optimize_indexes(apply=False)
+    assert any("idx_food_loss_records_user_date" in s for s in statements)
+
+    optimizer.optimize_indexes(apply=True)
+    assert optimizer.missing_indexes() == []
+    assert optimizer.optimize_indexes(apply=True) == []
+    # (user_id) は (user_id, record_date) の先頭と一致するため不要になる
+    assert {"table": "food_loss_records", "name": "idx_food_loss_user_id",
+            "covered_by": "idx_food_loss_records_user_date"} in optimizer.redundant_indexes()
+
+
+def test_update_statistics_sqlite(optimizer):
+    done = optimizer.update_statistics(force=True)
+    assert done == {"vacuum": ["*"], "analyze": ["*"]}
@@ -0,0 +1,40 @@
+import pytest
+
+from load_test import LatencyHistogram, find_saturation_point
+
+
+def test_histogram_percentiles_within_precision():
+    histogram = LatencyHistogram()
+    for value in range(1, 10001):
+        histogram.record(value)
+    assert histogram.total == 10000
+    assert histogram.value_at_percentile(50) == pytest.approx(5000, rel=0.02)
+    assert histogram.value_at_percentile(99) == pytest.approx(9900, rel=0.02)
+    assert histogram.value_at_percentile(100) == 10000
+
+
+def test_histogram_merge():
+    a, b = LatencyHistogram(), LatencyHistogram()
+    a.record(100)
+    b.record(300000)
+    a.merge(b)
+    assert a.total == 2
+    assert a.max_us == 300000
+    assert a.value_at_percentile(50) == 100
+
+
+def _sweep_result(rate, p99_ms, errors=0, dropped=0):
+    return {
+        "offered_rate": rate,
+        "requests": 100,
+        "error_count": errors,
+        "sessions_dropped": dropped,
+        "response_time": {"p99_ms": p99_ms},
+    }
+
+
+def test_find_saturation_point():
+    results = [_sweep_result(1, 50), _sweep_result(5, 80), _sweep_result(10, 900)]
+    assert find_saturation_point(results, slo_ms=500) == 10
+    assert find_saturation_point(results[:2], slo_ms=500) is None
+    assert find_saturation_point([_sweep_result(2, 10, errors=5)], slo_ms=500) == 2
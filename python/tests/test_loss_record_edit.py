@@ -0,0 +1,140 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+import clock
+import points_ledger
+from app import app
+from models import FoodLossRecord, PointsLedger, User
+from services import add_loss_record_with_points, delete_loss_record, update_loss_record
+from user_counters import compute_counters
+
+NOW = datetime(2026, 10, 14, 10, 0)
+
+
+@pytest.fixture
+def records(db):
+    """(ユーザー, 先週の記録の ID, 今週の記録の ID)"""
+    unique = f"edit_{uuid.uuid4().hex[:8]}"
+    u = User(username=unique, password="x", email=f"{unique}@example.com")
+    db.add(u)
+    db.commit()
+    # 先週の最初の記録で初回ポイント、今週は先週比 50% 減で 5 ポイント（各週とも毎日のボーナスあり）
+    with clock.use_clock(lambda: NOW - timedelta(days=7)):
+        last_week, _ = add_loss_record_with_points(
+            db, {"user_id": u.id, "item_name": "牛乳", "weight_grams": 600, "reason_text": "期限切れ"}
+        )
+    with clock.use_clock(lambda: NOW):
+        this_week, result = add_loss_record_with_points(
+            db, {"user_id": u.id, "item_name": "カレー", "weight_grams": 300, "reason_text": "食べ残し"}
+        )
+    assert result["points_added"] == 5 + 1
+    return u, last_week, this_week
+
+
+def _weekly_points(db, user_id, week_start):
+    return sum(
+        entry.points for entry in db.query(PointsLedger).filter(
+            PointsLedger.user_id == user_id,
+            PointsLedger.entry_type.in_((points_ledger.WEEKLY_AWARD, points_ledger.WEEKLY_ADJUSTMENT)),
+            PointsLedger.reference == week_start,
+        )
+    )
+
+
+def _assert_counters_match(db, user_id):
+    user = db.get(User, user_id, populate_existing=True)
+    expected = compute_counters(db, [user_id])[user_id]
+    assert (user.record_count, user.first_record_date, user.last_record_date, user.participation_days) == (
+        expected["record_count"], expected["first_record_date"], expected["last_record_date"], expected["participation_days"],
+    )
+    assert user.total_grams == pytest.approx(expected["total_grams"])
+    return user
+
+
+def test_edit_and_delete_adjust_counters_and_settled_weeks(db, records):
+    user, last_week_id, this_week_id = records
+    with clock.use_clock(lambda: NOW + timedelta(hours=1)):
+        # 540g にすると先週比 10% 減で 1 ポイント
+        result = update_loss_record(db, user.id, this_week_id, {"weight_grams": 540, "reason_text": "期限切れ"})
+        assert result["points_adjusted"] == 1 - 5
+        assert result["record"]["reason"] == "期限切れ"
+        assert _weekly_points(db, user.id, "2026-10-12") == 1
+        assert _assert_counters_match(db, user.id).total_grams == pytest.approx(1140)
+
+        # 品目名だけの変更ではポイントは変わらない
+        assert update_loss_record(db, user.id, this_week_id, {"item_name": "シチュー"})["points_adjusted"] == 0
+
+        # 先週の唯一の記録を削除すると、その週の初回ポイントは取り消される
+        assert delete_loss_record(db, user.id, last_week_id)["points_adjusted"] == -10
+        assert _weekly_points(db, user.id, "2026-10-05") == 0
+        # 先週の記録がなくなったため、今週は初回の週として計算し直す
+        assert update_loss_record(db, user.id, this_week_id, {"weight_grams": 500})["points_adjusted"] == 10 - 1
+
+    refreshed = _assert_counters_match(db, user.id)
+    assert (refreshed.record_count, refreshed.first_record_date, refreshed.participation_days) == (1, "2026-10-14", 1)
+    # 毎日のボーナス 2 回と、今週の 10 ポイント
+    assert refreshed.total_points == 2 + 10
+    assert points_ledger.reconcile(db) == []
+
+
+def test_deduction_is_capped_at_redeemed_balance(db, records):
+    user, last_week_id, this_week_id = records
+    # 先週 10 + 今週 5 + 毎日のボーナス 2 のうち 15 ポイントを交換済み
+    assert points_ledger.redeem(db, user.id, 15, "エコバッグ") is not None
+    db.commit()
+    with clock.use_clock(lambda: NOW + timedelta(hours=1)):
+        # 先週の初回ポイント 10 を取り消すが、残高の 2 ポイントまでしか差し引かない
+        assert delete_loss_record(db, user.id, last_week_id)["points_adjusted"] == -2
+    assert db.get(User, user.id, populate_existing=True).total_points == 0
+    assert _weekly_points(db, user.id, "2026-10-05") == 8
+    assert points_ledger.reconcile(db) == []
+
+
+def test_edit_rescores_only_the_records_present_at_the_award(db):
+    unique = f"edit_{uuid.uuid4().hex[:8]}"
+    u = User(username=unique, password="x", email=f"{unique}@example.com")
+    db.add(u)
+    db.flush()
+    # 過去4週間は毎週 1000g
+    for day in ("2026-09-02", "2026-09-09", "2026-09-16", "2026-09-23"):
+        db.add(FoodLossRecord(user_id=u.id, item_name="ご飯", weight_grams=1000, loss_reason_id=1, record_date=f"{day}T09:00:00"))
+    db.commit()
+    entry = {"user_id": u.id, "item_name": "牛乳", "reason_text": "期限切れ"}
+    with clock.use_clock(lambda: datetime(2026, 9, 29, 10, 0)):
+        # 先週比・ベースライン比とも 85% 減で 8 ポイント
+        record, result = add_loss_record_with_points(db, dict(entry, weight_grams=150))
+        assert result["points_added"] == 8 + 1
+    with clock.use_clock(lambda: datetime(2026, 9, 30, 10, 0)):
+        # 付与の後に追加した記録は、その週の評価に含めない
+        add_loss_record_with_points(db, dict(entry, weight_grams=2000))
+    balance = db.get(User, u.id, populate_existing=True).total_points
+    with clock.use_clock(lambda: datetime(2026, 10, 1, 10, 0)):
+        assert update_loss_record(db, u.id, record, {"weight_grams": 151})["points_adjusted"] == 0
+    assert _weekly_points(db, u.id, "2026-09-28") == 8
+    assert db.get(User, u.id, populate_existing=True).total_points == balance
+
+
+def test_record_api(db, records):
+    user, last_week_id, this_week_id = records
+    with app.test_client() as client:
+        assert client.delete(f"/api/loss_records/{this_week_id}").status_code == 401
+        with client.session_transaction() as sess:
+            sess["user_id"] = user.id
+
+        response = client.patch(f"/api/loss_records/{this_week_id}", json={"weight_grams": -1})
+        assert response.status_code == 422
+        response = client.patch(f"/api/loss_records/{this_week_id}", json={"record_date": "2026-01-01"})
+        assert response.status_code == 422
+        response = client.patch(f"/api/loss_records/{this_week_id}", json={"item_name": "シチュー"})
+        assert response.status_code == 200
+        assert response.get_json()["record"]["dish_name"] == "シチュー"
+
+        assert client.delete(f"/api/loss_records/{this_week_id}").status_code == 200
+        assert client.delete(f"/api/loss_records/{this_week_id}").status_code == 404
+
+        # 他のユーザーの記録は見つからない扱い
+        with client.session_transaction() as sess:
+            sess["user_id"] = user.id + 1000
+        assert client.patch(f"/api/loss_records/{last_week_id}", json={"item_name": "x"}).status_code == 404
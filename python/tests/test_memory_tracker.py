@@ -0,0 +1,54 @@
+import os
+
+import pytest
+from flask import Flask
+
+import memory_tracker
+from app import app
+from memory_tracker import MemoryTracker, setup_memory_tracking
+from metrics import PROCESS_RSS
+
+
+@pytest.fixture
+def tracker():
+    tracker = MemoryTracker(frames=1)
+    yield tracker
+    tracker.stop()
+
+
+def test_snapshot_report_diffs_against_previous_snapshot(tracker):
+    first = tracker.snapshot_report()
+    assert first["tracing"] and "top_growth" not in first
+
+    retained = [bytearray(1024) for _ in range(2000)]
+    report = tracker.snapshot_report(limit=50, key_type="filename")
+    growth = {item["location"].rsplit(":", 1)[0]: item for item in report["top_growth"]}
+    assert growth[__file__]["size_diff_kb"] >= 2000
+    assert len(report["top_allocations"]) <= 50
+
+    # 次の差分は直前のスナップショットが基準になる
+    report = tracker.snapshot_report(limit=50, key_type="filename")
+    growth = {item["location"].rsplit(":", 1)[0]: item for item in report["top_growth"]}
+    assert __file__ not in growth or growth[__file__]["size_diff_kb"] < 100
+    del retained
+
+
+def test_rss_gauge_is_updated_after_requests():
+    test_app = Flask("test_memory")
+    setup_memory_tracking(test_app)
+    test_app.add_url_rule("/ping", "ping", lambda: "ok")
+    with test_app.test_client() as client:
+        assert client.get("/ping").status_code == 200
+    rss = {key: value for key, value in PROCESS_RSS.dump().items() if str(os.getpid()) in key}
+    assert list(rss.values())[0] == pytest.approx(memory_tracker.get_rss_bytes(), rel=0.5)
+
+
+def test_snapshot_endpoint_validates_limit(monkeypatch, tracker):
+    monkeypatch.setenv("ADMIN_TOKEN", "admin-secret")
+    monkeypatch.setattr(memory_tracker, "_tracker", tracker)
+    headers = {"X-Admin-Token": "admin-secret"}
+    with app.test_client() as client:
+        for limit in ("many", 0, None, [1]):
+            response = client.post("/admin/memory/snapshot", json={"limit": limit}, headers=headers)
+            assert response.status_code == 400
+        assert client.post("/admin/memory/snapshot", json={"limit": 5}, headers=headers).status_code == 200
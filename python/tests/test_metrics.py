@@ -0,0 +1,85 @@
+import json
+import os
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+from database import create_database_engine
+from metrics import POOL_WAIT, MetricsRegistry, install_pool_wait_listener
+
+
+def make_registry(directory):
+    registry = MetricsRegistry(str(directory))
+    requests = registry.counter("requests_total", "リクエスト数", ("status",))
+    latency = registry.histogram("latency_seconds", "処理時間", buckets=(0.1, 1.0))
+    rss = registry.gauge("rss_bytes", "RSS")
+    return registry, requests, latency, rss
+
+
+def write_worker(directory, pid, registry):
+    with open(os.path.join(directory, f"metrics_{pid}.json"), "w", encoding="utf-8") as f:
+        json.dump(registry.snapshot(), f)
+
+
+def test_counter_histogram_and_gauge_aggregate_across_workers(tmp_path):
+    # 別のワーカー（pid 1001）が書き出した値
+    other, requests, latency, rss = make_registry(tmp_path / "other")
+    requests.inc(status=200)
+    requests.inc(3, status=500)
+    latency.observe(0.05)
+    latency.observe(5.0)
+    rss._values[(("pid", "1001"),)] = 100.0
+    write_worker(tmp_path, 1001, other)
+
+    registry, requests, latency, rss = make_registry(tmp_path)
+    requests.inc(2, status=200)
+    latency.observe(0.5)
+    rss.set(200)
+
+    output = registry.render_prometheus()
+    assert "# TYPE requests_total counter" in output
+    assert 'requests_total{status="200"} 3' in output
+    assert 'requests_total{status="500"} 3' in output
+    assert 'latency_seconds_bucket{le="0.1"} 1' in output
+    assert 'latency_seconds_bucket{le="1"} 2' in output
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in output
+    assert "latency_seconds_sum 5.55" in output
+    assert "latency_seconds_count 3" in output
+    assert 'rss_bytes{pid="1001"} 100' in output
+    assert f'rss_bytes{{pid="{os.getpid()}"}} 200' in output
+
+    # 終了したワーカーのカウンター・ヒストグラムはアーカイブに残し、ゲージは捨てる
+    registry.mark_process_dead(1001)
+    assert not (tmp_path / "metrics_1001.json").exists()
+    output = registry.render_prometheus()
+    assert 'requests_total{status="200"} 3' in output
+    assert "latency_seconds_count 3" in output
+    assert 'pid="1001"' not in output
+
+
+def test_pool_wait_listener_is_installed_once():
+    engine = create_engine("sqlite://", poolclass=NullPool)
+    install_pool_wait_listener(engine)
+    install_pool_wait_listener(engine)
+    assert len(engine.dialect.dispatch.do_connect) == 1
+
+    before = sum(sum(series[:-1]) for series in POOL_WAIT._values.values())
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    after = sum(sum(series[:-1]) for series in POOL_WAIT._values.values())
+    assert after - before == 1
+
+
+def test_replica_and_shard_engines_record_pool_wait(tmp_path):
+    # レプリカ・シャードのエンジンも create_database_engine で作られる
+    engines = [
+        create_database_engine(f"sqlite:///{tmp_path}/replica.db"),
+        create_database_engine(f"sqlite:///{tmp_path}/shard1.db"),
+    ]
+    before = sum(sum(series[:-1]) for series in POOL_WAIT._values.values())
+    for engine in engines:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        engine.dispose()
+    after = sum(sum(series[:-1]) for series in POOL_WAIT._values.values())
+    assert after - before == len(engines)
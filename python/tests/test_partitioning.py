@@ -0,0 +1,77 @@
+import pytest
+from sqlalchemy import func, inspect
+from sqlalchemy.orm import Session
+
+from database import create_database_engine
+from db_migration import upgrade
+from final_report import FinalReportGenerator
+from models import DailyLossSummary, FoodLossRecord
+from partitioning import (
+    add_months,
+    benchmark_pruning,
+    detach_old_months,
+    detachable_months,
+    ensure_partitions,
+    list_partitions,
+    month_bounds,
+    partition_month,
+    partition_name,
+)
+from synthetic_data import SyntheticDataGenerator, load_synthetic_data
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_database_engine(f"sqlite:///{tmp_path}/app.db")
+    upgrade(engine)
+    load_synthetic_data(engine, SyntheticDataGenerator(10, 30, records_per_week=5, seed=5))
+    yield engine
+    engine.dispose()
+
+
+def test_month_helpers():
+    assert add_months("2026-11", 2) == "2027-01"
+    assert add_months("2026-01", -1) == "2025-12"
+    assert month_bounds("2026-12") == ("2026-12", "2027-01")
+    assert partition_month(partition_name("2026-03")) == "2026-03"
+    assert partition_month("food_loss_records_default") is None
+    # ISO 8601 の record_date は月の境界の文字列の間に入る
+    lower, upper = month_bounds("2026-10")
+    assert lower <= "2026-10-01T00:00:00" < "2026-10-31T23:59:59" < upper
+
+
+def test_detach_moves_old_months_and_keeps_report(engine):
+    with engine.begin() as conn:
+        assert ensure_partitions(conn) == []
+        months = detachable_months(conn, horizon_weeks=9)
+    assert months
+
+    with Session(engine) as db:
+        before = FinalReportGenerator(db).generate_complete_report()
+        total = db.query(func.count(FoodLossRecord.id)).scalar()
+
+        detached = detach_old_months(db, horizon_weeks=9)
+        assert list(detached) == months
+        assert db.query(func.sum(DailyLossSummary.record_count)).scalar() == sum(detached.values())
+        assert db.query(func.count(FoodLossRecord.id)).scalar() == total - sum(detached.values())
+        # 保管期間の最初の月より前の記録は残らない
+        assert db.query(func.min(FoodLossRecord.record_date)).scalar() >= add_months(months[-1], 1)
+
+        after = FinalReportGenerator(db).generate_complete_report()
+        for section in ("user_statistics", "reason_analysis", "timeline_analysis", "overall_summary"):
+            assert after[section] == before[section]
+        assert detach_old_months(db, horizon_weeks=9) == {}
+
+    with engine.connect() as conn:
+        assert list_partitions(conn) == [partition_name(month) for month in months]
+        assert partition_name(months[0]) in inspect(engine).get_table_names()
+
+
+def test_benchmark_reports_both_runs(engine):
+    result = benchmark_pruning(engine, sample_users=3)
+    assert result["backend"] == "sqlite"
+    assert result["detached_months"] > 0
+    assert result["hot_records"] < result["records"]
+    assert set(result["before"]) == set(result["after"]) == {
+        "calculate_weekly_statistics", "get_total_grams_for_weeks", "get_last_two_weeks",
+    }
@@ -0,0 +1,106 @@
+import threading
+import uuid
+
+from sqlalchemy.orm import Session
+
+import points_ledger
+from app import app
+from database import begin_write, create_database_engine
+from db_migration import upgrade
+from models import PointsLedger, User
+
+
+def create_user(db, total_points=0):
+    unique = f"ledger_{uuid.uuid4().hex[:8]}"
+    u = User(username=unique, password="x", email=f"{unique}@example.com", total_points=total_points)
+    db.add(u)
+    db.commit()
+    db.refresh(u)
+    return u
+
+
+def test_credit_is_idempotent_per_key(db):
+    user = create_user(db)
+    assert points_ledger.credit(db, user.id, 3, points_ledger.WEEKLY_AWARD, idempotency_key="week:2026-10-12")
+    assert points_ledger.credit(db, user.id, 3, points_ledger.WEEKLY_AWARD, idempotency_key="week:2026-10-12") is None
+    db.commit()
+    assert db.get(User, user.id).total_points == 3
+    assert points_ledger.reconcile(db) == []
+
+
+def test_redeem_never_overdraws_and_history_pages(db):
+    user = create_user(db)
+    points_ledger.credit(db, user.id, 10, points_ledger.ADJUSTMENT)
+    assert points_ledger.redeem(db, user.id, 4, "エコバッグ").balance_after == 6
+    assert points_ledger.redeem(db, user.id, 7, "リサイクルボックス") is None
+    assert points_ledger.redeem(db, user.id, 6, "エコバッグ").balance_after == 0
+    db.commit()
+
+    first = points_ledger.get_history(db, user.id, limit=2)
+    assert [e["points"] for e in first] == [-6, -4]
+    rest = points_ledger.get_history(db, user.id, limit=2, before_id=first[-1]["id"])
+    assert [(e["entry_type"], e["points"]) for e in rest] == [(points_ledger.ADJUSTMENT, 10)]
+
+
+def test_reconcile_detects_and_fixes_drift(db):
+    user = create_user(db)
+    points_ledger.credit(db, user.id, 5, points_ledger.ADJUSTMENT)
+    user.total_points = 50  # 台帳を通さない更新
+    db.commit()
+
+    assert points_ledger.reconcile(db) == [{"user_id": user.id, "cached": 50, "ledger": 5}]
+    points_ledger.reconcile(db, fix=True)
+    assert db.get(User, user.id).total_points == 5
+    assert points_ledger.reconcile(db) == []
+
+
+def test_history_api(db):
+    user = create_user(db)
+    points_ledger.credit(db, user.id, 600, points_ledger.ADJUSTMENT)
+    db.commit()
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess["user_id"] = user.id
+        assert client.post("/api/redeem", json={"item_name": "エコバッグ", "cost": 500}).status_code == 200
+
+        data = client.get("/api/points/history?limit=1").get_json()
+        assert [(e["entry_type"], e["points"], e["reference"]) for e in data["entries"]] == [
+            (points_ledger.REDEMPTION, -500, "エコバッグ")
+        ]
+        data = client.get(f"/api/points/history?before={data['next_before']}").get_json()
+        assert [e["balance_after"] for e in data["entries"]] == [600]
+        assert data["next_before"] is None
+
+
+def test_concurrent_redemptions_do_not_overdraw(tmp_path):
+    engine = create_database_engine(f"sqlite:///{tmp_path}/app.db")
+    upgrade(engine)
+    with Session(engine) as db:
+        user = create_user(db)
+        points_ledger.credit(db, user.id, 100, points_ledger.ADJUSTMENT)
+        db.commit()
+        user_id = user.id
+
+    results = []
+    barrier = threading.Barrier(8)
+
+    def worker():
+        with Session(engine) as db:
+            barrier.wait()
+            begin_write(db)
+            entry = points_ledger.redeem(db, user_id, 30, "エコバッグ")
+            db.commit()
+            results.append(entry is not None)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with Session(engine) as db:
+        assert results.count(True) == 3
+        assert db.get(User, user_id).total_points == 10
+        assert db.query(PointsLedger).filter_by(user_id=user_id).count() == 4
+        assert points_ledger.reconcile(db) == []
+    engine.dispose()
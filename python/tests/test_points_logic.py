@@ -1,18 +1,9 @@
-import pytest
-from database import SessionLocal
 from models import User
-import python.services as services
+import services
 import uuid
 
-
-@pytest.fixture
-def db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
+# 毎日最初の入力には週次の削減ポイントとは別に DAILY_BONUS_POINTS が加算される
+BONUS = services.DAILY_BONUS_POINTS
 
 def create_user(db, username="test_user"):
     unique = f"{username}_{uuid.uuid4().hex[:8]}"
@@ -23,29 +14,17 @@ def create_user(db, username="test_user"):
     return u
 
 
-def remove_user(db, user_id):
-    u = db.query(User).get(user_id)
-    if u:
-        db.delete(u)
-        db.commit()
-
-
 def test_no_reduction_returns_zero(db, monkeypatch):
     user = create_user(db, "p_test1")
 
     # Simulate last_week=100, this_week=100, baseline irrelevant
     monkeypatch.setattr(services, "get_last_two_weeks", lambda _db, uid: (100.0, 100.0))
-    monkeypatch.setattr(
-        services, "get_total_grams_for_weeks", lambda _db, uid, weeks_ago=4: 400.0
-    )
 
     result = services.calculate_weekly_points_logic(db, user.id)
 
-    assert result["points_added"] == 0
+    assert result["points_added"] == BONUS
     refreshed = db.query(User).get(user.id)
-    assert refreshed.total_points == 0
-
-    remove_user(db, user.id)
+    assert refreshed.total_points == BONUS
 
 
 def test_25_percent_reduction_gives_2_points(db, monkeypatch):
@@ -53,17 +32,12 @@ def test_25_percent_reduction_gives_2_points(db, monkeypatch):
 
     # last_week=100, this_week=75 => 25% reduction => 2 points
     monkeypatch.setattr(services, "get_last_two_weeks", lambda _db, uid: (100.0, 75.0))
-    monkeypatch.setattr(
-        services, "get_total_grams_for_weeks", lambda _db, uid, weeks_ago=4: 400.0
-    )
 
     result = services.calculate_weekly_points_logic(db, user.id)
 
-    assert result["points_added"] == 2
+    assert result["points_added"] == 2 + BONUS
     refreshed = db.query(User).get(user.id)
-    assert refreshed.total_points == 2
-
-    remove_user(db, user.id)
+    assert refreshed.total_points == 2 + BONUS
 
 
 def test_baseline_limits_the_rate(db, monkeypatch):
@@ -71,19 +45,19 @@ def test_baseline_limits_the_rate(db, monkeypatch):
 
     # last_week small reduction (20%), but baseline indicates larger possible (60%)
     monkeypatch.setattr(services, "get_last_two_weeks", lambda _db, uid: (100.0, 80.0))
-    # past_4_weeks_total=800 -> baseline=200 -> rate_baseline = (200-80)/200 = 0.6
+    # 4 past weeks of 200 -> baseline=200 -> rate_baseline = (200-80)/200 = 0.6
     monkeypatch.setattr(
-        services, "get_total_grams_for_weeks", lambda _db, uid, weeks_ago=4: 800.0
+        services,
+        "get_rolling_weekly_totals",
+        lambda _db, uid, weeks: [80.0] + [200.0] * 4 + [0.0] * (weeks - 5),
     )
 
     result = services.calculate_weekly_points_logic(db, user.id)
 
     # final_rate = min(0.2, 0.6) = 0.2 => 20% => 2 points
-    assert result["points_added"] == 2
+    assert result["points_added"] == 2 + BONUS
     refreshed = db.query(User).get(user.id)
-    assert refreshed.total_points == 2
-
-    remove_user(db, user.id)
+    assert refreshed.total_points == 2 + BONUS
 
 
 def test_baseline_and_last_week_zero_and_this_week_zero(db, monkeypatch):
@@ -91,34 +65,26 @@ def test_baseline_and_last_week_zero_and_this_week_zero(db, monkeypatch):
 
     # both last_week and baseline are zero, this_week is zero -> no points
     monkeypatch.setattr(services, "get_last_two_weeks", lambda _db, uid: (0.0, 0.0))
-    monkeypatch.setattr(
-        services, "get_total_grams_for_weeks", lambda _db, uid, weeks_ago=4: 0.0
-    )
 
     result = services.calculate_weekly_points_logic(db, user.id)
 
-    assert result["points_added"] == 0
+    assert result["points_added"] == BONUS
     refreshed = db.query(User).get(user.id)
-    assert refreshed.total_points == 0
+    assert refreshed.total_points == BONUS
     assert refreshed.last_points_awarded_week_start is not None
 
-    remove_user(db, user.id)
-
 
 def test_onboarding_awarded_for_first_week(db, monkeypatch):
     user = create_user(db, "p_onboard")
 
     # first week: last_week=0, baseline=0, but this_week >= MIN_RECORD_WEIGHT
     monkeypatch.setattr(services, "get_last_two_weeks", lambda _db, uid: (0.0, 120.0))
-    monkeypatch.setattr(
-        services, "get_total_grams_for_weeks", lambda _db, uid, weeks_ago=4: 0.0
-    )
 
     result = services.calculate_weekly_points_logic(db, user.id)
 
-    assert result["points_added"] == services.ONBOARDING_POINTS
+    assert result["points_added"] == services.ONBOARDING_POINTS + BONUS
     refreshed = db.query(User).get(user.id)
-    assert refreshed.total_points == services.ONBOARDING_POINTS
+    assert refreshed.total_points == services.ONBOARDING_POINTS + BONUS
     assert refreshed.last_points_awarded_week_start is not None
 
     # second run: should be idempotent
@@ -126,36 +92,24 @@ def test_onboarding_awarded_for_first_week(db, monkeypatch):
     assert result2["points_added"] == 0
     assert result2.get("message") == "already_awarded"
 
-    remove_user(db, user.id)
-
 
 def test_minimum_reduction_threshold(db, monkeypatch):
     # Case A: 4% reduction -> no points
     user_a = create_user(db, "p_threshold_a")
 
     monkeypatch.setattr(services, "get_last_two_weeks", lambda _db, uid: (100.0, 96.0))
-    monkeypatch.setattr(
-        services, "get_total_grams_for_weeks", lambda _db, uid, weeks_ago=4: 500.0
-    )
 
     result = services.calculate_weekly_points_logic(db, user_a.id)
-    assert result["points_added"] == 0
+    assert result["points_added"] == BONUS
     refreshed = db.query(User).get(user_a.id)
-    assert refreshed.total_points == 0
-
-    remove_user(db, user_a.id)
+    assert refreshed.total_points == BONUS
 
     # Case B: 5% reduction -> should award points
     user_b = create_user(db, "p_threshold_b")
     monkeypatch.setattr(services, "get_last_two_weeks", lambda _db, uid: (100.0, 95.0))
-    monkeypatch.setattr(
-        services, "get_total_grams_for_weeks", lambda _db, uid, weeks_ago=4: 500.0
-    )
 
     result2 = services.calculate_weekly_points_logic(db, user_b.id)
-    assert result2["points_added"] > 0
-
-    remove_user(db, user_b.id)
+    assert result2["points_added"] > BONUS
 
 
 def test_increase_results_in_no_points(db, monkeypatch):
@@ -163,15 +117,12 @@ def test_increase_results_in_no_points(db, monkeypatch):
 
     # last_week=100, this_week=150 => increase => negative reduction => no points
     monkeypatch.setattr(services, "get_last_two_weeks", lambda _db, uid: (100.0, 150.0))
-    monkeypatch.setattr(
-        services, "get_total_grams_for_weeks", lambda _db, uid, weeks_ago=4: 400.0
-    )
 
     result = services.calculate_weekly_points_logic(db, user.id)
 
-    assert result["points_added"] == 0
+    assert result["points_added"] == BONUS
     refreshed = db.query(User).get(user.id)
-    assert refreshed.total_points == 0
+    assert refreshed.total_points == BONUS
     assert refreshed.last_points_awarded_week_start is not None
 
     # 二回目実行しても付与されない（idempotency）
@@ -179,4 +130,49 @@ def test_increase_results_in_no_points(db, monkeypatch):
     assert result2["points_added"] == 0
     assert result2.get("message") == "already_awarded"
 
-    remove_user(db, user.id)
+
+def test_concurrent_inputs_award_once(tmp_path):
+    import threading
+    from datetime import datetime
+    from sqlalchemy.orm import Session
+
+    import clock
+    import points_ledger
+    from database import create_database_engine
+    from db_migration import upgrade
+    from models import FoodLossRecord, PointsLedger
+
+    engine = create_database_engine(f"sqlite:///{tmp_path}/app.db")
+    upgrade(engine)
+    with Session(engine) as db:
+        user_id = create_user(db, "p_concurrent").id
+
+    workers = 8
+    barrier = threading.Barrier(workers)
+    results = []
+
+    def post_input():
+        with Session(engine) as db:
+            barrier.wait()
+            _, result = services.add_loss_record_with_points(
+                db,
+                {"user_id": user_id, "item_name": "ご飯", "weight_grams": 120, "reason_text": "食べ残し"},
+            )
+            results.append(result)
+
+    with clock.use_clock(clock.FrozenClock(datetime(2026, 10, 14, 12, 0))):
+        threads = [threading.Thread(target=post_input) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    # 初回の入力だけが初回ボーナスと毎日のボーナスを受け取る
+    assert sorted(r["points_added"] for r in results) == [0] * (workers - 1) + [services.ONBOARDING_POINTS + BONUS]
+    with Session(engine) as db:
+        assert db.query(FoodLossRecord).filter_by(user_id=user_id).count() == workers
+        entries = db.query(PointsLedger).filter_by(user_id=user_id).all()
+        assert sorted(e.entry_type for e in entries) == [points_ledger.DAILY_BONUS, points_ledger.WEEKLY_AWARD]
+        assert db.get(User, user_id).total_points == services.ONBOARDING_POINTS + BONUS
+        assert points_ledger.reconcile(db) == []
+    engine.dispose()
@@ -0,0 +1,41 @@
+from datetime import datetime
+
+import clock
+from points_simulation import SimulationReport
+
+
+def test_use_clock_restores_previous_clock():
+    frozen = clock.FrozenClock(datetime(2025, 1, 6, 9, 0))
+    with clock.use_clock(frozen):
+        assert clock.now() == datetime(2025, 1, 6, 9, 0)
+        frozen.advance(days=1)
+        assert clock.today().isoformat() == "2025-01-07"
+    assert clock.now() != datetime(2025, 1, 7, 9, 0)
+
+
+def _result(points, daily_bonus=1, onboarding=False):
+    return {
+        "points_added": points,
+        "onboarding_applied": onboarding,
+        "calculation_details": {"daily_bonus": daily_bonus} if daily_bonus else {},
+    }
+
+
+def test_report_detects_double_weekly_award_and_point_mismatch():
+    report = SimulationReport()
+    report.record(1, "2025-01-06", 1, 0.004, 16, _result(11, onboarding=True))
+    report.record(1, "2025-01-06", 2, 0.004, 16, _result(0, daily_bonus=0))
+    report.record(2, "2025-01-06", 1, 0.004, 16, _result(3))
+    report.record(2, "2025-01-06", 2, 0.004, 16, _result(2))
+
+    violations = report.invariant_violations({1: 11, 2: 4})
+    assert len(violations) == 2
+    assert any("2 回付与" in v for v in violations)
+
+    distribution = report.point_distribution({1: 11, 2: 5})
+    assert distribution["buckets"]["10-19"] == 1
+    assert distribution["outcomes"]["onboarding"] == 1
+
+    week = report.weekly_summary()[0]
+    assert week["calls"] == 4
+    assert week["mean_queries"] == 16
@@ -0,0 +1,94 @@
+import json
+import logging
+
+from flask import Flask
+
+import production_logging
+from production_logging import (
+    AsyncLogPipeline,
+    BatchingRotatingFileHandler,
+    ProductionLogger,
+    setup_production_logging,
+)
+
+
+def test_pipeline_writes_batches_in_background(tmp_path):
+    pipeline = AsyncLogPipeline(queue_size=100, batch_size=10, flush_interval=0.05)
+    file_handler = BatchingRotatingFileHandler(tmp_path / "app.log", encoding="utf-8")
+    file_handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+
+    logger = logging.getLogger("test_pipeline_batches")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(pipeline.make_handler(file_handler))
+
+    for i in range(25):
+        logger.info("line %d", i)
+    pipeline.stop()
+
+    lines = (tmp_path / "app.log").read_text(encoding="utf-8").splitlines()
+    assert lines == [f"INFO line {i}" for i in range(25)]
+    assert pipeline.stats()["written"] == 25
+
+
+def test_pipeline_drops_when_queue_is_full_and_samples_info(tmp_path):
+    pipeline = AsyncLogPipeline(queue_size=3, batch_size=10, flush_interval=0.05)
+    # 書き込みスレッドを起動しないようにして、キューを溢れさせる
+    pipeline.start = lambda: None
+    pipeline._thread = object()
+    handler = pipeline.make_handler(logging.NullHandler())
+
+    logger = logging.getLogger("test_pipeline_drops")
+    logger.propagate = False
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    for _ in range(5):
+        logger.warning("x")
+    stats = pipeline.stats()
+    assert stats["enqueued"] == 3
+    assert stats["dropped"] == 2
+
+    handler.sample_rate = 0.0
+    logger.info("sampled out")
+    logger.error("always kept")
+    stats = pipeline.stats()
+    assert stats["sampled_out"] == 1
+    assert stats["dropped"] == 3
+    pipeline._thread = None
+
+
+def test_log_access_writes_json_lines(tmp_path):
+    # プロセス共通のパイプラインは止めない（他のテストのロガーが使う）
+    pipeline = AsyncLogPipeline(flush_interval=0.05)
+    manager = ProductionLogger(app_name="test_access", log_dir=str(tmp_path), pipeline=pipeline)
+    manager.log_access(1, "login", ip_address="127.0.0.1")
+    manager.log_performance("/input", 0.0123, user_id=1)
+    manager.pipeline.stop()
+
+    access = [json.loads(x) for x in open(manager.access_log_file, encoding="utf-8")]
+    perf = [json.loads(x) for x in open(manager.performance_log_file, encoding="utf-8")]
+    assert access[0]["action"] == "login"
+    assert perf[0]["duration_ms"] == 12.3
+
+
+def test_setup_routes_module_loggers_through_queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(production_logging, "LOG_INFO_SAMPLE_RATE", 0.0)
+    pipeline = AsyncLogPipeline(flush_interval=0.05)
+    root = logging.getLogger()
+    saved = (root.handlers[:], root.level)
+    try:
+        manager = setup_production_logging(Flask("test_app"), log_dir=str(tmp_path), pipeline=pipeline)
+        # app.py などのモジュールのロガーはルートロガー経由でキューに積まれる
+        module_logger = logging.getLogger("test_setup_module")
+        module_logger.info("sampled out")
+        module_logger.error("kept")
+        pipeline.stop()
+    finally:
+        root.handlers, level = saved
+        root.setLevel(level)
+        for name in ("foodloss_app", "foodloss_app_error", "foodloss_app.access", "foodloss_app.performance"):
+            logging.getLogger(name).handlers = []
+
+    assert pipeline.stats()["sampled_out"] == 1
+    assert "kept" in open(manager.app_log_file, encoding="utf-8").read()
+    assert "kept" in open(manager.error_log_file, encoding="utf-8").read()
@@ -0,0 +1,44 @@
+import pytest
+
+import profiler
+from app import app
+from profiler import ProfilerConfig, make_profile_token, verify_profile_token
+
+
+def test_profile_token_is_signed_and_expires(monkeypatch):
+    token = make_profile_token("secret")
+    assert verify_profile_token("secret", token)
+    assert not verify_profile_token("other-secret", token)
+    assert not verify_profile_token("secret", token[:-2] + "xx")
+
+    monkeypatch.setattr(profiler, "PROFILE_TOKEN_MAX_AGE", -1)
+    assert not verify_profile_token("secret", token)
+
+
+def test_config_accepts_only_json_booleans_and_syncs_workers(tmp_path):
+    config = ProfilerConfig(str(tmp_path))
+    config.update({"enabled": True, "sample_rate": 2, "slow_ms": "250"})
+    assert config.to_dict() == {"enabled": True, "sample_rate": 1.0, "slow_ms": 250.0}
+
+    # 不正な値は何も変更しない
+    for data in ({"enabled": "false"}, {"enabled": 0}, {"sample_rate": "x"}, ["enabled"]):
+        with pytest.raises((TypeError, ValueError)):
+            config.update(data)
+    assert config.to_dict() == {"enabled": True, "sample_rate": 1.0, "slow_ms": 250.0}
+
+    # 別のワーカーは control.json から取り込む
+    other = ProfilerConfig(str(tmp_path))
+    other.refresh()
+    assert other.to_dict() == config.to_dict()
+
+
+def test_admin_rejects_invalid_profiling_config(tmp_path, monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "admin-secret")
+    monkeypatch.setattr(profiler, "_config", ProfilerConfig(str(tmp_path)))
+    headers = {"X-Admin-Token": "admin-secret"}
+    with app.test_client() as client:
+        response = client.post("/admin/profiling", json={"enabled": "false"}, headers=headers)
+        assert response.status_code == 400
+        response = client.post("/admin/profiling", json={"enabled": False, "slow_ms": 100}, headers=headers)
+        assert response.status_code == 200
+        assert response.get_json()["slow_ms"] == 100.0
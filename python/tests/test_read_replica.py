@@ -0,0 +1,65 @@
+import time
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+import database
+from app import app
+from database import ReplicaRouter, create_database_engine
+from models import Base, User
+
+
+@pytest.fixture
+def replica(tmp_path):
+    engine = create_database_engine(f"sqlite:///{tmp_path}/replica.db")
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+def test_router_sticks_to_primary_after_write(replica):
+    router = ReplicaRouter(replica, sticky_seconds=5)
+    assert router.engine_for_read() is replica
+    assert router.engine_for_read(last_write_at=time.time() - 1) is None
+    assert router.engine_for_read(last_write_at=time.time() - 10) is replica
+    assert ReplicaRouter(None).engine_for_read() is None
+
+
+def test_router_falls_back_when_replica_is_unreachable(tmp_path, replica):
+    broken = create_engine(f"sqlite:///{tmp_path}/missing/replica.db")
+    router = ReplicaRouter(broken, check_interval=60)
+    assert router.engine_for_read() is None
+    assert router.lag is None
+
+    # クエリの失敗（接続断など）で次の確認までプライマリに切り替える
+    router = ReplicaRouter(replica, check_interval=60)
+    assert router.engine_for_read() is replica
+    with pytest.raises(Exception):
+        with Session(replica) as db:
+            db.execute(text("SELECT * FROM no_such_table"))
+    assert router.engine_for_read() is None
+
+
+def test_read_routes_use_replica_with_read_your_writes(db, replica, monkeypatch):
+    user = User(username="replica_user", password="x", email="replica@example.com", total_points=600)
+    db.add(user)
+    db.commit()
+    # レプリカには同じユーザーの古い状態がある
+    with Session(replica) as r:
+        r.add(User(id=user.id, username="replica_user", password="x", email="replica@example.com", total_points=7))
+        r.commit()
+    monkeypatch.setattr(database, "replica_router", ReplicaRouter(replica, sticky_seconds=5))
+
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess["user_id"] = user.id
+        assert client.get("/api/user/me").get_json()["total_points"] == 7
+
+        assert client.post("/api/redeem", json={"item_name": "エコバッグ", "cost": 100}).status_code == 200
+        # 書き込んだ直後は自分の書き込みが見えるようプライマリから読む
+        assert client.get("/api/user/me").get_json()["total_points"] == 500
+
+        with client.session_transaction() as sess:
+            sess[database.LAST_WRITE_SESSION_KEY] = time.time() - 60
+        assert client.get("/api/user/me").get_json()["total_points"] == 7
@@ -0,0 +1,155 @@
+from collections import Counter
+
+import pytest
+from sqlalchemy import func, select
+
+import database
+import points_ledger
+import user_service
+from app import app
+from database import create_database_engine
+from db_migration import upgrade
+from final_report import FinalReportGenerator, ShardedFinalReportGenerator
+from models import FoodLossRecord, PointsLedger, User, arrange_suggest
+from sharding import (
+    ShardRouter,
+    allocate_user_id,
+    parse_shard_urls,
+    rebalance,
+    register_user,
+    shard_status,
+    sync_user_id_allocator,
+    user_identity_reservations,
+)
+from synthetic_data import SyntheticDataGenerator, load_synthetic_data
+
+
+@pytest.fixture
+def shards(tmp_path):
+    engines = {}
+    for name in ("shard0", "shard1", "shard2"):
+        engines[name] = create_database_engine(f"sqlite:///{tmp_path}/{name}.db")
+        upgrade(engines[name])
+    router = ShardRouter(engines)
+    sync_user_id_allocator(router)
+    yield router
+    router.dispose()
+
+
+def count(engine, column):
+    with engine.connect() as conn:
+        return conn.execute(select(func.count(column))).scalar()
+
+
+def test_parse_shard_urls():
+    assert parse_shard_urls("a=sqlite:///a.db, b=sqlite:///b.db") == [("a", "sqlite:///a.db"), ("b", "sqlite:///b.db")]
+    assert parse_shard_urls("sqlite:///a.db,sqlite:///b.db") == [("shard0", "sqlite:///a.db"), ("shard1", "sqlite:///b.db")]
+
+
+def test_adding_a_shard_moves_only_its_share():
+    engines = {f"shard{i}": None for i in range(4)}
+    before = ShardRouter(dict(list(engines.items())[:3]))
+    after = ShardRouter(engines)
+    placement = Counter(before.shard_for(user_id) for user_id in range(1, 10001))
+    assert min(placement.values()) > 2500
+    moved = [user_id for user_id in range(1, 10001) if before.shard_for(user_id) != after.shard_for(user_id)]
+    # 移動するのは新しいシャードに割り当てられるユーザーだけ（約 1/4）
+    assert all(after.shard_for(user_id) == "shard3" for user_id in moved)
+    assert 1500 < len(moved) < 3500
+
+
+def test_rebalance_spreads_single_database_and_report_matches(shards):
+    # 既存の1台の DB（= 最初のシャード）のデータを分散する
+    home = shards.engines["shard0"]
+    load_synthetic_data(home, SyntheticDataGenerator(30, 3, records_per_week=4, seed=7))
+    db = shards.session("shard0")
+    for user_id in (1, 2, 3):
+        points_ledger.credit(db, user_id, 50 * user_id, points_ledger.ADJUSTMENT)
+    db.commit()
+    leftovers = {user_id: db.query(arrange_suggest).filter_by(user_id=user_id).count() for user_id in (1, 2, 3)}
+    db.close()
+    expected = FinalReportGenerator(shards.session("shard0")).generate_complete_report()
+    records = count(home, FoodLossRecord.id)
+
+    assert rebalance(shards, dry_run=True)["moves"]
+    assert count(home, User.id) == 30
+    result = rebalance(shards)
+    assert sum(counts["users"] for counts in result["moves"].values()) == sum(
+        1 for user_id in range(1, 31) if shards.shard_for(user_id) != "shard0"
+    )
+
+    status = shard_status(shards)
+    assert sum(s["users"] for s in status.values()) == 30
+    assert all(s["misplaced"] == 0 and s["users"] > 0 for s in status.values())
+    assert sum(count(engine, FoodLossRecord.id) for engine in shards.engines.values()) == records
+    for user_id in (1, 2, 3):
+        db = shards.session_for(user_id)
+        assert db.get(User, user_id).total_points == 50 * user_id
+        assert db.query(PointsLedger).filter_by(user_id=user_id).count() == 1
+        assert db.query(arrange_suggest).filter_by(user_id=user_id).count() == leftovers[user_id]
+        db.close()
+    # 再実行しても何も移動しない
+    assert rebalance(shards)["moves"] == {}
+
+    report = ShardedFinalReportGenerator(shards).generate_complete_report()
+    for section in ("reason_analysis", "timeline_analysis", "overall_summary", "weekly_comparison", "improvement_analysis"):
+        assert report[section] == expected[section]
+    assert sorted(report["user_statistics"], key=lambda u: u["username"]) == sorted(
+        expected["user_statistics"], key=lambda u: u["username"]
+    )
+    assert report["top_performers"]["top_points_earners"][:3] == expected["top_performers"]["top_points_earners"][:3]
+
+
+def test_app_routes_users_to_their_shard(shards, monkeypatch):
+    monkeypatch.setattr(database, "shard_router", shards)
+    with app.test_client() as client:
+        for name in ("shard_a", "shard_b", "shard_c", "shard_d"):
+            response = client.post(
+                "/api/register_user", json={"username": name, "email": f"{name}@example.com", "password": "password123"}
+            )
+            assert response.status_code == 201
+        user_id = response.get_json()["user_id"]
+        assert client.post(
+            "/api/register_user", json={"username": "shard_a", "email": "other@example.com", "password": "password123"}
+        ).status_code == 500
+
+        client.post("/login", data={"username": "shard_d", "password": "password123"})
+        with client.session_transaction() as sess:
+            assert sess["user_id"] == user_id
+        response = client.post(
+            "/api/add_loss_record", json={"item_name": "ご飯", "weight_grams": 120, "reason_text": "食べ残し"}
+        )
+        assert response.status_code == 201
+        assert client.get("/api/user/me").get_json()["username"] == "shard_d"
+
+    owner = shards.shard_for(user_id)
+    for name, engine in shards.engines.items():
+        assert count(engine, FoodLossRecord.id) == (1 if name == owner else 0)
+    assert sum(count(engine, User.id) for engine in shards.engines.values()) == 4
+
+
+def test_usernames_and_emails_are_reserved_across_shards(shards, monkeypatch):
+    # 導入前からいるユーザーは init（sync_user_id_allocator）で予約される
+    load_synthetic_data(shards.engines["shard0"], SyntheticDataGenerator(3, 1, seed=5))
+    sync_user_id_allocator(shards)
+    assert count(shards.engines["shard0"], user_identity_reservations.c.user_id) == 3
+    existing = shards.session("shard0").get(User, 1)
+    with pytest.raises(ValueError):
+        register_user(shards, existing.username, "new@example.com", "password123")
+
+    # 別のシャードに入るユーザー同士でも、予約の一意制約で重複を防ぐ（確認と登録の間に割り込まれない）
+    first = allocate_user_id(shards, "racer", "racer1@example.com")
+    with pytest.raises(ValueError):
+        allocate_user_id(shards, "racer2", "racer1@example.com")
+    assert allocate_user_id(shards, "racer2", "racer2@example.com") > first
+
+    # シャードへの登録に失敗した場合は予約を取り消す
+    def fail(*args, **kwargs):
+        raise RuntimeError("shard down")
+
+    with monkeypatch.context() as m:
+        m.setattr(user_service, "register_new_user", fail)
+        with pytest.raises(RuntimeError):
+            register_user(shards, "fresh", "fresh@example.com", "password123")
+    user_id = register_user(shards, "fresh", "fresh@example.com", "password123")
+    assert shards.session_for(user_id).get(User, user_id).username == "fresh"
@@ -0,0 +1,41 @@
+from sqlalchemy import create_engine, text
+
+from sql_instrumentation import (
+    collect_queries,
+    install_query_listeners,
+    normalize_statement,
+)
+
+
+def test_normalize_statement_collapses_literals_and_in_lists():
+    a = normalize_statement("SELECT * FROM users WHERE id = 1 AND name = 'a'")
+    b = normalize_statement("SELECT *  FROM users WHERE id = 42 AND name = 'bob'")
+    assert a == b
+
+    c = normalize_statement("SELECT * FROM t WHERE id IN (1, 2, 3)")
+    d = normalize_statement("SELECT * FROM t WHERE id IN (?)")
+    assert c == d
+
+
+def test_collect_queries_counts_and_flags_repeated_shapes():
+    engine = create_engine("sqlite://")
+    install_query_listeners(engine)
+    # 二重登録しても1回しか計測されない
+    install_query_listeners(engine)
+
+    with engine.connect() as conn:
+        with collect_queries("test") as stats:
+            for i in range(6):
+                conn.execute(text("SELECT :x"), {"x": i})
+            conn.execute(text("SELECT 1, 2"))
+
+    assert stats.count == 7
+    assert stats.total_time >= stats.slowest_time > 0
+    candidates = stats.repeated_shapes(threshold=5)
+    assert len(candidates) == 1
+    assert candidates[0]["count"] == 6
+
+    # ブロック外のクエリは集計されない
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    assert stats.count == 7
@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta
+
+import statistics
+from models import FoodLossRecord, LossReason, User
+
+TODAY = datetime(2026, 10, 14, 12, 0)
+
+
+def test_rolling_weekly_totals_match_total_grams_for_weeks(db):
+    user = User(username="rolling_user", email="rolling_user@example.com", password="x")
+    db.add(user)
+    db.flush()
+    reason = db.query(LossReason).filter_by(reason_text="食べ残し").one()
+    # 各週の境界ちょうど（today - k週）と週の途中に記録を置く
+    dates = [TODAY - timedelta(weeks=k) for k in range(6)]
+    dates += [TODAY - timedelta(weeks=k, days=3) for k in range(5)]
+    dates.append(TODAY + timedelta(days=1))
+    db.add_all(
+        [
+            FoodLossRecord(
+                user_id=user.id,
+                item_name="ごはん",
+                weight_grams=float(10 + i),
+                loss_reason_id=reason.id,
+                record_date=record_date.isoformat(),
+            )
+            for i, record_date in enumerate(dates)
+        ]
+    )
+    db.flush()
+
+    weeks = 5
+    totals = statistics.get_rolling_weekly_totals(db, user.id, weeks, today=TODAY)
+    assert len(totals) == weeks
+    for i, total in enumerate(totals):
+        expected = statistics.get_total_grams_for_weeks(
+            db, user.id, i + 1, today=TODAY
+        ) - statistics.get_total_grams_for_weeks(db, user.id, i, today=TODAY)
+        assert total == expected
+    # 境界ちょうどの記録は新しい側の週に入る
+    assert totals[0] == (10 + 1) + (10 + 6)
@@ -0,0 +1,38 @@
+from datetime import date
+
+from sqlalchemy import create_engine, text
+
+from synthetic_data import REASON_WEIGHTS, SyntheticDataGenerator, bulk_insert
+
+REASON_IDS = {reason: i + 1 for i, reason in enumerate(REASON_WEIGHTS)}
+
+
+def _rows(seed, users=20):
+    generator = SyntheticDataGenerator(users, 4, seed=seed, end_date=date(2025, 1, 31))
+    return list(generator.record_rows(1, 1, REASON_IDS))
+
+
+def test_generator_is_deterministic_per_seed():
+    assert _rows(1) == _rows(1)
+    assert _rows(1) != _rows(2)
+    # ユーザーを増やしても既存ユーザーの記録は変わらない
+    fewer = [row for row, _ in _rows(1, users=10)]
+    more = [row for row, _ in _rows(1, users=20)][: len(fewer)]
+    assert fewer == more
+
+
+def test_generated_records_stay_in_range():
+    rows = [row for row, _ in _rows(3)]
+    assert rows
+    assert all(5.0 <= row[3] <= 3000.0 for row in rows)
+    assert all("2025-01-03" <= row[5][:10] < "2025-01-31" for row in rows)
+    assert [row[0] for row in rows] == list(range(1, len(rows) + 1))
+
+
+def test_bulk_insert_executemany():
+    engine = create_engine("sqlite://")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT)"))
+        count = bulk_insert(connection, "t", ("id", "name"), ((i, f"n{i}") for i in range(25)), chunk_size=10)
+        assert count == 25
+        assert connection.execute(text("SELECT COUNT(*) FROM t")).scalar() == 25
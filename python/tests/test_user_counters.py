@@ -0,0 +1,75 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy.orm import Session
+
+import clock
+from archive import archive_records
+from database import create_database_engine
+from db_migration import upgrade
+from models import User
+from services import add_new_loss_record_direct, add_test_loss_records
+from synthetic_data import SyntheticDataGenerator, load_synthetic_data
+from user_counters import backfill, compute_counters, verify
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_database_engine(f"sqlite:///{tmp_path}/app.db")
+    upgrade(engine)
+    load_synthetic_data(engine, SyntheticDataGenerator(8, 14, records_per_week=4, seed=11))
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+def _counters(db, user_id):
+    user = db.get(User, user_id, populate_existing=True)
+    return (user.record_count, user.total_grams, user.first_record_date, user.last_record_date, user.participation_days)
+
+
+def test_synthetic_load_and_archive_keep_counters(db):
+    assert verify(db) == []
+    assert db.get(User, 1).record_count > 0
+    archive_records(db, horizon_weeks=9)
+    assert verify(db) == []
+
+
+def test_added_records_update_counters(db):
+    count, grams, first, last, days = _counters(db, 1)
+    # 記録のない未来の日に2件追加すると、参加日数は1日だけ増える
+    with clock.use_clock(lambda: datetime(2099, 1, 5, 9, 0)):
+        add_new_loss_record_direct(db, {"user_id": 1, "item_name": "パン", "weight_grams": 120.5, "reason_text": "期限切れ"})
+        add_new_loss_record_direct(db, {"user_id": 1, "item_name": "ご飯", "weight_grams": 80, "reason_text": "食べ残し"})
+    assert _counters(db, 1) == (count + 2, pytest.approx(grams + 200.5), first, "2099-01-05", days + 1)
+    assert verify(db) == []
+
+
+def test_verify_detects_and_fixes_drift(db):
+    db.query(User).filter(User.id.in_([2, 3])).update({User.record_count: User.record_count + 5, User.participation_days: 0})
+    db.commit()
+    drifts = verify(db)
+    assert [drift["user_id"] for drift in drifts] == [2, 3]
+    assert set(drifts[0]["columns"]) == {"record_count", "participation_days"}
+
+    assert len(verify(db, fix=True)) == 2
+    assert verify(db) == []
+    assert _counters(db, 2)[0] == compute_counters(db, [2])[2]["record_count"]
+
+    # 記録のないユーザーは 0 に戻す
+    db.add(User(username="empty", password="x", email="empty@example.com", record_count=3))
+    db.commit()
+    assert backfill(db) == 9
+    db.commit()
+    assert verify(db) == []
+
+
+def test_batch_of_records_counts_each_day_once(db):
+    db.add(User(username="batch", password="x", email="batch@example.com"))
+    db.commit()
+    user_id = db.query(User.id).filter_by(username="batch").scalar()
+    # 1週間前に2件、今日に1件
+    with clock.use_clock(lambda: datetime(2099, 1, 14, 9, 0)):
+        assert add_test_loss_records(db, user_id)
+    assert _counters(db, user_id)[0::4] == (3, 2)
+    assert verify(db) == []
@@ -1,34 +1,58 @@
 import pytest
 from app import app
-from database import SessionLocal
-from models import User
+from auth_service import generate_password_hash
+from models import FoodLossRecord, LossReason, User
+
+PASSWORD = "weekly-stats-pass"
 
 
 @pytest.fixture
-def client():
+def client(db):
     with app.test_client() as client:
         yield client
 
 
-def login_client(client, username):
-    return client.post("/login", data={"username": username}, follow_redirects=True)
-
+@pytest.fixture
+def user_with_records(db):
+    user = User(
+        username="weekly_stats_user",
+        email="weekly_stats_user@example.com",
+        password=generate_password_hash(PASSWORD),
+    )
+    db.add(user)
+    db.flush()
+    reason = db.query(LossReason).filter_by(reason_text="食べ残し").one()
+    db.add_all(
+        [
+            FoodLossRecord(
+                user_id=user.id,
+                item_name="カレー",
+                weight_grams=120.0,
+                loss_reason_id=reason.id,
+                record_date="2025-12-17T19:00:00",
+            ),
+            FoodLossRecord(
+                user_id=user.id,
+                item_name="サラダ",
+                weight_grams=40.5,
+                loss_reason_id=reason.id,
+                record_date="2025-12-18T12:30:00",
+            ),
+        ]
+    )
+    db.commit()
+    return user
 
-def get_some_username():
-    db = SessionLocal()
-    try:
-        user = db.query(User).first()
-        return user.username if user else None
-    finally:
-        db.close()
 
+def login_client(client, username):
+    return client.post(
+        "/login", data={"username": username, "password": PASSWORD}, follow_redirects=True
+    )
 
-def test_weekly_stats_returns_data(client):
-    username = get_some_username()
-    assert username is not None, "No user in DB to test with"
 
+def test_weekly_stats_returns_data(client, user_with_records):
     # login
-    resp = login_client(client, username)
+    resp = login_client(client, user_with_records.username)
     assert resp.status_code == 200
 
     # request weekly stats for a date known to have data
@@ -38,15 +62,14 @@ def test_weekly_stats_returns_data(client):
     assert data is not None
     assert data.get("is_data_present") is True
     assert isinstance(data.get("dish_table"), list)
-    assert len(data.get("dish_table")) > 0
-
+    assert len(data.get("dish_table")) == 2
+    assert {row["reason"] for row in data["dish_table"]} == {"食べ残し"}
+    assert sum(day["total_grams"] for day in data["daily_graph_data"]) == 160.5
 
-def test_log_page_shows_table(client):
-    username = get_some_username()
-    assert username is not None, "No user in DB to test with"
 
+def test_log_page_shows_table(client, user_with_records):
     # login and fetch /log
-    login_resp = login_client(client, username)
+    login_resp = login_client(client, user_with_records.username)
     assert login_resp.status_code == 200
 
     log_resp = client.get("/log")
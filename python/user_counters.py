@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+ユーザーごとの記録の集計値（users の record_count など）
+
+/account・/api/user/me・final_report の利用者別統計は、記録を走査せずに users の列を読む。
+記録数・総廃棄量・最初と最後の記録日・参加日数は記録を追加・変更・削除するたびに
+1つの UPDATE で差分だけ更新する（record_added / record_updated / record_removed。複数件は add_records）。参加日数と記録日の判定には
+(user_id, record_date) のインデックスを使うため、記録数によらず一定の時間で済む。
+同じユーザーの同時の更新は points_ledger.lock_user で直列化すること。
+
+保管（archive.py）・月の切り離し（partitioning.py）では記録が日ごとの集計に移るだけのため、
+集計値は変わらない。記録と日ごとの集計から計算し直した値と一致しないユーザーは verify で検出する。
+
+ここの関数は commit しない（verify の fix を除く）。
+
+使用例:
+    python user_counters.py verify          # 集計値と記録を照合
+    python user_counters.py verify --fix    # 一致しない集計値を計算し直す
+    python user_counters.py backfill        # 全ユーザーの集計値を計算し直す
+"""
+import sys
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+import click
+from sqlalchemy import and_, bindparam, case, func, or_, select, union_all, update
+from sqlalchemy.orm import Session
+
+from archive import loss_rows
+from models import DailyLossSummary, FoodLossRecord, User
+from points_ledger import lock_user
+
+COUNTER_COLUMNS = ("record_count", "total_grams", "first_record_date", "last_record_date", "participation_days")
+VERIFY_CHUNK_SIZE = 1000
+# 加算を繰り返した total_grams と合計の丸め誤差はずれとみなさない
+GRAMS_TOLERANCE = 0.01
+
+EMPTY_COUNTERS = {
+    "record_count": 0,
+    "total_grams": 0.0,
+    "first_record_date": None,
+    "last_record_date": None,
+    "participation_days": 0,
+}
+
+
+def _next_day(day: str) -> str:
+    return (date.fromisoformat(day) + timedelta(days=1)).isoformat()
+
+
+def _has_other_entries(user_id: int, day: str, record_id: int):
+    """その日に、指定した記録以外の記録（または保管した記録の集計）があるか"""
+    other_records = select(FoodLossRecord.id).where(
+        FoodLossRecord.user_id == user_id,
+        FoodLossRecord.record_date >= day,
+        FoodLossRecord.record_date < _next_day(day),
+        FoodLossRecord.id != record_id,
+    ).exists()
+    archived_day = select(DailyLossSummary.id).where(
+        DailyLossSummary.user_id == user_id,
+        DailyLossSummary.day == day,
+    ).exists()
+    return or_(other_records, archived_day)
+
+
+def record_added(db: Session, record: FoodLossRecord) -> None:
+    """追加した記録（flush 済み）を記録したユーザーの集計値に加える"""
+    day = record.record_date[:10]
+    db.execute(
+        update(User)
+        .where(User.id == record.user_id)
+        .values(
+            record_count=User.record_count + 1,
+            total_grams=User.total_grams + record.weight_grams,
+            first_record_date=case(
+                (or_(User.first_record_date.is_(None), User.first_record_date > day), day),
+                else_=User.first_record_date,
+            ),
+            last_record_date=case(
+                (or_(User.last_record_date.is_(None), User.last_record_date < day), day),
+                else_=User.last_record_date,
+            ),
+            participation_days=User.participation_days
+            + case((_has_other_entries(record.user_id, day, record.id), 0), else_=1),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def add_records(db: Session, records: Iterable[FoodLossRecord]) -> None:
+    """記録を1件ずつ追加して集計値に加える
+
+    まとめて flush してから record_added を呼ぶと、同じ日の他の記録が既にあるものとして
+    参加日数が数えられないため、1件ごとに flush する。
+    """
+    for record in records:
+        db.add(record)
+        db.flush()
+        record_added(db, record)
+
+
+def record_updated(db: Session, user_id: int, grams_delta: float) -> None:
+    """記録の重量を変更した差分を集計値に加える（記録日は変わらない）"""
+    db.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(total_grams=User.total_grams + grams_delta)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _remaining_day(user_id: int, aggregate):
+    """記録と日ごとの集計に残っている最初（func.min）または最後（func.max）の日"""
+    days = union_all(
+        select(aggregate(func.substr(FoodLossRecord.record_date, 1, 10)).label("day")).where(
+            FoodLossRecord.user_id == user_id
+        ),
+        select(aggregate(DailyLossSummary.day).label("day")).where(DailyLossSummary.user_id == user_id),
+    ).subquery()
+    return select(aggregate(days.c.day)).scalar_subquery()
+
+
+def record_removed(db: Session, record: FoodLossRecord) -> None:
+    """削除した記録（flush 済み）を記録したユーザーの集計値から除く
+
+    その日の最後の記録だった場合は参加日数を減らし、最初・最後の記録日だった場合は
+    残りの記録から探し直す（(user_id, record_date) のインデックスの端を読むだけ）。
+    """
+    day = record.record_date[:10]
+    day_emptied = ~_has_other_entries(record.user_id, day, record.id)
+    db.execute(
+        update(User)
+        .where(User.id == record.user_id)
+        .values(
+            record_count=User.record_count - 1,
+            total_grams=User.total_grams - record.weight_grams,
+            first_record_date=case(
+                (and_(User.first_record_date == day, day_emptied), _remaining_day(record.user_id, func.min)),
+                else_=User.first_record_date,
+            ),
+            last_record_date=case(
+                (and_(User.last_record_date == day, day_emptied), _remaining_day(record.user_id, func.max)),
+                else_=User.last_record_date,
+            ),
+            participation_days=User.participation_days - case((day_emptied, 1), else_=0),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def compute_counters(db, user_ids: Optional[Iterable[int]] = None) -> Dict[int, Dict[str, Any]]:
+    """記録と日ごとの集計から計算した集計値（記録のないユーザーは含まない）"""
+    rows = loss_rows()
+    query = select(
+        rows.c.user_id,
+        func.sum(rows.c.records),
+        func.sum(rows.c.grams),
+        func.min(rows.c.day),
+        func.max(rows.c.day),
+        func.count(func.distinct(rows.c.day)),
+    ).group_by(rows.c.user_id)
+    if user_ids is not None:
+        query = query.where(rows.c.user_id.in_(list(user_ids)))
+    return {
+        user_id: dict(zip(COUNTER_COLUMNS, (int(count), float(grams), first, last, int(days))))
+        for user_id, count, grams, first, last, days in db.execute(query)
+    }
+
+
+def _differs(column: str, cached, actual) -> bool:
+    if column == "total_grams":
+        return abs((cached or 0) - actual) > GRAMS_TOLERANCE
+    return cached != actual
+
+
+def _set_counters(db, counters: Dict[int, Dict[str, Any]]) -> None:
+    if not counters:
+        return
+    db.execute(
+        update(User.__table__)
+        .where(User.__table__.c.id == bindparam("uid"))
+        .values({column: bindparam(column) for column in COUNTER_COLUMNS}),
+        [{"uid": user_id, **values} for user_id, values in counters.items()],
+    )
+
+
+def backfill(conn, chunk_size: int = VERIFY_CHUNK_SIZE) -> int:
+    """全ユーザーの集計値を記録から計算し直す（列の追加時・合成データの投入後用）。更新した人数を返す"""
+    user_ids = [row[0] for row in conn.execute(select(User.id).order_by(User.id))]
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        computed = compute_counters(conn, chunk)
+        _set_counters(conn, {user_id: computed.get(user_id, EMPTY_COUNTERS) for user_id in chunk})
+    return len(user_ids)
+
+
+def verify(db: Session, fix: bool = False, chunk_size: int = VERIFY_CHUNK_SIZE) -> List[Dict[str, Any]]:
+    """集計値が記録と一致しないユーザーを返す（fix=True なら計算し直して保存する）"""
+    drifts = []
+    last_id = 0
+    while True:
+        users = db.execute(
+            select(User.id, *(getattr(User, column) for column in COUNTER_COLUMNS))
+            .where(User.id > last_id)
+            .order_by(User.id)
+            .limit(chunk_size)
+        ).all()
+        if not users:
+            break
+        last_id = users[-1][0]
+        computed = compute_counters(db, [row[0] for row in users])
+        for user_id, *cached in users:
+            actual = computed.get(user_id, EMPTY_COUNTERS)
+            columns = {
+                column: {"cached": value, "actual": actual[column]}
+                for column, value in zip(COUNTER_COLUMNS, cached)
+                if _differs(column, value, actual[column])
+            }
+            if columns:
+                drifts.append({"user_id": user_id, "columns": columns})
+    db.rollback()
+
+    if fix:
+        # 照合の後に記録が追加されていることがあるため、ロックを取ってから計算し直す
+        for drift in drifts:
+            user_id = drift["user_id"]
+            lock_user(db, user_id)
+            _set_counters(db, {user_id: compute_counters(db, [user_id]).get(user_id, EMPTY_COUNTERS)})
+            db.commit()
+    return drifts
+
+
+def _format(value) -> str:
+    return f"{value:.2f}" if isinstance(value, float) else str(value)
+
+
+@click.group()
+def cli():
+    """ユーザーごとの記録の集計値の管理ツール"""
+    pass
+
+
+@cli.command("verify")
+@click.option("--fix", is_flag=True, help="一致しない集計値を記録から計算し直す")
+def verify_command(fix):
+    """users の集計値を記録と照合する（ずれがあれば終了コード 1）"""
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        drifts = verify(db, fix=fix)
+    finally:
+        db.close()
+
+    for drift in drifts:
+        details = ", ".join(
+            f"{column} {_format(values['cached'])} / {_format(values['actual'])}"
+            for column, values in drift["columns"].items()
+        )
+        click.echo(f"user_id={drift['user_id']}: {details}（集計値 / 記録）")
+    if not drifts:
+        click.echo("✓ すべてのユーザーの集計値が記録と一致しています")
+    elif fix:
+        click.echo(f"✓ {len(drifts)} 人の集計値を記録から計算し直しました")
+    else:
+        click.echo(f"✗ {len(drifts)} 人の集計値が記録と一致しません（--fix で修正）")
+        sys.exit(1)
+
+
+@cli.command("backfill")
+def backfill_command():
+    """全ユーザーの集計値を記録から計算し直す"""
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        count = backfill(db)
+        db.commit()
+    finally:
+        db.close()
+    click.echo(f"✓ {count} 人の集計値を計算し直しました")
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,6 +1,7 @@
 # user_service.py
 from sqlalchemy.orm import Session
 from models import User
+import points_ledger
 import hashlib
 from typing import Optional, Dict, Any
 
@@ -33,6 +34,12 @@ def get_user_profile(db: Session, user_id: int) -> Optional[Dict[str, Any]]:
             "username": user.username,
             "email": user.email,
             "total_points": user.total_points,
+            # 記録の集計値（user_counters.py が記録の追加・変更・削除のたびに更新する）
+            "record_count": user.record_count,
+            "total_grams": round(user.total_grams, 2),
+            "first_record_date": user.first_record_date,
+            "last_record_date": user.last_record_date,
+            "participation_days": user.participation_days,
             # 必要に応じて address や family_size などの情報を追加
         }
     return None
@@ -41,9 +48,9 @@ def get_user_profile(db: Session, user_id: int) -> Optional[Dict[str, Any]]:
 # --- ユーザーデータの作成と更新 ---
 
 
-def register_new_user(db: Session, username: str, email: str, password: str) -> int:
+def register_new_user(db: Session, username: str, email: str, password: str, user_id: Optional[int] = None) -> int:
     """
-    新しいユーザーをデータベースに登録する。
+    新しいユーザーをデータベースに登録する。（user_id はシャーディング時に採番済みの ID）
     """
     # パスワード長さのバリデーション
     if len(password) < 8:
@@ -61,6 +68,7 @@ def register_new_user(db: Session, username: str, email: str, password: str) ->
     hashed_password = hashlib.sha256(password.encode()).hexdigest()
 
     new_user = User(
+        id=user_id,
         username=username,
         email=email,
         password=hashed_password,
@@ -78,11 +86,10 @@ def register_new_user(db: Session, username: str, email: str, password: str) ->
 
 def update_user_points(db: Session, user_id: int, points_to_add: int) -> bool:
     """
-    ユーザーの合計ポイントを更新する。
+    ユーザーの合計ポイントを更新する。（台帳に調整として記録する）
     """
-    user = db.query(User).get(user_id)
-    if user:
-        user.total_points += points_to_add
+    entry = points_ledger.credit(db, user_id, points_to_add, points_ledger.ADJUSTMENT)
+    if entry:
         db.commit()
         return True
     return False